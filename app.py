@@ -1,21 +1,48 @@
 from flask import (
-    Flask, render_template, request, jsonify, session, redirect, url_for, flash
+    Flask, render_template, request, jsonify, session, redirect, url_for, flash, g,
+    Response, stream_with_context
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 import psycopg2
 import psycopg2.extras # For dictionary cursors
-import json # Not explicitly used in this snippet, but often useful
+import json
+import csv
+import io
+import zlib
+import hashlib
 import os
-from datetime import datetime, date
+import time
+from datetime import datetime, date, timedelta, timezone
 import logging
 from collections import defaultdict # Not explicitly used, but can be handy
 from functools import wraps
 
+import click
+
+import assets
+import db
+import hashing
+import ingest
+import metrics
+import migrate
+import partitions
+import replica
+import report_cache
+import reports
+import rollups
+import shop_stats
+import storage
+from cache import LRUCache
+
 app = Flask(__name__)
 
 # !!! IMPORTANT: Set a strong, random secret key for session security !!!
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', b'_5#y2L"F4Q8z\n\xec]/' ) 
 
+# --- Static Assets ---
+# Templates link static files through asset_url(), which returns fingerprinted,
+# immutable-cached /assets/... URLs (see assets.py).
+assets.init_app(app)
+
 # --- Database Configuration ---
 DB_NAME = os.environ.get('DB_NAME', "coffee_tracker_db")
 DB_USER = os.environ.get('DB_USER', "postgres") 
@@ -23,20 +50,208 @@ DB_PASSWORD = os.environ.get('DB_PASSWORD', "postgres")
 DB_HOST = os.environ.get('DB_HOST', "localhost")
 DB_PORT = os.environ.get('DB_PORT', "5432")
 
+db.configure(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
+             connection_factory=metrics.InstrumentedConnection)
+
+def checkout_timed():
+    """db.checkout(), with the wait recorded against the current request."""
+    started = time.perf_counter()
+    try:
+        return db.checkout()
+    finally:
+        metrics.record_checkout(time.perf_counter() - started)
+
 def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
+    """Checks out a pooled connection; conn.close() returns it to the pool."""
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        return conn
+        conn = checkout_timed()
     except psycopg2.Error as e:
         logging.error(f"Error connecting to PostgreSQL database: {e}")
         raise
+    g.setdefault('db_connections', []).append(conn)
+    return conn
+
+# --- Read Replica ---
+# DB_REPLICA_DSN enables it (see replica.py). Routes marked @replica_reads send
+# their report reads there while it is up, within REPLICA_MAX_LAG and has
+# replayed the user's last data write; everything else uses the primary.
+read_router = replica.from_env(connection_factory=metrics.InstrumentedConnection)
+write_positions = replica.WritePositions(replica.REPLICA_POSITIONS_PATH) if read_router is not None else None
+
+def remember_write_position(conn, user_ids):
+    """Records the primary's WAL position for users whose data was just committed on conn."""
+    try:
+        lsn = replica.primary_lsn(conn)
+    except psycopg2.Error as e:
+        logging.warning(f"Could not read the primary WAL position after a write: {e}")
+        return
+    for user_id in user_ids:
+        write_positions.record(user_id, lsn)
+
+def get_read_connection():
+    """A replica connection when this request was routed to it, else get_db_connection()."""
+    if g.get('read_replica'):
+        started = time.perf_counter()
+        try:
+            conn = db.checkout_replica()
+        except psycopg2.Error as e:
+            read_router.mark_down(e)
+            g.read_replica = False
+        else:
+            g.setdefault('db_connections', []).append(conn)
+            return conn
+        finally:
+            metrics.record_checkout(time.perf_counter() - started)
+    return get_db_connection()
+
+# Routes read and write through repo (see storage.py); STORAGE_BACKEND=sqlite
+# runs them without a Postgres server.
+repo = storage.from_config(connect=get_db_connection, connect_read=get_read_connection,
+                           on_data_write=remember_write_position if read_router is not None else None)
+
+def postgres_only(f):
+    """501 for routes that still talk to Postgres directly (bulk import, export)."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if repo.backend != "postgres":
+            return jsonify({"error": f"Not supported by the {repo.backend} storage backend."}), 501
+        return f(*args, **kwargs)
+    return decorated_function
+
+def replica_reads(f):
+    """Lets a read-only route's report queries go to the read replica.
+
+    Apply below @login_required and above @etag_by_user_version so the ETag's
+    data version is read from the same server as the body. If the replica
+    fails mid-request the route is run again on the primary. Either way the
+    request counts as one "down" fallback, recorded here only.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if read_router is None or repo.backend != "postgres":
+            return f(*args, **kwargs)
+        routed = g.read_replica = read_router.choose(write_positions.get(session['user_id']))
+        response = app.make_response(f(*args, **kwargs))
+        if g.read_replica and response.status_code >= 500:
+            read_router.mark_down("query failed on the replica")
+            g.read_replica = False
+            response = app.make_response(f(*args, **kwargs))
+        if routed and not g.read_replica:
+            read_router.record_fallback("down")
+        return response
+    return decorated_function
+
+@app.teardown_appcontext
+def release_db_connections(exc):
+    """Safety net: hand back any connection a route forgot to close."""
+    for conn in g.pop('db_connections', []):
+        if not conn.returned:
+            conn.close()
+
+@app.route("/health/db", methods=['GET'])
+def db_pool_health():
+    """Pool statistics (in-use, idle, waiting, checkout latency) for monitoring."""
+    if repo.backend != "postgres":
+        return jsonify({"backend": repo.backend})
+    stats = db.get_pool().stats()
+    if read_router is not None:
+        stats["replica"] = {**read_router.stats(), "pool": db.get_replica_pool().stats()}
+    return jsonify(stats)
+
+@app.route("/health/report-cache", methods=['GET'])
+def report_cache_health():
+    """Report result cache counters and sizes (this worker process)."""
+    return jsonify(report_result_cache.stats())
+
+@app.route("/health/hashing", methods=['GET'])
+def password_hashing_health():
+    """Password hashing pool occupancy and rejection count."""
+    return jsonify(hashing.stats())
+
+# --- Request Metrics ---
+# Every request is timed per route (url rule, not raw path, to bound label
+# cardinality) along with its SQL count/time and pool wait; see metrics.py.
+# SERVER_TIMING=1 also reports the breakdown to the client.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', "0") == "1"
+
+@app.before_request
+def start_request_timing():
+    g.metrics_token = metrics.begin_request()
+
+@app.after_request
+def finish_request_timing(response):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        route = request.url_rule.rule if request.url_rule else None
+        timing = metrics.end_request(token, request.method, route, response.status_code)
+        if SERVER_TIMING and timing is not None:
+            response.headers['Server-Timing'] = timing.server_timing()
+    return response
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (this worker process only)."""
+    hasher = hashing.stats()
+    gauges = {
+        "coffee_password_hash_pending": ("Password hash jobs in flight.", hasher['pending']),
+        "coffee_password_hash_rejected": ("Logins rejected because hashing was saturated.", hasher['rejected']),
+        "coffee_user_cache_size": ("Cached user profiles.", user_profile_cache.stats()['size']),
+    }
+    if repo.backend == "postgres":
+        pool = db.get_pool().stats()
+        gauges.update({
+            "coffee_db_pool_in_use": ("Pooled connections checked out.", pool['in_use']),
+            "coffee_db_pool_idle": ("Pooled connections idle.", pool['idle']),
+            "coffee_db_pool_waiting": ("Requests waiting for a pooled connection.", pool['waiting']),
+            "coffee_db_pool_timeouts": ("Checkouts that timed out since start.", pool['timeouts']),
+        })
+    counters, histograms = {}, {}
+    if read_router is not None:
+        routing = read_router.stats()
+        counters["coffee_replica_reads_total"] = ("Report requests served from the read replica.",
+                                                  routing['routed_to_replica'])
+        for reason, count in routing['fallbacks'].items():
+            counters[f"coffee_replica_fallback_{reason}_total"] = (
+                f"Report requests sent to the primary because of replica {reason.replace('_', '-')}.", count)
+        gauges["coffee_replica_lag_seconds"] = ("Last sampled replica replay lag.", routing['lag_seconds'] or 0)
+    results = report_result_cache.stats()
+    counters.update({
+        "coffee_report_cache_hits_total": ("Report results served from the cache.", results['hits']),
+        "coffee_report_cache_misses_total": ("Report results computed.", results['misses']),
+        "coffee_report_cache_revalidations_total": ("Cache hits checked against the change feed after a write.",
+                                                    results['revalidated']),
+        "coffee_report_cache_invalidations_total": ("Cached results dropped because their period changed.",
+                                                    results['invalidated']),
+        "coffee_report_cache_evictions_total": ("Results evicted from the in-memory report cache.",
+                                                results['memory']['evictions']),
+    })
+    gauges["coffee_report_cache_size"] = ("Results in the in-memory report cache.", results['memory']['size'])
+    if results['shared'] is not None:
+        counters["coffee_report_cache_shared_hits_total"] = ("Lookups answered by the shared report cache file.",
+                                                             results['shared']['hits'])
+        counters["coffee_report_cache_shared_evictions_total"] = ("Results evicted from the shared report cache "
+                                                                  "file.", results['shared']['evictions'])
+        gauges["coffee_report_cache_shared_size"] = ("Results in the shared report cache file.",
+                                                     results['shared']['size'] or 0)
+    if shop_stats_refresher is not None:
+        refresher = shop_stats_refresher.stats()
+        counters["coffee_shop_stats_refreshes_total"] = ("Shop statistics views refreshed by this worker.",
+                                                         refresher['refreshes'])
+        counters["coffee_shop_stats_refresh_failures_total"] = ("Failed shop statistics refresh runs.",
+                                                                refresher['failures'])
+    committer = getattr(repo, 'group_committer', None)
+    if committer is not None:
+        batches = committer.stats()
+        counters.update({
+            "coffee_group_commit_commits_total": ("Group-commit transactions committed.", batches['commits']),
+            "coffee_group_commit_rows_total": ("Entries written through group commit.", batches['rows']),
+            "coffee_group_commit_failed_batches_total": ("Batches rolled back and retried row by row.",
+                                                         batches['failed_batches']),
+        })
+        gauges["coffee_group_commit_queued"] = ("Inserts waiting for the next batch.", batches['queued'])
+        histograms = {"coffee_group_commit_batch_size": ("Rows per group-commit transaction.",
+                                                         committer.batch_size_histogram())}
+    return Response(metrics.render(gauges, counters, histograms), mimetype='text/plain; version=0.0.4')
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO)
@@ -52,6 +267,38 @@ COFFEE_VOLUMES = { # in ml
     "Roma": 40, "Arpeggio": 40, "Livanto": 40, "Volluto Decaf": 90
 }
 
+# --- Per-User Settings Cache ---
+# Currency settings and custom prices are read on nearly every API call but only
+# change through user_settings (PUT) and user_coffee_prices_route (POST), which
+# invalidate the entry right after committing. The TTL bounds staleness across
+# worker processes, which each hold their own cache.
+user_profile_cache = LRUCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', "1024")),
+    ttl=float(os.environ.get('USER_CACHE_TTL', "300")),
+)
+
+def get_user_profile(user_id):
+    """Returns {'currency_code', 'currency_symbol', 'prices'} for a user, cached.
+
+    A cache miss costs one repository lookup (a single JOIN on Postgres).
+    """
+    profile = user_profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    profile = repo.user_profile(user_id)
+    if profile is None:
+        # Unknown user (e.g. deleted while a session is still alive); don't cache.
+        return {"currency_code": session.get('currency_code', 'EUR'),
+                "currency_symbol": session.get('currency_symbol', '€'), "prices": {}}
+    user_profile_cache.set(user_id, profile)
+    return profile
+
+def get_user_costs(user_id):
+    """Price to log for every known coffee type: the user's custom price or the default."""
+    prices = get_user_profile(user_id)['prices']
+    return {name: prices.get(name, default_cost) for name, default_cost in COFFEE_COSTS.items()}
+
 # --- Authentication Decorator ---
 def login_required(f):
     @wraps(f)
@@ -62,21 +309,58 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- Conditional GET Decorator ---
+def get_user_data_version(user_id):
+    """Current users.data_version, bumped by DB triggers on any entry/price/settings write."""
+    return repo.data_version(user_id)
+
+def compute_etag(user_id, version, full_path):
+    """Strong ETag for one user's view of a URL at a given data version."""
+    return hashlib.sha1(f"{user_id}:{version}:{full_path}".encode('utf-8')).hexdigest()
+
+def etag_by_user_version(f):
+    """Strong ETag / If-None-Match support for per-user GET endpoints.
+
+    The tag hashes the user's data version with the full request path and query,
+    so a 304 costs one primary-key lookup on users and never touches
+    coffee_entries. Must be applied below @login_required.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            version = get_user_data_version(session['user_id'])
+        except storage.StorageError as e:
+            logging.error(f"DB error reading data version for user {session['user_id']}: {e}")
+            version = None
+        if version is None:
+            return f(*args, **kwargs)
+        g.data_version = version  # Lets cached_report() skip revalidation while nothing changed.
+        digest = compute_etag(session['user_id'], version, request.full_path)
+        if digest in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(digest)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
+
 # --- Authentication Routes ---
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT id, username, password_hash, currency_code, currency_symbol FROM users WHERE username = %s", (username,))
-            user_record = cur.fetchone()
-            cur.close()
+            user_record = repo.find_user(username)
 
-            if user_record and check_password_hash(user_record['password_hash'], password):
+            if user_record and hashing.verify_password(user_record['password_hash'], password or ''):
+                if hashing.needs_rehash(user_record['password_hash']):
+                    # Transparent upgrade to the configured hash method/parameters.
+                    repo.set_password_hash(user_record['id'], hashing.hash_password(password))
+                    logging.info(f"Upgraded password hash for user '{user_record['username']}'.")
                 session['user_id'] = user_record['id']
                 session['logged_in_user'] = user_record['username']
                 # Store currency settings in session for easier access if needed, though fetching per request is safer for updates
@@ -88,14 +372,16 @@ def login():
                 return redirect(next_url or url_for('coffee_tracker_page'))
             else:
                 flash('Invalid username or password.', 'danger')
-        except psycopg2.Error as e:
+        except hashing.HasherBusy as e:
+            logging.warning(f"Rejected login, password hashing saturated: {e}")
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('login.html'), 503, {'Retry-After': '1'}
+        except storage.StorageError as e:
             logging.error(f"Database error during login: {e}")
             flash('A database error occurred. Please try again later.', 'danger')
         except Exception as e:
             logging.error(f"Unexpected error during login: {e}")
             flash('An unexpected error occurred. Please try again.', 'danger')
-        finally:
-            if conn: conn.close()
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -112,34 +398,28 @@ def register():
         if len(password) < 6: 
             flash('Password must be at least 6 characters long.', 'danger'); return render_template('register.html')
 
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-            if cur.fetchone():
-                flash('Username already exists.', 'warning'); cur.close(); return render_template('register.html')
+            if repo.find_user(username):
+                flash('Username already exists.', 'warning'); return render_template('register.html')
             
-            password_hash = generate_password_hash(password)
-            # New users get default currency settings from DB schema or explicitly here
-            cur.execute(
-                "INSERT INTO users (username, password_hash, currency_code, currency_symbol) VALUES (%s, %s, %s, %s)",
-                (username, password_hash, 'EUR', '€') # Explicit defaults
-            )
-            conn.commit()
-            cur.close()
+            password_hash = hashing.hash_password(password)
+            # New users get default currency settings explicitly here
+            if repo.create_user(username, password_hash, 'EUR', '€') is None:
+                # Taken by a concurrent registration since the check above.
+                flash('Username already exists.', 'warning'); return render_template('register.html')
             flash('Registration successful! Please log in.', 'success')
             logging.info(f"New user registered: {username}")
             return redirect(url_for('login'))
-        except psycopg2.Error as e:
-            if conn: conn.rollback()
+        except storage.StorageError as e:
             logging.error(f"Database error during registration: {e}")
             flash('A database error occurred.', 'danger')
+        except hashing.HasherBusy as e:
+            logging.warning(f"Rejected registration, password hashing saturated: {e}")
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('register.html'), 503, {'Retry-After': '1'}
         except Exception as e:
             logging.error(f"Unexpected error during registration: {e}")
             flash('An unexpected error occurred.', 'danger')
-        finally:
-            if conn: conn.close()
     return render_template('register.html')
 
 @app.route('/logout')
@@ -164,17 +444,10 @@ def coffee_tracker_page():
 @login_required
 def user_settings():
     user_id = session['user_id']
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
     if request.method == 'GET':
-        cur.execute("SELECT currency_code, currency_symbol FROM users WHERE id = %s", (user_id,))
-        settings = cur.fetchone()
-        cur.close()
-        conn.close()
-        if settings:
-            return jsonify(dict(settings))
-        return jsonify({"error": "Settings not found"}), 404
+        profile = get_user_profile(user_id)
+        return jsonify({"currency_code": profile['currency_code'], "currency_symbol": profile['currency_symbol']})
 
     if request.method == 'PUT':
         data = request.get_json()
@@ -182,262 +455,304 @@ def user_settings():
         new_symbol = data.get('currency_symbol', '')
 
         if not new_code or not new_symbol:
-            cur.close(); conn.close(); return jsonify({"error": "Currency code and symbol are required"}), 400
+            return jsonify({"error": "Currency code and symbol are required"}), 400
         if len(new_code) > 3 or len(new_symbol) > 5: # Basic validation
-            cur.close(); conn.close(); return jsonify({"error": "Invalid currency format"}), 400
-
-        cur.execute(
-            "UPDATE users SET currency_code = %s, currency_symbol = %s WHERE id = %s RETURNING currency_code, currency_symbol",
-            (new_code, new_symbol, user_id)
-        )
-        updated_settings = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
-        session['currency_code'] = updated_settings['currency_code'] # Update session
-        session['currency_symbol'] = updated_settings['currency_symbol']
+            return jsonify({"error": "Invalid currency format"}), 400
+
+        try:
+            updated_settings = repo.update_currency(user_id, new_code, new_symbol)
+        except storage.StorageError as e:
+            logging.error(f"DB error updating settings for user {user_id}: {e}")
+            return jsonify({"error": "Database error while updating settings"}), 500
+        if updated_settings is None:
+            return jsonify({"error": "User not found"}), 404
+        currency_code, currency_symbol = updated_settings
+        user_profile_cache.invalidate(user_id)
+        session['currency_code'] = currency_code # Update session
+        session['currency_symbol'] = currency_symbol
         logging.info(f"User {user_id} updated currency to {new_code} ({new_symbol}).")
         return jsonify({"message": "Settings updated successfully", 
-                        "currency_code": updated_settings['currency_code'], 
-                        "currency_symbol": updated_settings['currency_symbol']})
+                        "currency_code": currency_code, 
+                        "currency_symbol": currency_symbol})
 
 @app.route("/api/user/coffee_prices", methods=['GET', 'POST'])
 @login_required
 def user_coffee_prices_route(): # Renamed to avoid conflict with variable name
     user_id = session['user_id']
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
     if request.method == 'GET':
-        cur.execute("SELECT coffee_type, price FROM user_coffee_prices WHERE user_id = %s", (user_id,))
-        prices = {row['coffee_type']: float(row['price']) for row in cur.fetchall()}
-        cur.close()
-        conn.close()
-        return jsonify(prices)
+        return jsonify(get_user_profile(user_id)['prices'])
 
     if request.method == 'POST':
         custom_prices_data = request.get_json() 
         
-        # Using UPSERT for PostgreSQL to insert or update
-        # This is more efficient than DELETE then INSERT for many rows
-        sql_upsert_start = "INSERT INTO user_coffee_prices (user_id, coffee_type, price) VALUES "
-        sql_values_list = []
-        sql_params = []
-        
+        new_prices = {}
         for coffee_type, price_str in custom_prices_data.items():
             if coffee_type in COFFEE_COSTS: 
                 try:
                     price = float(price_str)
                     if price >= 0: # Allow 0 price, but not negative
-                        sql_values_list.append("(%s, %s, %s)")
-                        sql_params.extend([user_id, coffee_type, price])
+                        new_prices[coffee_type] = price
                     # If price is empty or invalid, it implies user wants to revert to default (handled by not inserting)
                 except (ValueError, TypeError):
                     logging.warning(f"Invalid price format for {coffee_type} by user {user_id}: {price_str}")
         
-        if sql_values_list:
-            # Clear only those types that are being updated or newly set. 
-            # Or, if a price is sent as empty/null, it means "delete my custom price for this".
-            # For simplicity in this example: we'll clear all user's prices and re-insert the valid ones.
-            # A more granular approach would be to handle deletions for empty strings.
-            cur.execute("DELETE FROM user_coffee_prices WHERE user_id = %s", (user_id,)) # Simple clear and re-add
-            
-            sql_upsert = sql_upsert_start + ", ".join(sql_values_list)
-            # The ON CONFLICT clause is for true UPSERT, but with DELETE first, it's just INSERT.
-            # sql_upsert += " ON CONFLICT (user_id, coffee_type) DO UPDATE SET price = EXCLUDED.price;"
-            # If not deleting first, the above ON CONFLICT is needed.
-            
-            cur.execute(sql_upsert, tuple(sql_params))
-        else: # If custom_prices_data was empty or all invalid, effectively clear all custom prices
-            cur.execute("DELETE FROM user_coffee_prices WHERE user_id = %s", (user_id,))
-
-
-        conn.commit()
-        cur.close()
-        conn.close()
+        # All of the user's prices are replaced by the valid ones sent; types left
+        # out (or an empty/all-invalid payload) fall back to the defaults.
+        try:
+            repo.replace_prices(user_id, new_prices)
+        except storage.StorageError as e:
+            logging.error(f"DB error updating coffee prices for user {user_id}: {e}")
+            return jsonify({"error": "Database error while updating prices"}), 500
+        user_profile_cache.invalidate(user_id)
         logging.info(f"User {user_id} updated custom coffee prices.")
         return jsonify({"message": "Custom coffee prices updated successfully"})
 
 # --- API Routes for Coffee Tracking ---
 @app.route("/api/coffee-types", methods=['GET'])
-@login_required 
+@login_required
+@etag_by_user_version
 def get_coffee_types_api(): # Renamed to avoid conflict
-    user_id = session['user_id']
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-    cur.execute("SELECT currency_code, currency_symbol FROM users WHERE id = %s", (user_id,))
-    user_settings = cur.fetchone()
-    user_currency_symbol = user_settings['currency_symbol'] if user_settings else session.get('currency_symbol', '€')
-
-    cur.execute("SELECT coffee_type, price FROM user_coffee_prices WHERE user_id = %s", (user_id,))
-    user_custom_prices = {row['coffee_type']: float(row['price']) for row in cur.fetchall()}
-    
-    cur.close()
-    conn.close()
+    return jsonify(coffee_type_catalog(get_user_profile(session['user_id'])))
 
+def coffee_type_catalog(profile):
+    """All coffee types priced for one user (custom price or global default)."""
     types_list = []
     for name, default_cost in COFFEE_COSTS.items():
-        cost = user_custom_prices.get(name, default_cost) 
+        cost = profile['prices'].get(name, default_cost)
         types_list.append({
             "name": name, 
             "cost": cost, 
             "volume": COFFEE_VOLUMES.get(name, 0),
-            "currency_symbol": user_currency_symbol 
+            "currency_symbol": profile['currency_symbol']
         })
-    return jsonify(types_list)
+    return types_list
+
+def fetch_day_log(user_id, entry_date, currency_symbol):
+    """The user's entries for one day, in display form, ordered by time."""
+    # Note: The 'cost' in DB is already in the user's currency at time of logging.
+    # For display consistency, we attach the current symbol.
+    return [{
+        "id": row["id"], 
+        "type": row["coffee_type"],
+        "time": row["entry_time"].strftime('%I:%M %p').lstrip('0'), 
+        "cost": row["cost"],
+        "currency_symbol": currency_symbol
+    } for row in repo.day_entries(user_id, entry_date)]
 
 @app.route("/api/coffees/<date_string>", methods=['GET', 'POST', 'DELETE'])
 @login_required
 def coffees_for_date_api(date_string): # Combined GET, POST, DELETE for day's log
+    if request.method == 'GET':
+        return etag_by_user_version(_coffees_for_date_api)(date_string)
+    return _coffees_for_date_api(date_string)
+
+def _coffees_for_date_api(date_string):
     try:
         entry_date = datetime.strptime(date_string, '%Y-%m-%d').date()
     except ValueError:
         return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
     
     user_id = session['user_id']
-    conn = get_db_connection() # Keep connection open for the duration of the request if possible
 
     if request.method == 'GET':
-        # ... (existing GET logic from previous version, ensure it uses DictCursor) ...
-        coffees_for_date = []
         try:
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute(
-                "SELECT id, coffee_type, entry_time, cost FROM coffee_entries "
-                "WHERE user_id = %s AND entry_date = %s ORDER BY entry_time",
-                (user_id, entry_date)
-            )
-            rows = cur.fetchall()
-            cur.close()
-            # Get user's current currency symbol to display with historical costs
-            # Note: The 'cost' in DB is already in the user's currency at time of logging.
-            # For display consistency, we can fetch the current symbol.
-            cur_symbol = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur_symbol.execute("SELECT currency_symbol FROM users WHERE id = %s", (user_id,))
-            user_currency_symbol = cur_symbol.fetchone()['currency_symbol']
-            cur_symbol.close()
-
-            for row in rows:
-                coffees_for_date.append({
-                    "id": row["id"], 
-                    "type": row["coffee_type"],
-                    "time": row["entry_time"].strftime('%I:%M %p').lstrip('0'), 
-                    "cost": float(row["cost"]),
-                    "currency_symbol": user_currency_symbol # Add current symbol for display
-                })
-        except psycopg2.Error as e:
+            user_currency_symbol = get_user_profile(user_id)['currency_symbol']
+            coffees_for_date = fetch_day_log(user_id, entry_date, user_currency_symbol)
+        except storage.StorageError as e:
             logging.error(f"DB error fetching coffees for date {date_string} for user {user_id}: {e}")
             return jsonify({"error": "Database error while fetching coffee entries"}), 500
-        finally:
-            if conn: conn.close()
         return jsonify(coffees_for_date)
 
     if request.method == 'POST':
         data = request.get_json()
         if not data or 'type' not in data or 'time' not in data:
-            conn.close(); return jsonify({"error": "Missing 'type' or 'time' in request."}), 400
+            return jsonify({"error": "Missing 'type' or 'time' in request."}), 400
 
         coffee_type = data['type']
         entry_time_str = data['time']
         
         if coffee_type not in COFFEE_COSTS:
-            conn.close(); return jsonify({"error": f"Unknown coffee type: {coffee_type}"}), 400
-
-        # Determine the cost for this user and coffee type
-        cur_cost = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur_cost.execute("SELECT price FROM user_coffee_prices WHERE user_id = %s AND coffee_type = %s", (user_id, coffee_type))
-        user_price_row = cur_cost.fetchone()
-        cur_cost.execute("SELECT currency_symbol FROM users WHERE id = %s", (user_id,)) # Get current symbol
-        user_currency_symbol = cur_cost.fetchone()['currency_symbol']
-        cur_cost.close() 
-        # Note: conn is still open from the main function body
-
-        cost_to_log = float(user_price_row['price']) if user_price_row else COFFEE_COSTS[coffee_type]
-        
+            return jsonify({"error": f"Unknown coffee type: {coffee_type}"}), 400
+
         try:
             entry_time_obj = datetime.strptime(entry_time_str, '%I:%M %p').time()
         except ValueError:
-            conn.close(); return jsonify({"error": "Invalid time format. Use HH:MM AM/PM."}), 400
+            return jsonify({"error": "Invalid time format. Use HH:MM AM/PM."}), 400
 
-        new_entry_id = None
         try:
-            cur_insert = conn.cursor()
-            cur_insert.execute(
-                "INSERT INTO coffee_entries (user_id, coffee_type, entry_date, entry_time, cost) "
-                "VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (user_id, coffee_type, entry_date, entry_time_obj, cost_to_log)
-            )
-            new_entry_id = cur_insert.fetchone()[0]
-            conn.commit()
-            cur_insert.close()
+            # Determine the cost for this user and coffee type (cached; no query on a hit)
+            profile = get_user_profile(user_id)
+            user_currency_symbol = profile['currency_symbol']
+            cost_to_log = profile['prices'].get(coffee_type, COFFEE_COSTS[coffee_type])
+            new_entry_id, day_count, day_total_cost = repo.add_entry(
+                user_id, coffee_type, entry_date, entry_time_obj, cost_to_log)
             logging.info(f"User {user_id} added coffee: {coffee_type} on {date_string} at {entry_time_str}, cost {cost_to_log}{user_currency_symbol}, ID: {new_entry_id}")
-            return jsonify({"id": new_entry_id, "type": coffee_type, "time": entry_time_str, "cost": cost_to_log, "currency_symbol": user_currency_symbol}), 201
-        except psycopg2.Error as e:
-            if conn: conn.rollback()
+            return jsonify({"id": new_entry_id, "type": coffee_type, "time": entry_time_str, "cost": cost_to_log, "currency_symbol": user_currency_symbol,
+                            "day_count": day_count, "day_total_cost": day_total_cost}), 201
+        except storage.WriteOutcomeUnknown as e:
+            logging.error(f"Outcome of adding coffee for user {user_id} unknown: {e}")
+            return jsonify({"error": "The coffee may or may not have been added; reload the day before retrying."}), 504
+        except storage.StorageError as e:
             logging.error(f"DB error adding coffee for user {user_id}: {e}")
             return jsonify({"error": "Database error while adding coffee"}), 500
-        finally:
-            if conn: conn.close()
             
     if request.method == 'DELETE': # This is for clearing the whole day
-        # ... (existing DELETE logic from previous version) ...
         try:
-            cur = conn.cursor()
-            cur.execute(
-                "DELETE FROM coffee_entries WHERE user_id = %s AND entry_date = %s",
-                (user_id, entry_date)
-            )
-            conn.commit()
-            rows_deleted = cur.rowcount
-            cur.close()
+            rows_deleted = repo.clear_day(user_id, entry_date)
             logging.info(f"User {user_id} cleared {rows_deleted} coffees for date {date_string}.")
-            return jsonify({"message": f"Coffees for {date_string} cleared successfully.", "deleted_count": rows_deleted}), 200
-        except psycopg2.Error as e:
-            if conn: conn.rollback()
+            return jsonify({"message": f"Coffees for {date_string} cleared successfully.", "deleted_count": rows_deleted,
+                            "day_count": 0, "day_total_cost": 0.0}), 200
+        except storage.StorageError as e:
             logging.error(f"DB error clearing coffees for user {user_id}: {e}")
             return jsonify({"error": "Database error while clearing coffees"}), 500
-        finally:
-            if conn: conn.close()
 
 
+BULK_MAX_ENTRIES = int(os.environ.get('BULK_MAX_ENTRIES', "10000"))
+
+@app.route("/api/coffees/bulk", methods=['POST'])
+@login_required
+@postgres_only
+def bulk_coffees_api():
+    """Adds many entries across many dates in one request.
+
+    Accepts {"entries": [{"date", "type", "time", "key"?}, ...]} or the legacy
+    coffee_log_BAK.json shape ({date: [{type, time}, ...]}). Entries with a key
+    (always the case for the legacy shape) are skipped if already imported for
+    that date.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('entries'), list):
+        raw_entries = data['entries']
+    elif isinstance(data, dict) and 'entries' not in data:
+        raw_entries = ingest.legacy_log_entries(data)
+    else:
+        return jsonify({"error": "Expected {'entries': [...]} or a legacy date-keyed log."}), 400
+    if not raw_entries:
+        return jsonify({"error": "No entries supplied."}), 400
+    if len(raw_entries) > BULK_MAX_ENTRIES:
+        return jsonify({"error": f"Too many entries; the limit is {BULK_MAX_ENTRIES} per request."}), 413
+
+    user_id = session['user_id']
+    conn = None
+    try:
+        conn = get_db_connection()
+        result = ingest.ingest_entries(conn, user_id, raw_entries, get_user_costs(user_id))
+        if result['inserted'] and read_router is not None:
+            remember_write_position(conn, [user_id])
+    except (psycopg2.Error, storage.StorageError) as e:
+        logging.error(f"DB error during bulk insert for user {user_id}: {e}")
+        return jsonify({"error": "Database error while adding coffees"}), 500
+    finally:
+        if conn: conn.close()
+    logging.info(f"User {user_id} bulk-added {result['inserted']} coffees "
+                 f"({result['skipped_duplicates']} duplicates, {len(result['errors'])} errors).")
+    return jsonify(result), 201 if result['inserted'] else 200
+
 @app.route("/api/coffee_entry/<int:entry_id>", methods=['DELETE'])
 @login_required
 def delete_coffee_entry_api(entry_id): # Renamed
     user_id = session['user_id']
-    conn = get_db_connection()
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "DELETE FROM coffee_entries WHERE id = %s AND user_id = %s",
-            (entry_id, user_id)
-        )
-        conn.commit()
-        rows_deleted = cur.rowcount
-        cur.close()
-        if rows_deleted == 0:
-            return jsonify({"error": "Entry not found or not authorized to delete."}), 404
-        logging.info(f"User {user_id} deleted coffee entry ID {entry_id}.")
-        return jsonify({"message": f"Coffee entry {entry_id} deleted successfully.", "deleted_id": entry_id}), 200
-    except psycopg2.Error as e:
-        if conn: conn.rollback()
+        deleted = repo.delete_entry(user_id, entry_id)
+    except storage.StorageError as e:
         logging.error(f"DB error deleting coffee entry ID {entry_id} for user {user_id}: {e}")
         return jsonify({"error": "Database error while deleting coffee entry"}), 500
-    finally:
-        if conn: conn.close()
+    if deleted is None:
+        return jsonify({"error": "Entry not found or not authorized to delete."}), 404
+    entry_date, day_count, day_total_cost = deleted
+    logging.info(f"User {user_id} deleted coffee entry ID {entry_id}.")
+    return jsonify({"message": f"Coffee entry {entry_id} deleted successfully.", "deleted_id": entry_id,
+                    "entry_date": entry_date.isoformat(), "day_count": day_count, "day_total_cost": day_total_cost}), 200
+
+# --- Change Feed ---
+# The tracker page caches day logs in IndexedDB and asks for the entry changes
+# after its cursor instead of re-downloading days (see migrations/0008).
+CHANGES_PAGE_SIZE = int(os.environ.get('CHANGES_PAGE_SIZE', "500"))
+CHANGE_RETENTION_DAYS = int(os.environ.get('CHANGE_RETENTION_DAYS', "90"))
+
+@app.route("/api/changes", methods=['GET'])
+@login_required
+def entry_changes_api():
+    """Entry inserts and deletes after ?since=<cursor>, oldest first.
+
+    Returns {cursor, reset, more, changes}. Without a cursor, or when it is too
+    old to answer, reset is true: the client drops its cached days and keeps
+    the returned cursor. more means another page is waiting.
+    """
+    since = request.args.get('since') or None
+    try:
+        cursor = int(since) if since is not None else None
+        limit = min(int(request.args.get('limit', CHANGES_PAGE_SIZE)), CHANGES_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "'since' and 'limit' must be integers."}), 400
+    if (cursor is not None and cursor < 0) or limit < 1:
+        return jsonify({"error": "'since' must be >= 0 and 'limit' >= 1."}), 400
+
+    user_id = session['user_id']
+    try:
+        changes, cursor, reset = repo.changes_since(user_id, cursor, limit)
+    except storage.StorageError as e:
+        logging.error(f"DB error reading the change feed for user {user_id}: {e}")
+        return jsonify({"error": "Database error while reading changes"}), 500
+    # Same display form as fetch_day_log, minus currency_symbol: cached entries
+    # are shown with the current symbol.
+    return jsonify({
+        "cursor": cursor, "reset": reset, "more": len(changes) == limit,
+        "changes": [{"op": "delete", "id": change['id'], "date": change['entry_date'].isoformat()}
+                    if change['op'] == 'delete' else
+                    {"op": "insert", "id": change['id'], "date": change['entry_date'].isoformat(),
+                     "type": change['coffee_type'], "time": change['entry_time'].strftime('%I:%M %p').lstrip('0'),
+                     "cost": change['cost']}
+                    for change in changes],
+    })
 
 # --- Report Routes ---
-def get_user_currency_symbol(user_id, db_conn):
+def get_user_currency_symbol(user_id):
     """Helper to get user's currency symbol."""
-    cur = db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute("SELECT currency_symbol FROM users WHERE id = %s", (user_id,))
-    settings = cur.fetchone()
-    cur.close()
-    return settings['currency_symbol'] if settings else session.get('currency_symbol', '€')
+    return get_user_profile(user_id)['currency_symbol']
+
+def period_bounds(year, month=None):
+    """Half-open [start, end) date range for a year or a single month.
+
+    Report queries compare entry_date/month against these bounds directly
+    (instead of EXTRACT(YEAR/MONTH FROM entry_date)) so an index can serve them.
+    """
+    if month is None:
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+def summarize_breakdown(rows, type_filter='All'):
+    """Turns repo.type_breakdown rows into the report's total/breakdown fields."""
+    overall_total_coffees = 0; overall_total_cost = 0.0; breakdown = {}
+    if type_filter == 'All':
+        for row in rows:
+            breakdown[row['coffee_type']] = {"count": row['count'], "cost": float(row['total_cost'])}
+            overall_total_coffees += row['count']
+            overall_total_cost += float(row['total_cost'])
+    elif rows: 
+        row = rows[0]
+        overall_total_coffees = row['count']
+        overall_total_cost = float(row['total_cost'])
+    return {"total_coffees": overall_total_coffees, "total_cost": round(overall_total_cost, 2),
+            "breakdown_by_type": breakdown if type_filter == 'All' else {}}
 
+# --- Report Result Cache ---
+# Monthly breakdowns and year summaries are cached per user, period and type
+# filter; a write only invalidates the periods it touches (see report_cache.py).
+report_result_cache = report_cache.from_env()
+
+def cached_report(report, user_id, start, end, type_filter, compute):
+    """compute() for [start, end) through report_result_cache."""
+    return report_result_cache.get_or_compute(repo, user_id, report, start, end, type_filter,
+                                              g.get('data_version'), compute)
 
 @app.route("/api/reports/monthly", methods=['GET'])
-@login_required 
+@login_required
+@replica_reads
+@etag_by_user_version
 def get_monthly_report():
     user_id = session.get('user_id')
     try:
@@ -451,132 +766,471 @@ def get_monthly_report():
     if type_filter != 'All' and type_filter not in COFFEE_COSTS:
         return jsonify({"error": f"Invalid coffee type: {type_filter}"}), 400
 
-    conn = None
     try:
-        conn = get_db_connection()
-        user_currency_symbol = get_user_currency_symbol(user_id, conn)
-        
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        sql_query = """
-            SELECT coffee_type, COUNT(*) as count, SUM(cost) as total_cost
-            FROM coffee_entries
-            WHERE user_id = %s AND EXTRACT(YEAR FROM entry_date) = %s AND EXTRACT(MONTH FROM entry_date) = %s
-        """
-        params = [user_id, year, month]
-        if type_filter != 'All':
-            sql_query += " AND coffee_type = %s"
-            params.append(type_filter)
-        sql_query += " GROUP BY coffee_type ORDER BY coffee_type;"
-        cur.execute(sql_query, tuple(params))
-        rows = cur.fetchall()
-        cur.close()
-        
-        overall_total_coffees = 0; overall_total_cost = 0.0; breakdown = {}
-        if type_filter == 'All':
-            for row in rows:
-                breakdown[row['coffee_type']] = {"count": row['count'], "cost": float(row['total_cost'])}
-                overall_total_coffees += row['count']
-                overall_total_cost += float(row['total_cost'])
-        elif rows: 
-            row = rows[0]
-            overall_total_coffees = row['count']
-            overall_total_cost = float(row['total_cost'])
-        
+        user_currency_symbol = get_user_currency_symbol(user_id)
+        start, end = period_bounds(year, month)
+        rows = cached_report("monthly", user_id, start, end, type_filter,
+                             lambda: repo.type_breakdown(user_id, start, end, type_filter))
+
         report = {"year": year, "month": month, "coffee_type_filter": type_filter,
-                  "total_coffees": overall_total_coffees, "total_cost": round(overall_total_cost, 2),
-                  "breakdown_by_type": breakdown if type_filter == 'All' else {},
+                  **summarize_breakdown(rows, type_filter),
                   "currency_symbol": user_currency_symbol}
         return jsonify(report)
-    except psycopg2.Error as e:
+    except storage.StorageError as e:
         logging.error(f"DB error generating monthly report for user {user_id}: {e}")
         return jsonify({"error": "Database error"}), 500
-    finally:
-        if conn: conn.close()
 
-@app.route("/api/reports/yearly", methods=['GET'])
-@login_required 
-def get_yearly_report():
-    user_id = session.get('user_id')
+def parse_year_args():
+    """(year, type_filter, None) from the query string, or (None, None, error response)."""
     try: year = int(request.args.get('year'))
-    except (TypeError, ValueError): return jsonify({"error": "Year required as integer."}), 400
-    if not (2000 <= year <= date.today().year + 10): return jsonify({"error": "Invalid year."}), 400
-    
+    except (TypeError, ValueError): return None, None, (jsonify({"error": "Year required as integer."}), 400)
+    if not (2000 <= year <= date.today().year + 10): return None, None, (jsonify({"error": "Invalid year."}), 400)
+
     type_filter = request.args.get('type', 'All')
     if type_filter != 'All' and type_filter not in COFFEE_COSTS:
-        return jsonify({"error": f"Invalid coffee type: {type_filter}"}), 400
+        return None, None, (jsonify({"error": f"Invalid coffee type: {type_filter}"}), 400)
+    return year, type_filter, None
+
+def year_summary(user_id, year, type_filter='All'):
+    """reports.build_year_summary over one grouped scan of the user's year (cached; don't mutate)."""
+    start, end = period_bounds(year)
+    return cached_report("year-summary", user_id, start, end, type_filter, lambda: reports.build_year_summary(
+        year, repo.year_activity(user_id, start, end, type_filter)))
+
+@app.route("/api/reports/year-summary", methods=['GET'])
+@login_required
+@replica_reads
+@etag_by_user_version
+def get_year_summary():
+    user_id = session.get('user_id')
+    year, type_filter, error = parse_year_args()
+    if error: return error
 
-    conn = None
     try:
-        conn = get_db_connection()
-        user_currency_symbol = get_user_currency_symbol(user_id, conn)
-
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        sql_query = """
-            SELECT coffee_type, COUNT(*) as count, SUM(cost) as total_cost
-            FROM coffee_entries
-            WHERE user_id = %s AND EXTRACT(YEAR FROM entry_date) = %s
-        """
-        params = [user_id, year]
-        if type_filter != 'All':
-            sql_query += " AND coffee_type = %s"
-            params.append(type_filter)
-        sql_query += " GROUP BY coffee_type ORDER BY coffee_type;"
-        cur.execute(sql_query, tuple(params))
-        rows = cur.fetchall()
-        cur.close()
+        summary = year_summary(user_id, year, type_filter)
+        return jsonify({**summary, "coffee_type_filter": type_filter,
+                        "currency_symbol": get_user_currency_symbol(user_id)})
+    except storage.StorageError as e:
+        logging.error(f"DB error generating year summary for user {user_id}: {e}")
+        return jsonify({"error": "Database error"}), 500
+
+# The two endpoints below predate /api/reports/year-summary and are kept as views over it.
+
+@app.route("/api/reports/yearly", methods=['GET'])
+@login_required
+@replica_reads
+@etag_by_user_version
+def get_yearly_report():
+    user_id = session.get('user_id')
+    year, type_filter, error = parse_year_args()
+    if error: return error
+
+    try:
+        user_currency_symbol = get_user_currency_symbol(user_id)
+        summary = year_summary(user_id, year, type_filter)
+        breakdown = {coffee_type: {"count": t['count'], "cost": t['cost']}
+                     for coffee_type, t in summary['by_type'].items()}
 
-        overall_total_coffees = 0; overall_total_cost = 0.0; breakdown = {}
-        if type_filter == 'All':
-            for row in rows:
-                breakdown[row['coffee_type']] = {"count": row['count'], "cost": float(row['total_cost'])}
-                overall_total_coffees += row['count']
-                overall_total_cost += float(row['total_cost'])
-        elif rows: 
-            row = rows[0]
-            overall_total_coffees = row['count']
-            overall_total_cost = float(row['total_cost'])
-        
         report = {"year": year, "coffee_type_filter": type_filter,
-                  "total_coffees": overall_total_coffees, "total_cost": round(overall_total_cost, 2),
+                  "total_coffees": summary['total_coffees'], "total_cost": summary['total_cost'],
                   "breakdown_by_type": breakdown if type_filter == 'All' else {},
                   "currency_symbol": user_currency_symbol}
         return jsonify(report)
-    except psycopg2.Error as e:
+    except storage.StorageError as e:
         logging.error(f"DB error generating yearly report for user {user_id}: {e}")
         return jsonify({"error": "Database error"}), 500
-    finally:
-        if conn: conn.close()
 
 @app.route("/api/fun-facts/yearly-volume", methods=['GET'])
-@login_required 
+@login_required
+@replica_reads
+@etag_by_user_version
 def get_yearly_volume():
     user_id = session.get('user_id')
-    try: year = int(request.args.get('year'))
-    except (TypeError, ValueError): return jsonify({"error": "Year required as integer."}), 400
-    if not (2000 <= year <= date.today().year + 10): return jsonify({"error": "Invalid year."}), 400
-    
-    total_volume_ml = 0
+    year, _, error = parse_year_args()
+    if error: return error
+
+    try:
+        summary = year_summary(user_id, year)
+        return jsonify({"year": year, "total_volume_ml": summary['total_volume_ml']})
+    except storage.StorageError as e:
+        logging.error(f"DB error getting yearly volume for user {user_id}: {e}")
+        return jsonify({"error": "Database error"}), 500
+
+RANGE_GRANULARITIES = storage.GRANULARITIES
+RANGE_MAX_BUCKETS = int(os.environ.get('RANGE_MAX_BUCKETS', "1100"))
+
+@app.route("/api/reports/range", methods=['GET'])
+@login_required
+@replica_reads
+@etag_by_user_version
+def get_range_report():
+    """Dense time series of count, cost and volume over [from, to] (inclusive).
+
+    Buckets are calendar days, ISO weeks (starting Monday) or months; empty
+    buckets are zero-filled, so the response grows with the number of buckets
+    only.
+    """
+    user_id = session['user_id']
+    try:
+        date_from = datetime.strptime(request.args.get('from', ''), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.args.get('to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"error": "from and to are required as YYYY-MM-DD."}), 400
+    if date_to < date_from:
+        return jsonify({"error": "'to' must not be before 'from'."}), 400
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in RANGE_GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of {', '.join(RANGE_GRANULARITIES)}."}), 400
+    type_filter = request.args.get('type', 'All')
+    if type_filter != 'All' and type_filter not in COFFEE_COSTS:
+        return jsonify({"error": f"Invalid coffee type: {type_filter}"}), 400
+
+    span_days = (date_to - date_from).days + 1
+    approx_buckets = {'day': span_days, 'week': span_days // 7 + 2, 'month': span_days // 28 + 2}[granularity]
+    if approx_buckets > RANGE_MAX_BUCKETS:
+        return jsonify({"error": f"Range too large for '{granularity}' granularity (max {RANGE_MAX_BUCKETS} buckets)."}), 400
+
+    try:
+        user_currency_symbol = get_user_currency_symbol(user_id)
+        series = repo.range_series(user_id, date_from, date_to, granularity, COFFEE_VOLUMES, type_filter)
+    except storage.StorageError as e:
+        logging.error(f"DB error generating range report for user {user_id}: {e}")
+        return jsonify({"error": "Database error"}), 500
+
+    for point in series:
+        point['period'] = point['period'].isoformat()
+    return jsonify({
+        "from": date_from.isoformat(), "to": date_to.isoformat(), "granularity": granularity,
+        "coffee_type_filter": type_filter, "currency_symbol": user_currency_symbol,
+        "series": series,
+        "total_coffees": sum(point['count'] for point in series),
+        "total_cost": round(sum(point['cost'] for point in series), 2),
+        "total_volume_ml": sum(point['volume_ml'] for point in series),
+    })
+
+# --- Shop Statistics ---
+# Totals and leaderboards across all users, read from materialized views that
+# a background thread refreshes every SHOP_STATS_REFRESH_INTERVAL seconds
+# (see shop_stats.py and migrations/0009).
+SHOP_LEADERBOARD_MAX = int(os.environ.get('SHOP_LEADERBOARD_MAX', "25"))
+shop_stats_refresher = shop_stats.Refresher() if repo.backend == "postgres" else None
+
+@app.before_request
+def start_shop_stats_refresher():
+    if shop_stats_refresher is not None:
+        shop_stats_refresher.ensure_started()
+
+@app.route("/api/shop/stats", methods=['GET'])
+@login_required
+@postgres_only
+@replica_reads
+def shop_stats_api():
+    """Cups, spend and volume per type across all users, plus daily and weekly leaderboards.
+
+    ?date=YYYY-MM-DD picks the leaderboard day (default today) and its ISO
+    week; ?limit caps each leaderboard. staleness_seconds is the age of the
+    oldest view.
+    """
+    try:
+        day = datetime.strptime(request.args.get('date') or date.today().isoformat(), '%Y-%m-%d').date()
+        limit = min(int(request.args.get('limit', 10)), SHOP_LEADERBOARD_MAX)
+    except ValueError:
+        return jsonify({"error": "Invalid date or limit. Use YYYY-MM-DD and an integer."}), 400
+    if limit < 1:
+        return jsonify({"error": "'limit' must be at least 1."}), 400
+
     conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(
-            "SELECT coffee_type, COUNT(*) as count FROM coffee_entries "
-            "WHERE user_id = %s AND EXTRACT(YEAR FROM entry_date) = %s "
-            "GROUP BY coffee_type",
-            (user_id, year)
-        )
-        rows = cur.fetchall()
-        cur.close()
-        for row in rows:
-            if row['coffee_type'] in COFFEE_VOLUMES: 
-                total_volume_ml += COFFEE_VOLUMES[row['coffee_type']] * row['count']
-        return jsonify({"year": year, "total_volume_ml": total_volume_ml})
+        conn = get_read_connection()
+        stats = shop_stats.read_stats(conn, day, day - timedelta(days=day.weekday()), limit)
     except psycopg2.Error as e:
-        logging.error(f"DB error getting yearly volume for user {user_id}: {e}")
+        logging.error(f"DB error reading shop statistics: {e}")
         return jsonify({"error": "Database error"}), 500
     finally:
         if conn: conn.close()
+    return jsonify({**stats, "refresh_interval_seconds": shop_stats.REFRESH_INTERVAL})
+
+# --- Dashboard Route ---
+@app.route("/api/dashboard", methods=['GET'])
+@login_required
+def dashboard_api():
+    """Everything the tracker page needs on load.
+
+    Settings and prices come from the user cache; the day log and the month
+    summary (from the monthly rollup on Postgres) are one query each.
+    """
+    try:
+        selected_date = datetime.strptime(request.args.get('date') or date.today().isoformat(), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+
+    # ?day=0 skips the day log, for clients that have the day cached (see /api/changes).
+    include_day = request.args.get('day') != '0'
+    user_id = session['user_id']
+    try:
+        profile = get_user_profile(user_id)
+        entries = fetch_day_log(user_id, selected_date, profile['currency_symbol']) if include_day else None
+        month_rows = repo.type_breakdown(user_id, *period_bounds(selected_date.year, selected_date.month))
+    except storage.StorageError as e:
+        logging.error(f"DB error loading dashboard for user {user_id}: {e}")
+        return jsonify({"error": "Database error"}), 500
+
+    return jsonify({
+        "settings": {"currency_code": profile['currency_code'], "currency_symbol": profile['currency_symbol']},
+        "custom_prices": profile['prices'],
+        "coffee_types": coffee_type_catalog(profile),
+        "date": selected_date.isoformat(),
+        "day": {"entries": entries, "count": len(entries),
+                "total_cost": round(sum(entry['cost'] for entry in entries), 2)} if include_day else None,
+        "month_summary": {"year": selected_date.year, "month": selected_date.month,
+                          **summarize_breakdown(month_rows),
+                          "currency_symbol": profile['currency_symbol']},
+    })
+
+# --- Export Routes ---
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', "2000"))
+EXPORT_COLUMNS = ["id", "date", "time", "type", "cost"]
+
+def _export_chunks(conn, sql_query, params, export_format):
+    """Yields encoded text chunks, one per server-side cursor batch.
+
+    Rows are pulled EXPORT_FETCH_SIZE at a time through a named (server-side)
+    cursor, so memory stays flat regardless of history size.
+    """
+    try:
+        cur = conn.cursor(name="coffee_export")
+        cur.itersize = EXPORT_FETCH_SIZE
+        cur.execute(sql_query, params)
+        if export_format == 'csv':
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buf.getvalue()
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            records = [(entry_id, entry_date.isoformat(), entry_time.strftime('%H:%M:%S'), coffee_type, float(cost))
+                       for entry_id, entry_date, entry_time, coffee_type, cost in rows]
+            if export_format == 'csv':
+                buf = io.StringIO()
+                csv.writer(buf).writerows(records)
+                yield buf.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, record))) + "\n" for record in records)
+        cur.close()
+    finally:
+        conn.close()
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route("/api/export", methods=['GET'])
+@login_required
+@postgres_only
+def export_coffees_api():
+    """Streams the user's full history as CSV or NDJSON.
+
+    Optional filters: from/to (YYYY-MM-DD, inclusive) and type. The body is
+    gzip-compressed on the fly when the client sends Accept-Encoding: gzip.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be 'csv' or 'ndjson'."}), 400
+    try:
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+    type_filter = request.args.get('type', 'All')
+    if type_filter != 'All' and type_filter not in COFFEE_COSTS:
+        return jsonify({"error": f"Invalid coffee type: {type_filter}"}), 400
+
+    sql_query = "SELECT id, entry_date, entry_time, coffee_type, cost FROM coffee_entries WHERE user_id = %s"
+    params = [session['user_id']]
+    if date_from:
+        sql_query += " AND entry_date >= %s"
+        params.append(date_from)
+    if date_to:
+        sql_query += " AND entry_date <= %s"
+        params.append(date_to)
+    if type_filter != 'All':
+        sql_query += " AND coffee_type = %s"
+        params.append(type_filter)
+    sql_query += " ORDER BY entry_date, entry_time, id"
+
+    try:
+        # Checked out directly rather than via get_db_connection(): the request's
+        # teardown runs before the body is streamed, and the generator returns it.
+        conn = checkout_timed()
+    except psycopg2.Error as e:
+        logging.error(f"Error connecting to PostgreSQL database: {e}")
+        return jsonify({"error": "Database error"}), 500
+    body = _export_chunks(conn, sql_query, tuple(params), export_format)
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    headers = {"Content-Disposition": f"attachment; filename=coffee_history.{export_format}",
+               "Vary": "Accept-Encoding"}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        headers["Content-Encoding"] = "gzip"
+        body = _gzip_stream(body)
+    else:
+        body = (chunk.encode('utf-8') for chunk in body)
+    logging.info(f"User {session['user_id']} started a {export_format} export.")
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+# --- Schema Management (flask --app app <command>) ---
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations from migrations/."""
+    conn = get_db_connection()
+    try:
+        applied = migrate.apply_migrations(conn)
+        partitions.ensure(conn)
+    finally:
+        conn.close()
+    print(f"Applied {len(applied)} migration(s)." if applied else "Schema is up to date.")
+
+@app.cli.command("ensure-partitions")
+@click.option("--ahead", type=int, default=partitions.PARTITION_AHEAD_YEARS, show_default=True,
+              help="Years after the current one to create partitions for.")
+def ensure_partitions_command(ahead):
+    """Create upcoming yearly coffee_entries partitions (safe to run from cron)."""
+    conn = get_db_connection()
+    try:
+        created = partitions.ensure(conn, ahead)
+        for partition in partitions.list_partitions(conn):
+            print(f"{partition['name']:<28} ~{partition['rows']} rows")
+    finally:
+        conn.close()
+    print(f"Created {created} partition(s).")
+
+@app.cli.command("archive-partitions")
+@click.option("--before", "before_year", type=int, required=True, help="Archive every year older than this one.")
+@click.option("--dir", "directory", type=click.Path(file_okay=False), default=partitions.ARCHIVE_DIR,
+              show_default=True, help="Where the .csv.gz archives are written.")
+def archive_partitions_command(before_year, directory):
+    """Archive old yearly coffee_entries partitions to gzipped CSV, then detach and drop them."""
+    conn = get_db_connection()
+    try:
+        archived = partitions.archive_before(conn, before_year, directory)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    finally:
+        conn.close()
+    for result in archived:
+        print(f"{result['partition']}: {result['rows']} rows -> {result['path']} (sha256 {result['sha256'][:12]})")
+    print(f"Archived {len(archived)} partition(s).")
+
+@app.cli.command("prune-changes")
+@click.option("--keep-days", type=int, default=CHANGE_RETENTION_DAYS, show_default=True,
+              help="Keep change feed rows from this many days back.")
+def prune_changes_command(keep_days):
+    """Delete old /api/changes rows; clients with older cursors reload their cached days."""
+    deleted = repo.prune_changes(datetime.now(timezone.utc) - timedelta(days=keep_days))
+    print(f"Pruned {deleted} change feed row(s).")
+
+@app.cli.command("refresh-shop-stats")
+@click.option("--force", is_flag=True, help="Refresh every view, not only those older than the interval.")
+def refresh_shop_stats_command(force):
+    """Refresh the shop statistics materialized views (for cron when the background refresher is off)."""
+    conn = get_db_connection()
+    try:
+        refreshed = shop_stats.refresh(conn, 0 if force else shop_stats.REFRESH_INTERVAL)
+    finally:
+        conn.close()
+    for view, duration_ms in refreshed.items():
+        print(f"{view:<24} {duration_ms} ms")
+    print(f"Refreshed {len(refreshed)} view(s).")
+
+@app.cli.command("rebuild-rollups")
+@click.option('--user-id', type=int, default=None, help="Only rebuild this user's rollups.")
+def rebuild_rollups_command(user_id):
+    """Backfill/rebuild the daily and monthly report rollups from coffee_entries."""
+    conn = get_db_connection()
+    try:
+        daily_rows = rollups.rebuild(conn, user_id)
+    finally:
+        conn.close()
+    print(f"Rebuilt rollups: {daily_rows} daily row(s).")
+
+@app.cli.command("check-rollups")
+@click.option('--user-id', type=int, default=None, help="Only check this user's rollups.")
+def check_rollups_command(user_id):
+    """Compare the report rollups against raw coffee_entries."""
+    conn = get_db_connection()
+    try:
+        mismatches = rollups.find_inconsistencies(conn, user_id)
+    finally:
+        conn.close()
+    for m in mismatches:
+        print(f"MISMATCH {m['level']} user={m['user_id']} period={m['period']} type={m['coffee_type']}: "
+              f"expected {m['expected_count']}/{m['expected_cost']}, rollup {m['rollup_count']}/{m['rollup_cost']}")
+    if mismatches:
+        raise SystemExit(1)
+    print("Rollups are consistent with coffee_entries.")
+
+@app.cli.command("import-log")
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--username', required=True, help="User the entries belong to.")
+@click.option('--chunk-size', type=int, default=ingest.DEFAULT_CHUNK_SIZE, show_default=True,
+              help="Entries per INSERT/transaction.")
+def import_log_command(path, username, chunk_size):
+    """Import a legacy coffee_log_BAK.json-style file. Safe to re-run."""
+    with open(path, encoding='utf-8') as f:
+        raw_entries = ingest.legacy_log_entries(json.load(f))
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM users WHERE username = %s", (username,))
+        row = cur.fetchone()
+        cur.close()
+        if row is None:
+            raise click.ClickException(f"No such user: {username}")
+        result = ingest.ingest_entries(conn, row[0], raw_entries, get_user_costs(row[0]), chunk_size)
+    finally:
+        conn.close()
+    for error in result['errors']:
+        print(f"ERROR entry {error['index']} ({error['entry'].get('date')}): {error['error']}")
+    print(f"Imported {result['inserted']} of {result['received']} entries "
+          f"({result['skipped_duplicates']} already present, {len(result['errors'])} errors).")
+    if result['errors']:
+        raise SystemExit(1)
+
+@app.cli.command("check-storage")
+@click.option('--backend', type=click.Choice(['postgres', 'sqlite']), default=None,
+              help="Backend to check (default: STORAGE_BACKEND).")
+@click.option('--sqlite-path', default=None, help="SQLite file for --backend sqlite (default: SQLITE_PATH).")
+def check_storage_command(backend, sqlite_path):
+    """Run the repository conformance checks against a storage backend."""
+    import conformance
+    backend = backend or repo.backend
+    if backend == repo.backend and sqlite_path is None:
+        target = repo
+    elif backend == "postgres":
+        target = storage.PostgresRepository(get_db_connection)
+    else:
+        import sqlite_storage
+        target = sqlite_storage.SQLiteRepository(sqlite_path or storage.SQLITE_PATH)
+    failures = conformance.check_repository(target, COFFEE_VOLUMES)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        raise SystemExit(1)
+    print(f"The {backend} backend conforms to the storage contract.")
+
+if os.environ.get('DB_AUTO_MIGRATE') == '1':
+    with app.app_context():
+        _conn = get_db_connection()
+        try:
+            migrate.apply_migrations(_conn)
+            partitions.ensure(_conn)
+        finally:
+            _conn.close()
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,335 @@
+"""Optional asyncio serving mode for the coffee tracker API.
+
+The hot ``/api/*`` reads (settings, prices, coffee types, day log, dashboard)
+and the delete routes are served natively on an asyncpg pool, so one process
+can keep thousands of requests in flight while they wait on Postgres.
+Everything else (pages, login/register, adding coffee, settings/price writes,
+bulk import, export, reports, ...) and any request without a valid session is
+handed to the Flask app unchanged, so the URL contract, the session cookie and
+the login redirect behave exactly as in the sync server. Adding coffee and the
+reports stay there because they rely on group commit, the report cache and
+the request metrics, which only the Flask app has.
+
+Requires the ``async`` extra (starlette, uvicorn, asyncpg, a2wsgi)::
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+"""
+import logging
+import os
+from datetime import datetime, date
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import rollups
+from app import (
+    app as flask_app, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+    user_profile_cache, coffee_type_catalog, compute_etag, period_bounds, summarize_breakdown, write_positions,
+)
+
+ASYNC_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', "2"))
+ASYNC_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', "20"))
+WSGI_FALLBACK_THREADS = int(os.environ.get('WSGI_FALLBACK_THREADS', "10"))
+
+flask_fallback = WSGIMiddleware(flask_app, workers=WSGI_FALLBACK_THREADS)
+_session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+pool = None
+
+
+# --- Session ---
+def load_flask_session(scope):
+    """Decodes Flask's signed session cookie; returns {} when absent or invalid."""
+    cookie = HTTPConnection(scope).cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie or _session_serializer is None:
+        return {}
+    try:
+        return _session_serializer.loads(
+            cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+class RequireSession:
+    """Sends unauthenticated requests to Flask, which issues the usual login redirect."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            session = load_flask_session(scope)
+            if 'user_id' not in session:
+                await flask_fallback(scope, receive, send)
+                return
+            scope['flask_session'] = session
+        await self.app(scope, receive, send)
+
+
+def error(message, status):
+    return JSONResponse({"error": message}, status_code=status)
+
+
+# --- Shared Lookups ---
+async def get_user_profile(conn, user_id, session):
+    """Async twin of app.get_user_profile; shares the same in-process cache."""
+    profile = user_profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+    rows = await conn.fetch(
+        "SELECT u.currency_code, u.currency_symbol, p.coffee_type, p.price "
+        "FROM users u LEFT JOIN user_coffee_prices p ON p.user_id = u.id "
+        "WHERE u.id = $1",
+        user_id
+    )
+    if not rows:
+        return {"currency_code": session.get('currency_code', 'EUR'),
+                "currency_symbol": session.get('currency_symbol', '€'), "prices": {}}
+    profile = {
+        "currency_code": rows[0]['currency_code'],
+        "currency_symbol": rows[0]['currency_symbol'],
+        "prices": {row['coffee_type']: float(row['price']) for row in rows if row['coffee_type'] is not None},
+    }
+    user_profile_cache.set(user_id, profile)
+    return profile
+
+
+async def apply_rollup_deltas(conn, user_id, deltas):
+    """asyncpg version of rollups.apply_deltas; must run inside the write transaction."""
+    for table, key_column, rows in rollups.rollup_levels(deltas):
+        await conn.executemany(
+            f"INSERT INTO {table} AS r (user_id, {key_column}, coffee_type, entry_count, total_cost) "
+            f"VALUES ($1, $2, $3, $4, $5) ON CONFLICT (user_id, {key_column}, coffee_type) DO UPDATE SET "
+            f"entry_count = r.entry_count + EXCLUDED.entry_count, "
+            f"total_cost = r.total_cost + EXCLUDED.total_cost",
+            [(user_id, *row) for row in rows]
+        )
+        await conn.execute(
+            f"DELETE FROM {table} WHERE user_id = $1 AND {key_column} = ANY($2::date[]) AND entry_count <= 0",
+            user_id, sorted({row[0] for row in rows})
+        )
+
+
+async def remember_write_position(conn, user_id):
+    """Async twin of app.remember_write_position, for a write just committed on conn."""
+    if write_positions is None:
+        return
+    try:
+        lsn = await conn.fetchval("SELECT pg_current_wal_insert_lsn()::text")
+    except asyncpg.PostgresError as e:
+        logging.warning(f"Could not read the primary WAL position after a write: {e}")
+        return
+    write_positions.record(user_id, lsn)
+
+
+async def day_totals(conn, user_id, entry_date):
+    row = await conn.fetchrow(
+        "SELECT COALESCE(SUM(entry_count), 0) AS count, COALESCE(SUM(total_cost), 0) AS total_cost "
+        "FROM coffee_daily_rollups WHERE user_id = $1 AND entry_date = $2",
+        user_id, entry_date
+    )
+    return int(row['count']), round(float(row['total_cost']), 2)
+
+
+async def fetch_day_log(conn, user_id, entry_date, currency_symbol):
+    rows = await conn.fetch(
+        "SELECT id, coffee_type, entry_time, cost FROM coffee_entries "
+        "WHERE user_id = $1 AND entry_date = $2 ORDER BY entry_time, id",
+        user_id, entry_date
+    )
+    return [{"id": row['id'], "type": row['coffee_type'],
+             "time": row['entry_time'].strftime('%I:%M %p').lstrip('0'),
+             "cost": float(row['cost']), "currency_symbol": currency_symbol} for row in rows]
+
+
+async def type_breakdown(conn, user_id, start, end):
+    return await conn.fetch(
+        "SELECT coffee_type, SUM(entry_count) AS count, SUM(total_cost) AS total_cost "
+        "FROM coffee_monthly_rollups WHERE user_id = $1 AND month >= $2 AND month < $3 "
+        "GROUP BY coffee_type ORDER BY coffee_type",
+        user_id, start, end
+    )
+
+
+def with_etag(handler):
+    """Same strong ETag/304 contract as app.etag_by_user_version."""
+    async def endpoint(request):
+        user_id = request.scope['flask_session']['user_id']
+        version = await pool.fetchval("SELECT data_version FROM users WHERE id = $1", user_id)
+        if version is None:
+            return await handler(request)
+        full_path = f"{request.url.path}?{request.url.query}"
+        digest = compute_etag(user_id, version, full_path)
+        headers = {"ETag": f'"{digest}"', "Cache-Control": "private, no-cache"}
+        if_none_match = request.headers.get('if-none-match', '')
+        if f'"{digest}"' in if_none_match or if_none_match.strip() == '*':
+            return Response(status_code=304, headers=headers)
+        response = await handler(request)
+        if response.status_code == 200:
+            response.headers.update(headers)
+        return response
+    return endpoint
+
+
+# --- API Routes ---
+async def user_settings(request):
+    session = request.scope['flask_session']
+    async with pool.acquire() as conn:
+        profile = await get_user_profile(conn, session['user_id'], session)
+    return JSONResponse({"currency_code": profile['currency_code'], "currency_symbol": profile['currency_symbol']})
+
+
+async def user_coffee_prices(request):
+    session = request.scope['flask_session']
+    async with pool.acquire() as conn:
+        profile = await get_user_profile(conn, session['user_id'], session)
+    return JSONResponse(profile['prices'])
+
+
+async def coffee_types(request):
+    session = request.scope['flask_session']
+    async with pool.acquire() as conn:
+        profile = await get_user_profile(conn, session['user_id'], session)
+    return JSONResponse(coffee_type_catalog(profile))
+
+
+async def coffees_for_date(request):
+    date_string = request.path_params['date_string']
+    try:
+        entry_date = datetime.strptime(date_string, '%Y-%m-%d').date()
+    except ValueError:
+        return error("Invalid date format. Use YYYY-MM-DD.", 400)
+    session = request.scope['flask_session']
+    user_id = session['user_id']
+
+    if request.method == 'GET':
+        try:
+            async with pool.acquire() as conn:
+                profile = await get_user_profile(conn, user_id, session)
+                entries = await fetch_day_log(conn, user_id, entry_date, profile['currency_symbol'])
+        except asyncpg.PostgresError as e:
+            logging.error(f"DB error fetching coffees for date {date_string} for user {user_id}: {e}")
+            return error("Database error while fetching coffee entries", 500)
+        return JSONResponse(entries)
+
+    # DELETE clears the whole day
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                deleted = await conn.fetch(
+                    "DELETE FROM coffee_entries WHERE user_id = $1 AND entry_date = $2 "
+                    "RETURNING coffee_type, entry_date, cost",
+                    user_id, entry_date
+                )
+                deltas = rollups.deltas_from_rows([tuple(row) for row in deleted], -1)
+                if deltas:
+                    await apply_rollup_deltas(conn, user_id, deltas)
+            if deleted:
+                await remember_write_position(conn, user_id)
+    except asyncpg.PostgresError as e:
+        logging.error(f"DB error clearing coffees for user {user_id}: {e}")
+        return error("Database error while clearing coffees", 500)
+    return JSONResponse({"message": f"Coffees for {date_string} cleared successfully.", "deleted_count": len(deleted),
+                         "day_count": 0, "day_total_cost": 0.0})
+
+
+async def delete_coffee_entry(request):
+    entry_id = request.path_params['entry_id']
+    user_id = request.scope['flask_session']['user_id']
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                deleted = await conn.fetch(
+                    "DELETE FROM coffee_entries WHERE id = $1 AND user_id = $2 "
+                    "RETURNING coffee_type, entry_date, cost",
+                    entry_id, user_id
+                )
+                if not deleted:
+                    return error("Entry not found or not authorized to delete.", 404)
+                await apply_rollup_deltas(conn, user_id, rollups.deltas_from_rows([tuple(row) for row in deleted], -1))
+                entry_date = deleted[0]['entry_date']
+                day_count, day_total_cost = await day_totals(conn, user_id, entry_date)
+            await remember_write_position(conn, user_id)
+    except asyncpg.PostgresError as e:
+        logging.error(f"DB error deleting coffee entry ID {entry_id} for user {user_id}: {e}")
+        return error("Database error while deleting coffee entry", 500)
+    return JSONResponse({"message": f"Coffee entry {entry_id} deleted successfully.", "deleted_id": entry_id,
+                         "entry_date": entry_date.isoformat(), "day_count": day_count,
+                         "day_total_cost": day_total_cost})
+
+
+async def dashboard(request):
+    session = request.scope['flask_session']
+    user_id = session['user_id']
+    try:
+        selected_date = datetime.strptime(request.query_params.get('date') or date.today().isoformat(),
+                                          '%Y-%m-%d').date()
+    except ValueError:
+        return error("Invalid date format. Use YYYY-MM-DD.", 400)
+    # ?day=0 skips the day log, as in app.dashboard_api.
+    include_day = request.query_params.get('day') != '0'
+    try:
+        async with pool.acquire() as conn:
+            profile = await get_user_profile(conn, user_id, session)
+            entries = (await fetch_day_log(conn, user_id, selected_date, profile['currency_symbol'])
+                       if include_day else None)
+            month_rows = await type_breakdown(conn, user_id, *period_bounds(selected_date.year, selected_date.month))
+    except asyncpg.PostgresError as e:
+        logging.error(f"DB error loading dashboard for user {user_id}: {e}")
+        return error("Database error", 500)
+    return JSONResponse({
+        "settings": {"currency_code": profile['currency_code'], "currency_symbol": profile['currency_symbol']},
+        "custom_prices": profile['prices'],
+        "coffee_types": coffee_type_catalog(profile),
+        "date": selected_date.isoformat(),
+        "day": {"entries": entries, "count": len(entries),
+                "total_cost": round(sum(entry['cost'] for entry in entries), 2)} if include_day else None,
+        "month_summary": {"year": selected_date.year, "month": selected_date.month,
+                          **summarize_breakdown(month_rows),
+                          "currency_symbol": profile['currency_symbol']},
+    })
+
+
+async def coffees_for_date_dispatch(request):
+    if request.method == 'GET':
+        return await with_etag(coffees_for_date)(request)
+    return await coffees_for_date(request)
+
+
+async def lifespan(app):
+    global pool
+    pool = await asyncpg.create_pool(
+        database=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
+        min_size=ASYNC_POOL_MIN, max_size=ASYNC_POOL_MAX,
+    )
+    logging.info(f"asyncpg pool ready (min={ASYNC_POOL_MIN}, max={ASYNC_POOL_MAX}).")
+    try:
+        yield
+    finally:
+        await pool.close()
+
+
+routes = [
+    # Literal paths that would otherwise match the parameterised routes below.
+    Route("/api/coffees/bulk", flask_fallback),
+    Route("/api/user/settings", user_settings, methods=['GET']),
+    Route("/api/user/coffee_prices", user_coffee_prices, methods=['GET']),
+    Route("/api/coffee-types", with_etag(coffee_types), methods=['GET']),
+    Route("/api/coffees/{date_string}", coffees_for_date_dispatch, methods=['GET', 'DELETE']),
+    Route("/api/coffee_entry/{entry_id:int}", delete_coffee_entry, methods=['DELETE']),
+    Route("/api/dashboard", dashboard, methods=['GET']),
+    # Anything not ported (or a method a route above doesn't accept) runs on Flask.
+    Mount("/", app=flask_fallback),
+]
+
+application = RequireSession(Starlette(routes=routes, lifespan=lifespan))
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:application", host=os.environ.get('ASYNC_HOST', '0.0.0.0'),
+                port=int(os.environ.get('ASYNC_PORT', "8000")))
@@ -0,0 +1,179 @@
+"""Content-fingerprinted static assets with long-lived caching.
+
+At startup every file under static/ is hashed and given a fingerprinted URL
+(``/assets/js/coffee_tracker.3f2a9c1b04de.js``). Templates link through
+``asset_url()``, so a changed file gets a new URL and the old one can be
+cached forever: fingerprinted responses carry
+``Cache-Control: public, max-age=31536000, immutable``. Text assets are
+gzipped once at build time and served precompressed to clients that accept
+gzip. Unknown or outdated fingerprints 404 rather than serving other content
+under a URL that is cached for a year.
+
+Set STATIC_FINGERPRINT=0 to link plain /static URLs instead.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+
+from flask import Blueprint, Response, abort, current_app, has_app_context, request, url_for
+
+STATIC_FINGERPRINT = os.environ.get('STATIC_FINGERPRINT', "1") == "1"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.map'}
+MIN_COMPRESS_BYTES = 512
+HASH_LENGTH = 12
+
+mimetypes.add_type('image/avif', '.avif')  # Not in the mimetypes table before Python 3.11.
+
+
+class Asset:
+    __slots__ = ("path", "url_path", "mimetype", "etag", "body", "gzip_body", "mtime")
+
+    def __init__(self, path, url_path, mimetype, etag, body, gzip_body, mtime):
+        self.path = path
+        self.url_path = url_path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.body = body
+        self.gzip_body = gzip_body
+        self.mtime = mtime
+
+
+def fingerprinted_name(filename, digest):
+    """'js/app.js' -> 'js/app.<digest>.js'."""
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+
+def load_asset(static_folder, filename):
+    path = os.path.join(static_folder, filename)
+    with open(path, 'rb') as f:
+        body = f.read()
+    digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    gzip_body = None
+    if os.path.splitext(filename)[1] in COMPRESSIBLE_EXTENSIONS and len(body) >= MIN_COMPRESS_BYTES:
+        # mtime=0 keeps the compressed bytes identical across builds and workers.
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            gzip_body = compressed
+    return Asset(path, fingerprinted_name(filename, digest), mimetype, digest, body, gzip_body,
+                 os.stat(path).st_mtime_ns)
+
+
+class Manifest:
+    """Logical static filename -> Asset, with the reverse map for serving.
+
+    watch=None follows the current app's debug flag on every lookup, so
+    ``flask run --debug`` and ``app.run(debug=True)`` turn it on even though
+    they set the flag after the manifest is built.
+    """
+
+    def __init__(self, static_folder, watch=None):
+        self.static_folder = static_folder
+        self.watch = watch
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._by_url = {}
+        self.build()
+
+    def build(self):
+        assets = {}
+        for directory, _, files in os.walk(self.static_folder):
+            for name in files:
+                filename = os.path.relpath(os.path.join(directory, name), self.static_folder).replace(os.sep, '/')
+                assets[filename] = load_asset(self.static_folder, filename)
+        with self._lock:
+            self._assets = assets
+            self._by_url = {asset.url_path: asset for asset in assets.values()}
+        compressed = sum(1 for a in assets.values() if a.gzip_body)
+        logging.info(f"Fingerprinted {len(assets)} static assets ({compressed} precompressed).")
+
+    def watching(self):
+        if self.watch is not None:
+            return self.watch
+        return has_app_context() and current_app.debug
+
+    def _refresh(self, filename):
+        # Development only (see watching()): rehash a file whose mtime changed since the build.
+        asset = self._assets.get(filename)
+        try:
+            changed = asset is None or os.stat(asset.path).st_mtime_ns != asset.mtime
+        except OSError:
+            changed = True
+        if changed and os.path.isfile(os.path.join(self.static_folder, filename)):
+            fresh = load_asset(self.static_folder, filename)
+            with self._lock:
+                self._assets[filename] = fresh
+                self._by_url[fresh.url_path] = fresh
+
+    def url_path(self, filename):
+        if self.watching():
+            self._refresh(filename)
+        asset = self._assets.get(filename)
+        return asset.url_path if asset else None
+
+    def lookup(self, url_path):
+        return self._by_url.get(url_path)
+
+    def urls(self, prefix):
+        """{logical filename: fingerprinted URL} for every asset under prefix (e.g. 'images/')."""
+        return {filename: url_for('assets.serve', filename=self.url_path(filename))
+                for filename in sorted(self._assets) if filename.startswith(prefix)}
+
+
+def accepts_gzip():
+    for value, quality in request.accept_encodings:
+        if value in ('gzip', '*'):
+            return quality > 0
+    return False
+
+
+def serve(manifest, filename):
+    asset = manifest.lookup(filename)
+    if asset is None:
+        abort(404)
+    response = Response(mimetype=asset.mimetype)
+    if asset.gzip_body is not None:
+        response.vary.add('Accept-Encoding')
+    if asset.gzip_body is not None and accepts_gzip():
+        response.set_data(asset.gzip_body)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(f"{asset.etag}-gzip")  # Each encoding is a distinct representation.
+    else:
+        response.set_data(asset.body)
+        response.set_etag(asset.etag)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    """Builds the manifest and registers /assets/<fingerprinted path> and asset_url()."""
+    manifest = Manifest(app.static_folder) if STATIC_FINGERPRINT else None
+    blueprint = Blueprint('assets', __name__)
+
+    @blueprint.route('/assets/<path:filename>', endpoint='serve')
+    def serve_asset(filename):
+        if manifest is None:
+            abort(404)
+        return serve(manifest, filename)
+
+    def asset_url(filename):
+        """Fingerprinted URL for a file under static/, falling back to the plain static URL."""
+        url_path = manifest.url_path(filename) if manifest else None
+        if url_path is None:
+            return url_for('static', filename=filename)
+        return url_for('assets.serve', filename=url_path)
+
+    def asset_urls(prefix):
+        """{logical filename: URL} for assets that scripts build URLs to at runtime."""
+        return manifest.urls(prefix) if manifest else {}
+
+    app.register_blueprint(blueprint)
+    app.add_template_global(asset_url)
+    app.add_template_global(asset_urls)
+    app.extensions['assets'] = manifest
+    return manifest
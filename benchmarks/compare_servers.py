@@ -0,0 +1,123 @@
+"""Side-by-side throughput of the sync (Flask) and async (asgi.py) servers.
+
+Start both against the same database, then point this script at them:
+
+    python app.py                                  # sync, :5000
+    uvicorn asgi:application --port 8000           # async, :8000
+    python benchmarks/compare_servers.py http://127.0.0.1:5000 http://127.0.0.1:8000 \
+        --requests 5000 --concurrency 200
+
+Each target gets its own freshly registered user, a few seeded entries, and the
+same read-heavy request mix (day log, coffee types, monthly/yearly report,
+dashboard, plus one add per ten reads). Requires the ``bench`` extra (httpx).
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+
+import httpx
+
+READ_PATHS = [
+    "/api/coffees/{day}",
+    "/api/coffee-types",
+    "/api/reports/monthly?year={year}&month={month}",
+    "/api/reports/yearly?year={year}",
+    "/api/dashboard?date={day}",
+]
+
+
+async def login(client):
+    username = f"bench_{uuid.uuid4().hex[:10]}"
+    password = "bench-password"
+    await client.post("/register", data={"username": username, "password": password,
+                                         "confirm_password": password})
+    response = await client.post("/login", data={"username": username, "password": password})
+    if "session" not in client.cookies:
+        raise SystemExit(f"Login failed against {client.base_url} (status {response.status_code})")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_target(base_url, total_requests, concurrency, write_every):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        await login(client)
+        today = time.strftime("%Y-%m-%d")
+        year, month = int(today[:4]), int(today[5:7])
+        for _ in range(5):
+            await client.post(f"/api/coffees/{today}", json={"type": "Roma", "time": "9:00 AM"})
+
+        latencies = []
+        statuses = {}
+        queue = asyncio.Queue()
+        for i in range(total_requests):
+            queue.put_nowait(i)
+
+        async def worker():
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.perf_counter()
+                if write_every and i % write_every == 0:
+                    response = await client.post(f"/api/coffees/{today}",
+                                                 json={"type": random.choice(["Roma", "Vienna"]), "time": "9:00 AM"})
+                else:
+                    path = random.choice(READ_PATHS).format(day=today, year=year, month=month)
+                    response = await client.get(path)
+                latencies.append((time.perf_counter() - started) * 1000.0)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "target": base_url,
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total_requests / elapsed, 1),
+        "latency_ms": {"mean": round(statistics.fmean(latencies), 2),
+                       "p50": round(percentile(latencies, 50), 2),
+                       "p95": round(percentile(latencies, 95), 2),
+                       "p99": round(percentile(latencies, 99), 2)},
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sync_url")
+    parser.add_argument("async_url")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--write-every", type=int, default=10, help="Every Nth request is an add (0 = reads only).")
+    args = parser.parse_args()
+
+    results = []
+    for label, url in (("sync", args.sync_url), ("async", args.async_url)):
+        result = asyncio.run(run_target(url, args.requests, args.concurrency, args.write_every))
+        result["mode"] = label
+        results.append(result)
+        print(f"{label:>5}: {result['throughput_rps']:>8} req/s  "
+              f"p50 {result['latency_ms']['p50']} ms  p95 {result['latency_ms']['p95']} ms  "
+              f"p99 {result['latency_ms']['p99']} ms  statuses {result['statuses']}")
+    sync_rps, async_rps = results[0]["throughput_rps"], results[1]["throughput_rps"]
+    print(f"async/sync throughput ratio: {async_rps / sync_rps:.2f}x" if sync_rps else "sync target served nothing")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""API latency while a burst of logins hammers the password hasher.
+
+    python benchmarks/login_storm.py http://127.0.0.1:5000 --logins 200 --login-concurrency 50
+
+Measures GET latency for a logged-in user on its own (baseline), then again
+while --login-concurrency clients log in repeatedly. With hashing in the
+request thread the second phase degrades sharply; with the hashing pool
+(PASSWORD_HASH_WORKERS > 0) reads should stay close to baseline and excess
+logins come back as 503 instead of queueing. Requires the ``bench`` extra.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+READ_PATH = "/api/coffee-types"
+PASSWORD = "bench-password"
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"count": 0}
+    return {"count": len(latencies),
+            "mean": round(statistics.fmean(latencies), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2)}
+
+
+async def register(client):
+    username = f"storm_{uuid.uuid4().hex[:10]}"
+    await client.post("/register", data={"username": username, "password": PASSWORD,
+                                         "confirm_password": PASSWORD})
+    return username
+
+
+async def read_loop(client, stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get(READ_PATH)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+
+async def run(base_url, duration, logins, login_concurrency):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as reader:
+        username = await register(reader)
+        await reader.post("/login", data={"username": username, "password": PASSWORD})
+        if "session" not in reader.cookies:
+            raise SystemExit(f"Login failed against {base_url}")
+
+        baseline = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(read_loop(reader, stop, baseline))
+        await asyncio.sleep(duration)
+        stop.set()
+        await task
+
+        under_load = []
+        login_latencies = []
+        login_statuses = {}
+        queue = asyncio.Queue()
+        for i in range(logins):
+            queue.put_nowait(i)
+
+        async def login_worker():
+            async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+                while True:
+                    try:
+                        queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    started = time.perf_counter()
+                    response = await client.post("/login", data={"username": username, "password": PASSWORD})
+                    login_latencies.append((time.perf_counter() - started) * 1000.0)
+                    login_statuses[response.status_code] = login_statuses.get(response.status_code, 0) + 1
+                    client.cookies.clear()
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(read_loop(reader, stop, under_load))
+        started = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(login_concurrency)))
+        storm_seconds = time.perf_counter() - started
+        stop.set()
+        await task
+
+    return {
+        "target": base_url,
+        "read_path": READ_PATH,
+        "baseline_read_ms": summarize(baseline),
+        "storm_read_ms": summarize(under_load),
+        "storm_seconds": round(storm_seconds, 3),
+        "login_ms": summarize(login_latencies),
+        "login_statuses": login_statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base_url")
+    parser.add_argument("--baseline-seconds", type=float, default=5.0)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--login-concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.base_url, args.baseline_seconds, args.logins, args.login_concurrency))
+    base, storm = result["baseline_read_ms"], result["storm_read_ms"]
+    print(f"baseline reads: p50 {base.get('p50')} ms  p99 {base.get('p99')} ms")
+    print(f"storm reads:    p50 {storm.get('p50')} ms  p99 {storm.get('p99')} ms  "
+          f"logins {result['login_statuses']} in {result['storm_seconds']} s")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
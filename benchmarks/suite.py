@@ -0,0 +1,292 @@
+"""Reproducible load benchmark against a local Postgres.
+
+    # 1. seed 20 users x 3 years of history into the database app.py points at
+    #    (re-seed before each run: the load phase itself adds entries)
+    python benchmarks/suite.py seed --users 20 --years 3
+    # 2. start the server under test (any mode), then drive it
+    python app.py
+    python benchmarks/suite.py run http://127.0.0.1:5000 --requests 5000 --concurrency 50 \
+        --output results/$(git rev-parse --short HEAD).json
+
+``run`` logs in as every seeded user and spreads a weighted mix of all user
+routes (add coffee, day log, monthly/yearly reports, yearly volume, settings,
+prices, coffee types, range report, dashboard) across them at the requested
+concurrency. Before the load phase it also replays each route in-process
+through the Flask test client with a counting cursor, recording how many SQL
+statements the route issues. The JSON result (per-route and overall
+p50/p95/p99, throughput, status counts, queries per request) is written with
+sorted keys so two files diff cleanly. Requires the ``bench`` extra (httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+import httpx
+import psycopg2
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+
+# name -> (weight, method, path template); templates see day/year/month/start.
+ROUTES = {
+    "add_coffee": (10, "POST", "/api/coffees/{day}"),
+    "day_log": (25, "GET", "/api/coffees/{day}"),
+    "monthly_report": (15, "GET", "/api/reports/monthly?year={year}&month={month}"),
+    "yearly_report": (10, "GET", "/api/reports/yearly?year={year}"),
+    "yearly_volume": (5, "GET", "/api/fun-facts/yearly-volume?year={year}"),
+    "range_report": (5, "GET", "/api/reports/range?from={start}&to={day}&granularity=week"),
+    "dashboard": (15, "GET", "/api/dashboard?date={day}"),
+    "coffee_types": (5, "GET", "/api/coffee-types"),
+    "settings": (5, "GET", "/api/user/settings"),
+    "prices": (5, "GET", "/api/user/coffee_prices"),
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"count": 0}
+    return {"count": len(latencies),
+            "mean": round(statistics.fmean(latencies), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2)}
+
+
+def request_args(name, rng, first_date, last_date):
+    _, method, template = ROUTES[name]
+    day = first_date + timedelta(days=rng.randint(0, (last_date - first_date).days))
+    path = template.format(day=day.isoformat(), year=day.year, month=day.month,
+                           start=(day - timedelta(days=90)).isoformat())
+    body = None
+    if method == "POST":
+        hour = rng.randint(6, 17)
+        body = {"type": rng.choice(list(synthetic.COFFEE_COSTS)),
+                "time": f"{hour % 12 or 12}:{rng.randint(0, 59):02d} {'AM' if hour < 12 else 'PM'}"}
+    return method, path, body
+
+
+# --- Queries per request (in-process) ---
+
+_query_count = 0
+_counting_classes = {}
+
+
+def _counting_cursor(base):
+    if base not in _counting_classes:
+        class CountingCursor(base):
+            def execute(self, query, vars=None):
+                global _query_count
+                _query_count += 1
+                return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                global _query_count
+                _query_count += 1
+                return super().executemany(query, vars_list)
+        _counting_classes[base] = CountingCursor
+    return _counting_classes[base]
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _counting_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+
+def probe_queries(first_date, last_date, samples, random_seed):
+    """Mean SQL statements per request for each route, via the Flask test client."""
+    global _query_count
+    import app as app_module
+    import db
+    db.configure(dbname=app_module.DB_NAME, user=app_module.DB_USER, password=app_module.DB_PASSWORD,
+                 host=app_module.DB_HOST, port=app_module.DB_PORT, connection_factory=CountingConnection)
+    client = app_module.app.test_client()
+    client.post("/login", data={"username": synthetic.bench_username(0), "password": synthetic.PASSWORD})
+    rng = random.Random(random_seed)
+    result = {}
+    for name in ROUTES:
+        counts = []
+        for _ in range(samples):
+            # Profile cache hits would hide the settings lookups after the first call.
+            app_module.user_profile_cache.clear()
+            method, path, body = request_args(name, rng, first_date, last_date)
+            _query_count = 0
+            response = client.open(path, method=method, json=body)
+            if response.status_code >= 400:
+                raise SystemExit(f"Probe of {name} failed: {method} {path} -> {response.status_code}")
+            counts.append(_query_count)
+        result[name] = round(statistics.fmean(counts), 2)
+    db.get_pool().closeall()
+    return result
+
+
+# --- Load phase (over HTTP) ---
+
+async def login_all(base_url, users, limits):
+    clients = []
+    for index in range(users):
+        client = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0)
+        await client.post("/login", data={"username": synthetic.bench_username(index),
+                                          "password": synthetic.PASSWORD})
+        if "session" not in client.cookies:
+            await client.aclose()
+            raise SystemExit(f"Could not log in as {synthetic.bench_username(index)}; run `seed` first.")
+        clients.append(client)
+    return clients
+
+
+async def drive(base_url, users, total_requests, concurrency, first_date, last_date, random_seed):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    clients = await login_all(base_url, users, limits)
+    rng = random.Random(random_seed)
+    names = list(ROUTES)
+    weights = [ROUTES[name][0] for name in names]
+    plan = [(clients[i % len(clients)], name, *request_args(name, rng, first_date, last_date))
+            for i, name in enumerate(rng.choices(names, weights, k=total_requests))]
+    latencies = {name: [] for name in names}
+    statuses = {name: {} for name in names}
+    queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+
+    async def worker():
+        while True:
+            try:
+                client, name, method, path, body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies[name].append((time.perf_counter() - started) * 1000.0)
+            statuses[name][status] = statuses[name].get(status, 0) + 1
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        elapsed = time.perf_counter() - started
+        for client in clients:
+            await client.aclose()
+    return elapsed, latencies, statuses
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seeded_date_range():
+    import app as app_module
+    conn = psycopg2.connect(dbname=app_module.DB_NAME, user=app_module.DB_USER, password=app_module.DB_PASSWORD,
+                            host=app_module.DB_HOST, port=app_module.DB_PORT)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT MIN(e.entry_date), MAX(e.entry_date), COUNT(*), COUNT(DISTINCT u.id) "
+                    "FROM users u JOIN coffee_entries e ON e.user_id = u.id WHERE u.username ~ %s",
+                    (synthetic.USERNAME_PATTERN,))
+        return cur.fetchone()
+    finally:
+        conn.close()
+
+
+def cmd_seed(args):
+    import app as app_module
+    conn = psycopg2.connect(dbname=app_module.DB_NAME, user=app_module.DB_USER, password=app_module.DB_PASSWORD,
+                            host=app_module.DB_HOST, port=app_module.DB_PORT)
+    try:
+        started = time.perf_counter()
+        summary = synthetic.seed(conn, args.users, args.years, args.random_seed)
+    finally:
+        conn.close()
+    print(f"Seeded {summary['users']} users, {summary['entries']} entries "
+          f"({summary['first_date']}..{summary['last_date']}) in {time.perf_counter() - started:.1f}s.")
+
+
+def cmd_run(args):
+    first_date, last_date, entries, users = seeded_date_range()
+    if not users:
+        raise SystemExit("No seeded bench_* users found; run `seed` first.")
+    users = min(users, args.users) if args.users else users
+
+    queries = probe_queries(first_date, last_date, args.probe_samples, args.random_seed) if args.probe_samples else {}
+    elapsed, latencies, statuses = asyncio.run(
+        drive(args.base_url, users, args.requests, args.concurrency, first_date, last_date, args.random_seed))
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    result = {
+        "revision": git_revision(),
+        "target": args.base_url,
+        "parameters": {"requests": args.requests, "concurrency": args.concurrency, "users": users,
+                       "random_seed": args.random_seed, "probe_samples": args.probe_samples},
+        "dataset": {"entries": entries, "first_date": first_date.isoformat(), "last_date": last_date.isoformat()},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "latency_ms": latency_summary(all_latencies),
+        "routes": {name: {"latency_ms": latency_summary(latencies[name]),
+                          "statuses": statuses[name],
+                          "queries_per_request": queries.get(name)}
+                   for name in ROUTES},
+    }
+    for name, route in result["routes"].items():
+        lat = route["latency_ms"]
+        print(f"{name:>15}: n={lat['count']:<6} p50 {lat.get('p50', '-'):>8} ms  p95 {lat.get('p95', '-'):>8} ms  "
+              f"p99 {lat.get('p99', '-'):>8} ms  queries {route['queries_per_request']}  {route['statuses']}")
+    print(f"overall: {result['throughput_rps']} req/s, p50 {result['latency_ms'].get('p50')} ms, "
+          f"p99 {result['latency_ms'].get('p99')} ms")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    seed_parser = sub.add_parser("seed", help="Replace bench_* users with synthetic history.")
+    seed_parser.add_argument("--users", type=int, default=20)
+    seed_parser.add_argument("--years", type=int, default=3)
+    seed_parser.add_argument("--random-seed", type=int, default=42)
+    seed_parser.set_defaults(func=cmd_seed)
+    run_parser = sub.add_parser("run", help="Drive a running server and record results.")
+    run_parser.add_argument("base_url")
+    run_parser.add_argument("--requests", type=int, default=2000)
+    run_parser.add_argument("--concurrency", type=int, default=20)
+    run_parser.add_argument("--users", type=int, default=0, help="Use only the first N seeded users (0 = all).")
+    run_parser.add_argument("--random-seed", type=int, default=42)
+    run_parser.add_argument("--probe-samples", type=int, default=5,
+                            help="In-process requests per route for query counts (0 = skip).")
+    run_parser.add_argument("--output", help="Write the JSON result here.")
+    run_parser.set_defaults(func=cmd_run)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Deterministic synthetic coffee history for benchmarks.
+
+``seed(conn, users, years)`` (re)creates users ``bench_0000``..``bench_NNNN``
+with a shared password and fills ``coffee_entries`` with M years of plausible
+habits per user: a favourite type or two, more cups on weekdays, the odd
+day off, all timed between early morning and late afternoon. The same
+``--random-seed`` always yields the same rows, so result files taken on
+different commits are comparable.
+"""
+import os
+import random
+import sys
+from datetime import date, time, timedelta
+
+import psycopg2.extras
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashing  # noqa: E402
+import rollups  # noqa: E402
+from app import COFFEE_COSTS  # noqa: E402
+
+USERNAME_PREFIX = "bench_"
+# Exactly the names bench_username() generates. A LIKE 'bench_%' pattern would also
+# match real accounts such as "benchy", since _ matches any character.
+USERNAME_PATTERN = f"^{USERNAME_PREFIX}[0-9]{{4,}}$"
+PASSWORD = "bench-password"
+
+
+def bench_username(index):
+    return f"{USERNAME_PREFIX}{index:04d}"
+
+
+def user_days(rng, start, end):
+    """Yields (entry_date, [(coffee_type, entry_time), ...]) for one user."""
+    types = list(COFFEE_COSTS)
+    favourites = rng.sample(types, 2)
+    weights = [6 if t == favourites[0] else 3 if t == favourites[1] else 1 for t in types]
+    habit = rng.uniform(1.0, 3.5)
+    day = start
+    while day <= end:
+        if rng.random() >= 0.08:
+            mean = habit if day.weekday() < 5 else habit * 0.6
+            cups = max(0, min(8, round(rng.gauss(mean, 1.0))))
+            minutes = sorted(rng.randint(6 * 60, 18 * 60) for _ in range(cups))
+            yield day, [(rng.choices(types, weights)[0], time(m // 60, m % 60)) for m in minutes]
+        day += timedelta(days=1)
+
+
+def seed(conn, users, years, random_seed=42, end=None):
+    """Replaces all bench_* users with `users` fresh ones holding `years` years each.
+
+    Returns {"users": n, "entries": n, "first_date": iso, "last_date": iso}.
+    """
+    end = end or date.today()
+    start = date(end.year - years + 1, 1, 1)
+    rng = random.Random(random_seed)
+    password_hash = hashing.hash_password(PASSWORD)
+    cur = conn.cursor()
+    total = 0
+    try:
+        cur.execute("DELETE FROM users WHERE username ~ %s", (USERNAME_PATTERN,))
+        # Yearly partitions for the whole span, so history doesn't pile up in the DEFAULT partition.
+        cur.execute("SELECT ensure_coffee_entry_partitions(%s, %s)", (start.year, end.year))
+        for index in range(users):
+            cur.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id",
+                        (bench_username(index), password_hash))
+            user_id = cur.fetchone()[0]
+            rows = [(user_id, coffee_type, day, entry_time, COFFEE_COSTS[coffee_type])
+                    for day, cups in user_days(rng, start, end) for coffee_type, entry_time in cups]
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO coffee_entries (user_id, coffee_type, entry_date, entry_time, cost) VALUES %s",
+                rows, page_size=5000
+            )
+            total += len(rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    rollups.rebuild(conn)
+    cur = conn.cursor()
+    cur.execute("ANALYZE coffee_entries")
+    conn.commit()
+    cur.close()
+    return {"users": users, "entries": total, "first_date": start.isoformat(), "last_date": end.isoformat()}
@@ -0,0 +1,173 @@
+"""Small caches shared by the request handlers: in-process, or in a local file."""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL.
+
+    ``get`` returns ``None`` on a miss, so ``None`` itself is never cached.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.maxsize,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class SQLiteCache:
+    """TTL cache in a local SQLite file, shared by the worker processes on one host.
+
+    Same interface as ``LRUCache``; values must be JSON-serializable. Expiry uses
+    wall-clock time so every process agrees on it. Expired rows are dropped
+    during writes, and once more than ``maxsize`` rows remain the ones closest
+    to expiry are evicted. Errors are logged and treated as misses: a broken
+    cache file must not fail requests.
+    """
+
+    PRUNE_EVERY = 100  # writes between prune passes
+
+    def __init__(self, path, maxsize=100000, ttl=300.0):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        conn = self._open()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                     "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at)")
+        conn.close()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")  # Losing recent entries in a crash is fine for a cache.
+        return conn
+
+    def _connection(self):
+        # One connection per thread and process; connections must not cross fork().
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn, local.pid = self._open(), os.getpid()
+        return local.conn
+
+    def _failed(self, action, error):
+        with self._lock:
+            self.errors += 1
+        logging.warning(f"Shared cache {self.path}: {action} failed: {error}")
+
+    def get(self, key):
+        try:
+            row = self._connection().execute("SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                                             (key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            self._failed("read", e)
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        try:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)",
+                         (key, expires_at, json.dumps(value, separators=(',', ':'))))
+            if prune:
+                self._prune(conn)
+        except sqlite3.Error as e:
+            self._failed("write", e)
+
+    def _prune(self, conn):
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        evicted = conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at "
+            "LIMIT MAX((SELECT COUNT(*) FROM cache) - ?, 0))",
+            (self.maxsize,)
+        ).rowcount
+        with self._lock:
+            self.evictions += evicted
+
+    def invalidate(self, key):
+        try:
+            self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM cache")
+        except sqlite3.Error as e:
+            self._failed("clear", e)
+
+    def stats(self):
+        try:
+            size = self._connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error as e:
+            self._failed("count", e)
+            size = None
+        with self._lock:
+            return {"size": size, "max_size": self.maxsize, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "errors": self.errors}
@@ -0,0 +1,157 @@
+"""Backend-neutral conformance checks for storage.Repository implementations.
+
+``check_repository(repo)`` drives a throwaway pair of users through every
+repository method and compares the results with what the routes rely on;
+it returns a list of failure descriptions (empty when the backend conforms)
+and removes its users afterwards. tests/test_storage_conformance.py runs it
+against both backends; ``flask --app app check-storage [--backend sqlite
+--sqlite-path FILE]`` runs it against a deployed database.
+"""
+import uuid
+from datetime import date, time
+
+from storage import StorageError
+
+
+class _Checks:
+    def __init__(self):
+        self.failures = []
+
+    def equal(self, label, actual, expected):
+        if actual != expected:
+            self.failures.append(f"{label}: expected {expected!r}, got {actual!r}")
+
+    def true(self, label, condition):
+        if not condition:
+            self.failures.append(label)
+
+
+def check_repository(repo, volumes=None):
+    """Returns a list of failures; exercises users, prices, entries and reports."""
+    volumes = volumes or {"Roma": 40, "Vienna": 90}
+    checks = _Checks()
+    suffix = uuid.uuid4().hex[:10]
+    user_id = other_id = None
+    try:
+        user_id = repo.create_user(f"conformance_{suffix}", "hash-1")
+        other_id = repo.create_user(f"conformance_other_{suffix}", "hash-2", "USD", "$")
+        checks.true("create_user returns an id", isinstance(user_id, int) and isinstance(other_id, int))
+        checks.equal("create_user with a taken username", repo.create_user(f"conformance_{suffix}", "x"), None)
+
+        user = repo.find_user(f"conformance_{suffix}")
+        checks.equal("find_user", user and {k: user[k] for k in ("id", "password_hash", "currency_code")},
+                     {"id": user_id, "password_hash": "hash-1", "currency_code": "EUR"})
+        checks.equal("find_user for an unknown name", repo.find_user(f"missing_{suffix}"), None)
+        repo.set_password_hash(user_id, "hash-1b")
+        checks.equal("set_password_hash", repo.find_user(f"conformance_{suffix}")['password_hash'], "hash-1b")
+
+        checks.equal("user_profile defaults", repo.user_profile(user_id),
+                     {"currency_code": "EUR", "currency_symbol": "€", "prices": {}})
+        checks.equal("user_profile for an unknown user", repo.user_profile(-1), None)
+        checks.equal("data_version for an unknown user", repo.data_version(-1), None)
+
+        changes, cursor, reset = repo.changes_since(user_id, None, 100)
+        checks.equal("changes_since without a cursor", (changes, reset), ([], True))
+
+        version = repo.data_version(user_id)
+        day, next_day = date(2024, 2, 28), date(2024, 2, 29)
+        february = (date(2024, 2, 1), date(2024, 3, 1))
+        first = repo.add_entry(user_id, "Vienna", day, time(14, 5), 0.54)
+        second = repo.add_entry(user_id, "Roma", day, time(8, 30), 0.5)
+        checks.equal("add_entry day totals", (first[1:], second[1:]), ((1, 0.54), (2, 1.04)))
+        repo.add_entry(user_id, "Roma", next_day, time(9, 0), 0.5)
+        repo.add_entry(user_id, "Roma", date(2024, 3, 1), time(9, 0), 0.5)
+        repo.add_entry(other_id, "Roma", day, time(9, 0), 0.5)
+        checks.true("data_version changes on add_entry", repo.data_version(user_id) != version)
+
+        changes, page_cursor, reset = repo.changes_since(user_id, cursor, 100)
+        checks.equal("changes_since lists the user's inserts", [(c['op'], c['entry_date']) for c in changes],
+                     [("insert", day), ("insert", day), ("insert", next_day), ("insert", date(2024, 3, 1))])
+        checks.equal("changes_since insert details", changes[:1] and {k: changes[0][k] for k in (
+                     "id", "coffee_type", "entry_time", "cost")},
+                     {"id": first[0], "coffee_type": "Vienna", "entry_time": time(14, 5), "cost": 0.54})
+        checks.true("changes_since is ordered by seq", [c['seq'] for c in changes] == sorted(c['seq'] for c in changes))
+        checks.equal("changes_since cursor", (page_cursor, reset), (changes[-1]['seq'] if changes else None, False))
+        paged, paged_cursor, _ = repo.changes_since(user_id, cursor, 2)
+        checks.equal("changes_since limit", (len(paged), paged_cursor), (2, changes[1]['seq'] if changes else None))
+        checks.equal("changes_since when up to date", repo.changes_since(user_id, page_cursor, 100),
+                     ([], page_cursor, False))
+        checks.true("changes_since with a cursor ahead of the feed resets",
+                    repo.changes_since(user_id, page_cursor + 1000000, 100)[2])
+        checks.equal("period_changed without a position", repo.period_changed(user_id, None, *february),
+                     (page_cursor, True))
+        checks.equal("period_changed when up to date", repo.period_changed(user_id, page_cursor, *february),
+                     (page_cursor, False))
+        cursor = page_cursor
+
+        entries = repo.day_entries(user_id, day)
+        checks.equal("day_entries ordered by time",
+                     [(e['id'], e['coffee_type'], e['entry_time'], e['cost']) for e in entries],
+                     [(second[0], "Roma", time(8, 30), 0.5), (first[0], "Vienna", time(14, 5), 0.54)])
+
+        checks.equal("type_breakdown", repo.type_breakdown(user_id, *february),
+                     [{"coffee_type": "Roma", "count": 2, "total_cost": 1.0},
+                      {"coffee_type": "Vienna", "count": 1, "total_cost": 0.54}])
+        checks.equal("type_breakdown with type filter", repo.type_breakdown(user_id, *february, 'Vienna'),
+                     [{"coffee_type": "Vienna", "count": 1, "total_cost": 0.54}])
+        checks.equal("type_breakdown of an empty period", repo.type_breakdown(user_id, date(2023, 1, 1),
+                                                                              date(2023, 2, 1)), [])
+
+        checks.equal("range_series by day", repo.range_series(user_id, day, date(2024, 3, 1), 'day', volumes), [
+            {"period": day, "count": 2, "cost": 1.04, "volume_ml": 130},
+            {"period": next_day, "count": 1, "cost": 0.5, "volume_ml": 40},
+            {"period": date(2024, 3, 1), "count": 1, "cost": 0.5, "volume_ml": 40},
+        ])
+        checks.equal("range_series by week, zero-filled",
+                     [(p['period'], p['count']) for p in repo.range_series(user_id, date(2024, 2, 20),
+                                                                          date(2024, 3, 6), 'week', volumes)],
+                     [(date(2024, 2, 19), 0), (date(2024, 2, 26), 4), (date(2024, 3, 4), 0)])
+        checks.equal("range_series by month with type filter",
+                     [(p['period'], p['count'], p['volume_ml'])
+                      for p in repo.range_series(user_id, day, date(2024, 3, 1), 'month', volumes, 'Roma')],
+                     [(date(2024, 2, 1), 2, 80), (date(2024, 3, 1), 1, 40)])
+
+        activity = sorted((r['entry_date'], r['hour'], r['coffee_type'], r['count'], r['cost'], r['volume_ml'])
+                          for r in repo.year_activity(user_id, date(2024, 1, 1), date(2025, 1, 1)))
+        checks.equal("year_activity", activity, [
+            (day, 8, "Roma", 1, 0.5, 40), (day, 14, "Vienna", 1, 0.54, 90),
+            (next_day, 9, "Roma", 1, 0.5, 40), (date(2024, 3, 1), 9, "Roma", 1, 0.5, 40),
+        ])
+        checks.equal("year_activity with type filter",
+                     [r['entry_date'] for r in repo.year_activity(user_id, *february, 'Vienna')], [day])
+
+        checks.equal("delete_entry of another user's entry", repo.delete_entry(other_id, first[0]), None)
+        checks.equal("delete_entry", repo.delete_entry(user_id, first[0]), (day, 1, 0.5))
+        checks.equal("delete_entry twice", repo.delete_entry(user_id, first[0]), None)
+        checks.equal("clear_day", repo.clear_day(user_id, day), 1)
+        checks.equal("day_entries after clear_day", repo.day_entries(user_id, day), [])
+        checks.equal("other user's entries untouched", len(repo.day_entries(other_id, day)), 1)
+        checks.equal("type_breakdown after deletes", repo.type_breakdown(user_id, *february),
+                     [{"coffee_type": "Roma", "count": 1, "total_cost": 0.5}])
+        checks.equal("period_changed after deletes in the period",
+                     repo.period_changed(user_id, cursor, *february)[1], True)
+        checks.equal("period_changed for an untouched period",
+                     repo.period_changed(user_id, cursor, date(2024, 3, 1), date(2024, 4, 1))[1], False)
+        checks.equal("changes_since lists deletes", [(c['op'], c['id']) for c in repo.changes_since(
+                     user_id, cursor, 100)[0]], [("delete", first[0]), ("delete", second[0])])
+
+        version = repo.data_version(user_id)
+        checks.equal("update_currency", repo.update_currency(user_id, "GBP", "£"), ("GBP", "£"))
+        checks.equal("update_currency for an unknown user", repo.update_currency(-1, "GBP", "£"), None)
+        checks.true("data_version changes on update_currency", repo.data_version(user_id) != version)
+        version = repo.data_version(user_id)
+        repo.replace_prices(user_id, {"Roma": 0.6, "Vienna": 0.0})
+        checks.equal("replace_prices", repo.user_profile(user_id),
+                     {"currency_code": "GBP", "currency_symbol": "£", "prices": {"Roma": 0.6, "Vienna": 0.0}})
+        checks.true("data_version changes on replace_prices", repo.data_version(user_id) != version)
+        repo.replace_prices(user_id, {})
+        checks.equal("replace_prices with nothing clears", repo.user_profile(user_id)['prices'], {})
+    except StorageError as e:
+        checks.failures.append(f"StorageError: {e}")
+    finally:
+        for uid in (user_id, other_id):
+            if uid is not None:
+                repo.delete_user(uid)
+    if user_id is not None:
+        checks.equal("delete_user", repo.user_profile(user_id), None)
+    return checks.failures
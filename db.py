@@ -0,0 +1,329 @@
+"""Pooled PostgreSQL connections for the coffee tracker.
+
+Routes keep calling ``get_db_connection()`` and ``conn.close()`` exactly as
+before; the connection they get is a thin proxy whose ``close()`` hands the
+underlying psycopg2 connection back to the pool instead of tearing down the
+TCP session.
+"""
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class PooledConnection:
+    """Proxy around a pooled psycopg2 connection; ``close()`` returns it to the pool."""
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._conn = raw_conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    @property
+    def returned(self):
+        return self._conn is None
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Thread-safe bounded pool with health checks and checkout statistics."""
+
+    def __init__(self, minconn, maxconn, timeout=5.0, ping_after=30.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool bounds: min={minconn}, max={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._connect_kwargs = connect_kwargs
+        self._idle = []  # list of (raw_conn, returned_at)
+        self._in_use = set()
+        self._reserved = 0  # slots claimed by checkouts still pinging or connecting
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            "checkouts": 0, "timeouts": 0, "connects": 0, "discarded": 0,
+            "checkout_wait_total_ms": 0.0, "checkout_wait_max_ms": 0.0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._cond:
+            self._stats["connects"] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._stats["discarded"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, idle_for):
+        """Cheap checks always; a round-trip ping only for long-idle connections."""
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        if self.ping_after is not None and idle_for >= self.ping_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def getconn(self):
+        """Checks out a healthy connection, blocking up to ``timeout`` seconds.
+
+        Only the bookkeeping runs under the lock. The health check and
+        psycopg2.connect() run after a slot has been reserved, so a slow or
+        hanging server never holds up other checkouts and returns.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn, idle_for = self._reserve(deadline)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                elif not self._is_healthy(conn, idle_for):
+                    logging.warning("Discarding broken pooled PostgreSQL connection.")
+                    self._discard(conn)
+                    conn = None
+            except BaseException:
+                self._release_slot()
+                raise
+            if conn is not None:
+                return self._checked_out(conn, started)
+            self._release_slot()
+
+    def _reserve(self, deadline):
+        """Claims an idle connection as (conn, idle_for), or room for a new one as (None, None)."""
+        with self._cond:
+            if self._closed:
+                raise psycopg2.InterfaceError("connection pool is closed")
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn, returned_at = self._idle.pop()
+                        self._reserved += 1
+                        return conn, time.monotonic() - returned_at
+                    if len(self._in_use) + self._reserved < self.maxconn:
+                        self._reserved += 1
+                        return None, None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"Timed out after {self.timeout}s waiting for a database connection "
+                            f"({len(self._in_use)}/{self.maxconn} in use)"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def _release_slot(self):
+        with self._cond:
+            self._reserved -= 1
+            self._cond.notify()
+
+    def _checked_out(self, conn, started):
+        waited_ms = (time.monotonic() - started) * 1000.0
+        with self._cond:
+            self._reserved -= 1
+            self._in_use.add(conn)
+            self._stats["checkouts"] += 1
+            self._stats["checkout_wait_total_ms"] += waited_ms
+            self._stats["checkout_wait_max_ms"] = max(self._stats["checkout_wait_max_ms"], waited_ms)
+        return conn
+
+    def putconn(self, conn):
+        """Returns a connection; anything left mid-transaction is rolled back.
+
+        The rollback and any close run outside the lock, like getconn()'s I/O.
+        The connection stays counted as in use until it is back in the pool.
+        """
+        keep = not self._closed and not conn.closed
+        if keep and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                keep = False
+        with self._cond:
+            self._in_use.discard(conn)
+            keep = keep and not self._closed and len(self._idle) + len(self._in_use) + self._reserved < self.maxconn
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if not keep:
+            self._discard(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "timeouts": self._stats["timeouts"],
+                "connects": self._stats["connects"],
+                "discarded": self._stats["discarded"],
+                "checkout_wait_avg_ms": round(self._stats["checkout_wait_total_ms"] / checkouts, 3) if checkouts else 0.0,
+                "checkout_wait_max_ms": round(self._stats["checkout_wait_max_ms"], 3),
+            }
+
+
+class _PoolSlot:
+    """One lazily built, per-process pool and the connect() arguments for it."""
+
+    def __init__(self, label, env_prefix):
+        self.label = label
+        self.env_prefix = env_prefix
+        self.connect_kwargs = {}
+        self.pool = None
+        self.pid = None
+
+    def _setting(self, name, default):
+        # Replica settings fall back to the primary's (DB_REPLICA_POOL_MAX -> DB_POOL_MAX).
+        return os.environ.get(f'{self.env_prefix}_{name}', os.environ.get(f'DB_POOL_{name}', default))
+
+    def get(self):
+        if self.pool is None or self.pid != os.getpid():
+            with _pool_lock:
+                if self.pool is None or self.pid != os.getpid():
+                    self.pid = os.getpid()
+                    self.pool = ConnectionPool(
+                        minconn=int(self._setting('MIN', "1")),
+                        maxconn=int(self._setting('MAX', "10")),
+                        timeout=float(self._setting('TIMEOUT', "5")),
+                        ping_after=float(self._setting('PING_AFTER', "30")),
+                        **self.connect_kwargs,
+                    )
+                    logging.info(f"PostgreSQL {self.label} pool ready (min={self.pool.minconn}, max={self.pool.maxconn}).")
+        return self.pool
+
+    def forget(self):
+        """Drops the pool reference; returns the pool if this process built it."""
+        with _pool_lock:
+            pool = self.pool if self.pid == os.getpid() else None
+            self.pool = None
+            self.pid = None
+        return pool
+
+
+_pool_lock = threading.Lock()
+_primary = _PoolSlot("primary", "DB_POOL")
+_replica = _PoolSlot("replica", "DB_REPLICA_POOL")
+
+
+def configure(**connect_kwargs):
+    """Sets the psycopg2.connect() arguments used when the pool is first built."""
+    _primary.connect_kwargs.clear()
+    _primary.connect_kwargs.update(connect_kwargs)
+
+
+def configure_replica(**connect_kwargs):
+    """Sets the connect() arguments for the optional read-replica pool (e.g. dsn=...)."""
+    _replica.connect_kwargs.clear()
+    _replica.connect_kwargs.update(connect_kwargs)
+
+
+def replica_configured():
+    return bool(_replica.connect_kwargs)
+
+
+def get_pool():
+    """Lazily builds the process-wide pool, sized from the DB_POOL_* environment.
+
+    The pool belongs to the process that built it: a forked worker gets a
+    fresh pool of its own on first use (see reset_after_fork).
+    """
+    return _primary.get()
+
+
+def get_replica_pool():
+    """The read-replica pool, sized from DB_REPLICA_POOL_* (defaulting to DB_POOL_*)."""
+    if not replica_configured():
+        raise psycopg2.InterfaceError("no read replica configured")
+    return _replica.get()
+
+
+def reset_after_fork():
+    """Forgets pools inherited from the parent process without closing them.
+
+    The inherited sockets are shared with the parent; closing them here would
+    end the parent's sessions, so they are only dropped.
+    """
+    for slot in (_primary, _replica):
+        with _pool_lock:
+            slot.pool = None
+            slot.pid = None
+
+
+def close_pool():
+    """Closes this process's pools (worker shutdown); a later checkout rebuilds them."""
+    for slot in (_primary, _replica):
+        pool = slot.forget()
+        if pool is not None:
+            pool.closeall()
+
+
+def checkout():
+    """Returns a ``PooledConnection`` from the process-wide pool."""
+    pool = get_pool()
+    return PooledConnection(pool, pool.getconn())
+
+
+def checkout_replica():
+    """Returns a ``PooledConnection`` from the read-replica pool."""
+    pool = get_replica_pool()
+    return PooledConnection(pool, pool.getconn())
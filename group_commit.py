@@ -0,0 +1,196 @@
+"""Group commit for single-entry inserts (GROUP_COMMIT=1, Postgres only).
+
+Instead of one transaction and one commit per ``POST /api/coffees/<date>``,
+requests hand their row to a per-process flusher thread and wait. The
+flusher collects rows for up to GROUP_COMMIT_WINDOW_MS (or until
+GROUP_COMMIT_MAX_BATCH rows are waiting) and writes them with one multi-row
+INSERT, one rollup update per user and one commit, then hands every waiter
+its own entry id and day totals. If the batch fails, its rows are retried one
+by one so only the offending request sees the error. A request that times
+out while its row is still queued withdraws the row; once the row's batch
+is executing, the request waits for it a while longer, and then reports
+that the outcome is unknown rather than blocking forever.
+
+Each request's day totals are read after the whole batch is applied, so two
+cups logged by the same user for the same day in one batch both report the
+final total.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import psycopg2
+import psycopg2.extras
+
+import db
+import metrics
+import rollups
+from storage import StorageError, WriteOutcomeUnknown
+
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT', "0") == "1"
+WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', "3"))
+MAX_BATCH = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', "64"))
+TIMEOUT = float(os.environ.get('GROUP_COMMIT_TIMEOUT', "10"))
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# Ids are drawn in a materialized CTE so each VALUES ordinal maps to its id
+# without relying on the order of INSERT ... RETURNING.
+INSERT_SQL = """
+    WITH v AS (
+        SELECT nextval(pg_get_serial_sequence('coffee_entries', 'id')) AS id, t.*
+        FROM (VALUES %s) AS t(ord, user_id, coffee_type, entry_date, entry_time, cost)
+    ), inserted AS (
+        INSERT INTO coffee_entries (id, user_id, coffee_type, entry_date, entry_time, cost)
+        SELECT id, user_id, coffee_type, entry_date, entry_time, cost FROM v
+    )
+    SELECT ord, id FROM v
+"""
+INSERT_TEMPLATE = "(%s::int, %s::int, %s::text, %s::date, %s::time, %s::numeric)"
+
+
+class GroupCommitter:
+    """Batches add_entry calls from concurrent requests into shared transactions."""
+
+    def __init__(self, connect=None, window_ms=WINDOW_MS, max_batch=MAX_BATCH, timeout=TIMEOUT, on_commit=None):
+        self._connect = connect or db.checkout
+        # Called as on_commit(conn, user_ids) after each batch commits, like
+        # PostgresRepository.on_data_write.
+        self.on_commit = on_commit
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._batch_sizes = metrics.Histogram(BATCH_SIZE_BUCKETS)
+        self._stats = {"commits": 0, "rows": 0, "failed_batches": 0, "row_errors": 0}
+
+    def _ensure_flusher(self):
+        # Threads don't survive fork(); each worker process starts its own.
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def submit(self, user_id, coffee_type, entry_date, entry_time, cost):
+        """Queues one insert and blocks until its batch commits.
+
+        Returns (entry_id, day_count, day_total_cost); raises StorageError, or
+        WriteOutcomeUnknown when the row's batch is stuck.
+        """
+        self._ensure_flusher()
+        future = Future()
+        self._queue.put(((user_id, coffee_type, entry_date, entry_time, cost), future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # A timed-out row is withdrawn only while it is still queued. Once the
+            # flusher has taken it into a batch, we wait once more for that batch's
+            # outcome. A plain StorageError from this method therefore always means
+            # the row was not written, so the client can retry without creating a
+            # duplicate. If the batch is stuck (e.g. a hung COMMIT), we stop waiting
+            # with WriteOutcomeUnknown instead: the row may still commit.
+            if future.cancel():
+                raise StorageError(f"Insert not committed within {self.timeout}s")
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise WriteOutcomeUnknown(f"Insert still in flight after {2 * self.timeout}s")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Drops rows whose submitter timed out; the rest can no longer be withdrawn.
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            results = self._write([row for row, _ in batch])
+        except psycopg2.Error as e:
+            with self._lock:
+                self._stats["failed_batches"] += 1
+            if len(batch) == 1:
+                with self._lock:
+                    self._stats["row_errors"] += 1
+                batch[0][1].set_exception(StorageError(str(e)))
+                return
+            logging.warning(f"Group commit of {len(batch)} rows failed ({e}); retrying rows individually.")
+            for item in batch:
+                self._flush([item])
+            return
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _write(self, rows):
+        """One transaction for all rows; returns [(entry_id, day_count, day_total_cost)] in order."""
+        conn = self._connect()
+        try:
+            cur = conn.cursor()
+            returned = psycopg2.extras.execute_values(
+                cur, INSERT_SQL,
+                [(ordinal, *row) for ordinal, row in enumerate(rows)],
+                template=INSERT_TEMPLATE, page_size=len(rows), fetch=True
+            )
+            ids = dict(returned)
+            by_user = defaultdict(list)
+            for user_id, coffee_type, entry_date, _, cost in rows:
+                by_user[user_id].append((coffee_type, entry_date, cost))
+            # Users in a fixed order so concurrent writers lock rollup rows consistently.
+            for user_id in sorted(by_user):
+                rollups.record_inserts(cur, user_id, by_user[user_id])
+            days = sorted({(row[0], row[2]) for row in rows})
+            cur.execute(
+                f"SELECT r.user_id, r.entry_date, SUM(r.entry_count), SUM(r.total_cost) "
+                f"FROM {rollups.DAILY_TABLE} r "
+                f"JOIN unnest(%s::int[], %s::date[]) AS d(user_id, entry_date) USING (user_id, entry_date) "
+                f"GROUP BY r.user_id, r.entry_date",
+                ([user_id for user_id, _ in days], [entry_date for _, entry_date in days])
+            )
+            totals = {(user_id, entry_date): (int(count), round(float(total), 2))
+                      for user_id, entry_date, count, total in cur.fetchall()}
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        else:
+            if self.on_commit is not None:
+                self.on_commit(conn, sorted(by_user))
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats["commits"] += 1
+            self._stats["rows"] += len(rows)
+            self._batch_sizes.observe(len(rows))
+        return [(ids[ordinal], *totals.get((row[0], row[2]), (0, 0.0))) for ordinal, row in enumerate(rows)]
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "window_ms": self.window * 1000.0, "max_batch": self.max_batch,
+                    "queued": self._queue.qsize()}
+
+    def batch_size_histogram(self):
+        return self._batch_sizes
@@ -0,0 +1,62 @@
+"""Production server settings: a preforking gunicorn with threaded workers.
+
+Run with ``python main.py`` (or ``gunicorn app:app``, which reads this file
+from the working directory). Settings come from the environment:
+
+    WEB_BIND              address to listen on (default 0.0.0.0:8000)
+    WEB_WORKERS           worker processes (default: CPU count)
+    WEB_THREADS           request threads per worker (default 4)
+    WEB_MAX_REQUESTS      recycle a worker after this many requests (default 2000, 0 = never)
+    WEB_MAX_REQUESTS_JITTER  random extra requests so workers don't recycle together (default 200)
+    WEB_TIMEOUT           seconds before a silent worker is killed (default 30)
+    WEB_GRACEFUL_TIMEOUT  seconds in-flight requests get to finish on stop/reload (default 30)
+    WEB_KEEPALIVE         seconds an idle keep-alive connection is held open (default 2)
+
+The app is imported once in the master (``preload_app``) and forked, so
+workers share its code pages. Process-bound state is rebuilt per worker:
+the PostgreSQL pool is dropped in ``post_fork`` (db.reset_after_fork), and
+the password-hashing pool, group-commit flusher, shop statistics refresher
+and SQLite connections notice the new pid on first use. Each worker opens up to DB_POOL_MAX
+connections; keep DB_POOL_MAX >= WEB_THREADS.
+
+Signals: TERM stops gracefully (workers finish in-flight requests for up to
+WEB_GRACEFUL_TIMEOUT), HUP replaces every worker the same way. Because the
+app is preloaded, HUP does not pick up new code; to deploy, send USR2 (a
+new master with the new code starts alongside), then TERM the old master.
+Requests a worker has started always complete; connections still waiting in
+the listen backlog at TERM, and idle keep-alive connections of a recycled
+worker, are closed unanswered, so put the server behind a proxy that drains
+or retries (or set WEB_KEEPALIVE=0).
+"""
+import os
+
+bind = os.environ.get('WEB_BIND', "0.0.0.0:8000")
+workers = int(os.environ.get('WEB_WORKERS', str(os.cpu_count() or 1)))
+threads = int(os.environ.get('WEB_THREADS', "4"))
+worker_class = "gthread"
+preload_app = True
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', "2000"))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', "200"))
+timeout = int(os.environ.get('WEB_TIMEOUT', "30"))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', "30"))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', "2"))
+
+
+def when_ready(server):
+    pool_max = int(os.environ.get('DB_POOL_MAX', "10"))
+    server.log.info(f"Serving with {workers} workers x {threads} threads; "
+                    f"up to {workers * pool_max} PostgreSQL connections (DB_POOL_MAX={pool_max} per worker).")
+    if pool_max < threads:
+        server.log.warning(f"DB_POOL_MAX={pool_max} is below WEB_THREADS={threads}; requests will queue for connections.")
+
+
+def post_fork(server, worker):
+    import db
+    db.reset_after_fork()
+
+
+def worker_exit(server, worker):
+    import db
+    import hashing
+    db.close_pool()
+    hashing.shutdown()
@@ -0,0 +1,116 @@
+"""Password hashing off the request thread.
+
+werkzeug's hashes are deliberately CPU-heavy. Running them inline lets a burst
+of logins stall every other request on the worker, so they run in a bounded
+process pool instead. At most PASSWORD_HASH_MAX_PENDING hash jobs may be
+running or queued; beyond that ``HasherBusy`` is raised right away so the
+route can answer 503 rather than pile up waiting requests.
+
+PASSWORD_HASH_WORKERS=0 hashes inline (handy for development).
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', "scrypt")
+HASH_SALT_LENGTH = int(os.environ.get('PASSWORD_HASH_SALT_LENGTH', "16"))
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', str(max(1, HASH_WORKERS) * 4)))
+HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', "10"))
+
+
+class HasherBusy(Exception):
+    """Too many hash jobs in flight; the caller should answer 503."""
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+_stats = {"submitted": 0, "rejected": 0}
+_current_prefix = None
+
+
+def _get_executor():
+    """One pool per process; rebuilt after a fork so workers never share it."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+                _executor_pid = os.getpid()
+                logging.info(f"Password hashing pool ready ({HASH_WORKERS} processes, {HASH_MAX_PENDING} max pending).")
+    return _executor
+
+
+def shutdown():
+    """Stops this process's hashing pool (worker shutdown); a later hash rebuilds it."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        executor = _executor if _executor_pid == os.getpid() else None
+        _executor = None
+        _executor_pid = None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def _release(_future):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def _run(fn, *args):
+    global _pending
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+    with _pending_lock:
+        if _pending >= HASH_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise HasherBusy(f"{HASH_MAX_PENDING} password hash jobs already pending")
+        _pending += 1
+        _stats["submitted"] += 1
+    try:
+        future = _get_executor().submit(fn, *args)
+    except BaseException:
+        _release(None)
+        raise
+    # The slot is freed when the job finishes, not when the caller stops
+    # waiting, so a timed-out hash still counts until the pool is done with it.
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        future.cancel()  # Frees the slot right away if the job hasn't started.
+        raise HasherBusy(f"Password hashing took longer than {HASH_TIMEOUT}s")
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, HASH_METHOD, HASH_SALT_LENGTH)
+
+
+def verify_password(stored_hash, password):
+    return _run(check_password_hash, stored_hash, password)
+
+
+def _method_prefix(stored_hash):
+    return stored_hash.split('$', 1)[0]
+
+
+def needs_rehash(stored_hash):
+    """True when stored_hash was made with different method/parameters than configured."""
+    global _current_prefix
+    if _current_prefix is None:
+        # Let werkzeug expand defaults (e.g. "scrypt" -> "scrypt:32768:8:1") once.
+        _current_prefix = _method_prefix(generate_password_hash("", HASH_METHOD, 1))
+    return _method_prefix(stored_hash) != _current_prefix
+
+
+def stats():
+    return {"workers": HASH_WORKERS, "max_pending": HASH_MAX_PENDING,
+            "pending": _pending,
+            "submitted": _stats["submitted"], "rejected": _stats["rejected"]}
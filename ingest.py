@@ -0,0 +1,130 @@
+"""Bulk loading of coffee entries (batch API and legacy JSON importer).
+
+Entries are validated up front, priced from a map resolved once per user, and
+written with multi-row ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` in
+chunked transactions. Entries carrying an ``import_key`` are idempotent:
+re-sending them is reported as a duplicate instead of inserting twice. Keys
+are unique per user and entry date (the partition key, see migrations/0007).
+Entries dated in an archived year are rejected: that year's keys were
+archived with its rows, so they could no longer catch a re-import.
+"""
+import logging
+from collections import Counter
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extras
+
+import partitions
+import rollups
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def legacy_log_entries(log):
+    """Flattens the coffee_log_BAK.json format ({date: [{type, time}]}) into entries.
+
+    Keys are derived from date, type, time and the ordinal among identical
+    entries that day, so two cups logged at the same minute both survive and a
+    re-run of the same file inserts nothing.
+    """
+    entries = []
+    if not isinstance(log, dict):
+        return entries
+    for date_string, day_entries in log.items():
+        seen = Counter()
+        for item in day_entries if isinstance(day_entries, list) else [day_entries]:
+            entry = dict(item) if isinstance(item, dict) else {"type": None, "time": None}
+            entry['date'] = date_string
+            identity = (str(entry.get('type')), str(entry.get('time')).strip().upper())
+            seen[identity] += 1
+            entry['key'] = f"legacy:{date_string}:{identity[0]}:{identity[1]}:{seen[identity]}"
+            entries.append(entry)
+    return entries
+
+
+def validate_entry(raw, costs):
+    """Returns (row_dict, None) or (None, error_message) for one raw entry."""
+    if not isinstance(raw, dict):
+        return None, "Entry must be an object."
+    missing = [field for field in ('date', 'type', 'time') if not raw.get(field)]
+    if missing:
+        return None, f"Missing {', '.join(missing)}."
+    for field in ('date', 'type', 'time'):
+        if not isinstance(raw[field], str):
+            return None, f"{field.capitalize()} must be a string."
+    if raw['type'] not in costs:
+        return None, f"Unknown coffee type: {raw['type']}"
+    try:
+        entry_date = datetime.strptime(raw['date'], '%Y-%m-%d').date()
+    except ValueError:
+        return None, "Invalid date format. Use YYYY-MM-DD."
+    try:
+        entry_time = datetime.strptime(raw['time'].strip(), '%I:%M %p').time()
+    except ValueError:
+        return None, "Invalid time format. Use HH:MM AM/PM."
+    key = raw.get('key')
+    if key is not None and (not isinstance(key, str) or len(key) > 255):
+        return None, "Key must be a string of at most 255 characters."
+    return {"coffee_type": raw['type'], "entry_date": entry_date, "entry_time": entry_time,
+            "cost": costs[raw['type']], "import_key": key}, None
+
+
+def ingest_entries(conn, user_id, raw_entries, costs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Validates and inserts raw_entries for one user.
+
+    costs maps every accepted coffee type to the price to log (the user's
+    custom price or the global default). Returns a summary with per-entry
+    errors indexed by position in raw_entries.
+    """
+    errors = []
+    valid = []
+    for index, raw in enumerate(raw_entries):
+        row, error = validate_entry(raw, costs)
+        if error:
+            errors.append({"index": index, "entry": raw, "error": error})
+        else:
+            valid.append((index, row))
+
+    archived = partitions.archived_periods(conn) if valid else []
+    if archived:
+        accepted = []
+        for index, row in valid:
+            if any(start <= row['entry_date'] < end for start, end in archived):
+                errors.append({"index": index, "entry": raw_entries[index],
+                               "error": f"{row['entry_date'].year} is archived; entries can't be imported into it."})
+            else:
+                accepted.append((index, row))
+        valid = accepted
+
+    inserted = 0
+    duplicates = 0
+    for chunk_start in range(0, len(valid), chunk_size):
+        chunk = valid[chunk_start:chunk_start + chunk_size]
+        cur = conn.cursor()
+        try:
+            returned = psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO coffee_entries (user_id, coffee_type, entry_date, entry_time, cost, import_key) "
+                "VALUES %s ON CONFLICT (user_id, entry_date, import_key) WHERE import_key IS NOT NULL DO NOTHING "
+                "RETURNING coffee_type, entry_date, cost",
+                [(user_id, row['coffee_type'], row['entry_date'], row['entry_time'], row['cost'], row['import_key'])
+                 for _, row in chunk],
+                page_size=len(chunk),
+                fetch=True
+            )
+            rollups.record_inserts(cur, user_id, returned)
+            conn.commit()
+            inserted += len(returned)
+            duplicates += len(chunk) - len(returned)
+        except psycopg2.Error as e:
+            conn.rollback()
+            logging.error(f"Bulk insert chunk failed for user {user_id}: {e}")
+            errors.extend({"index": index, "entry": raw_entries[index], "error": "Database error; chunk rolled back."}
+                          for index, _ in chunk)
+        finally:
+            cur.close()
+
+    errors.sort(key=lambda e: e['index'])
+    return {"received": len(raw_entries), "inserted": inserted,
+            "skipped_duplicates": duplicates, "errors": errors}
@@ -1,5 +1,19 @@
+"""Production entry point: ``python main.py`` runs the app under gunicorn.
+
+Settings live in gunicorn.conf.py and are read from WEB_* environment
+variables. Requires the ``server`` extra (gunicorn). For development use
+``flask --app app run --debug``.
+"""
+import os
+import sys
+
+
 def main():
-    print("Hello from coffee-tracker!")
+    from gunicorn.app.wsgiapp import run
+
+    config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+    sys.argv = [sys.argv[0], "--config", config, *sys.argv[1:], "app:app"]
+    run()
 
 
 if __name__ == "__main__":
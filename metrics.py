@@ -0,0 +1,227 @@
+"""Per-route request and SQL instrumentation, exposed in Prometheus text format.
+
+app.py opens a ``RequestTiming`` for every request; pooled connections are
+created with ``InstrumentedConnection`` so every cursor execution adds its
+count and duration to the current request (and is logged when slower than
+SLOW_QUERY_MS). Closing the request feeds the per-route histograms that
+``render()`` serializes for ``/metrics``. Values are per process: under a
+multi-worker server each worker reports its own series.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+
+import psycopg2.extensions
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', "200"))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+NO_ROUTE = "<unmatched>"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class RequestTiming:
+    """Accumulates what one request spent on the pool and on SQL."""
+
+    __slots__ = ("started", "queries", "query_seconds", "checkout_seconds", "slow_queries")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.checkout_seconds = 0.0
+        self.slow_queries = 0
+
+    def server_timing(self):
+        """Value for the Server-Timing response header."""
+        total = (time.perf_counter() - self.started) * 1000.0
+        db_ms = self.query_seconds * 1000.0
+        pool_ms = self.checkout_seconds * 1000.0
+        return (f'pool;dur={pool_ms:.2f}, db;dur={db_ms:.2f};desc="{self.queries} queries", '
+                f'app;dur={max(0.0, total - db_ms - pool_ms):.2f}, total;dur={total:.2f}')
+
+
+_current = contextvars.ContextVar('request_timing', default=None)
+_lock = threading.Lock()
+_request_seconds = {}    # (method, route) -> Histogram
+_request_queries = {}    # (method, route) -> Histogram
+_query_seconds = {}      # (route,) -> Histogram
+_checkout_seconds = {}   # (route,) -> Histogram
+_responses = {}          # (method, route, status) -> count
+_slow_queries = {}       # (route,) -> count
+
+
+def begin_request():
+    """Starts timing the current request; returns the token for end_request."""
+    return _current.set(RequestTiming())
+
+
+def current():
+    return _current.get()
+
+
+def record_checkout(seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.checkout_seconds += seconds
+
+
+def _record_query(query, seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.queries += 1
+        timing.query_seconds += seconds
+    if seconds * 1000.0 >= SLOW_QUERY_MS:
+        if timing is not None:
+            timing.slow_queries += 1
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        logging.warning(f"Slow query ({seconds * 1000.0:.1f} ms): {' '.join(str(query).split())[:500]}")
+
+
+def _observe(series, key, buckets, value):
+    histogram = series.get(key)
+    if histogram is None:
+        histogram = series[key] = Histogram(buckets)
+    histogram.observe(value)
+
+
+def end_request(token, method, route, status):
+    """Closes the current request's timing, records it under route, returns it."""
+    timing = _current.get()
+    _current.reset(token)
+    if timing is None:
+        return None
+    elapsed = time.perf_counter() - timing.started
+    route = route or NO_ROUTE
+    with _lock:
+        _observe(_request_seconds, (method, route), LATENCY_BUCKETS, elapsed)
+        _observe(_request_queries, (method, route), QUERY_COUNT_BUCKETS, timing.queries)
+        if timing.queries:
+            _observe(_query_seconds, (route,), LATENCY_BUCKETS, timing.query_seconds)
+        if timing.checkout_seconds:
+            _observe(_checkout_seconds, (route,), LATENCY_BUCKETS, timing.checkout_seconds)
+        _responses[(method, route, str(status))] = _responses.get((method, route, str(status)), 0) + 1
+        if timing.slow_queries:
+            _slow_queries[(route,)] = _slow_queries.get((route,), 0) + timing.slow_queries
+    return timing
+
+
+# --- Cursor instrumentation ---
+
+_instrumented_classes = {}
+
+
+def _instrumented_cursor(base):
+    cls = _instrumented_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _record_query(query, time.perf_counter() - started)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _record_query(query, time.perf_counter() - started)
+
+        InstrumentedCursor.__name__ = f"Instrumented{base.__name__}"
+        cls = _instrumented_classes[base] = InstrumentedCursor
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """psycopg2 connection whose cursors (whatever cursor_factory) report to metrics."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _instrumented_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+
+# --- Prometheus text exposition ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+def _histogram_lines(name, help_text, label_names, series):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key in sorted(series):
+        histogram = series[key]
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(label_names, key, [('le', _format_bound(bound))])} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(label_names, key, [('le', '+Inf')])} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(label_names, key)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(label_names, key)} {histogram.count}")
+    return lines
+
+
+def _counter_lines(name, help_text, label_names, series):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines.extend(f"{name}{_labels(label_names, key)} {value}" for key, value in sorted(series.items()))
+    return lines
+
+
+def render(gauges=None, counters=None, histograms=None):
+    """Prometheus text format.
+
+    gauges/counters are optional {name: (help, value)} maps and histograms an
+    optional {name: (help, Histogram)} map, for series kept outside this module.
+    """
+    with _lock:
+        lines = []
+        lines += _histogram_lines("coffee_http_request_duration_seconds", "Request latency by route.",
+                                  ("method", "route"), _request_seconds)
+        lines += _counter_lines("coffee_http_responses_total", "Responses by route and status.",
+                                ("method", "route", "status"), _responses)
+        lines += _histogram_lines("coffee_db_queries_per_request", "SQL statements executed per request.",
+                                  ("method", "route"), _request_queries)
+        lines += _histogram_lines("coffee_db_query_seconds", "Total SQL time per request.",
+                                  ("route",), _query_seconds)
+        lines += _histogram_lines("coffee_db_checkout_seconds", "Time waiting for pooled connections per request.",
+                                  ("route",), _checkout_seconds)
+        lines += _counter_lines("coffee_db_slow_queries_total", f"Statements slower than {SLOW_QUERY_MS:g} ms.",
+                                ("route",), _slow_queries)
+    for name, (help_text, value) in sorted((gauges or {}).items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    for name, (help_text, value) in sorted((counters or {}).items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+    for name, (help_text, histogram) in sorted((histograms or {}).items()):
+        lines += _histogram_lines(name, help_text, (), {(): histogram})
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,28 @@
+-- Baseline schema. Uses IF NOT EXISTS so databases created by hand before
+-- migrations existed are adopted without changes.
+
+CREATE TABLE IF NOT EXISTS users (
+    id              SERIAL PRIMARY KEY,
+    username        VARCHAR(80)  NOT NULL UNIQUE,
+    password_hash   VARCHAR(255) NOT NULL,
+    currency_code   VARCHAR(3)   NOT NULL DEFAULT 'EUR',
+    currency_symbol VARCHAR(5)   NOT NULL DEFAULT '€',
+    created_at      TIMESTAMPTZ  NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS coffee_entries (
+    id          SERIAL PRIMARY KEY,
+    user_id     INTEGER       NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    coffee_type VARCHAR(50)   NOT NULL,
+    entry_date  DATE          NOT NULL,
+    entry_time  TIME          NOT NULL,
+    cost        NUMERIC(10,2) NOT NULL,
+    created_at  TIMESTAMPTZ   NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS user_coffee_prices (
+    user_id     INTEGER       NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    coffee_type VARCHAR(50)   NOT NULL,
+    price       NUMERIC(10,2) NOT NULL CHECK (price >= 0),
+    PRIMARY KEY (user_id, coffee_type)
+);
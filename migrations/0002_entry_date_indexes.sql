@@ -0,0 +1,11 @@
+-- Serves the day log (user_id, entry_date ORDER BY entry_time) and the
+-- half-open date-range predicates used by the report routes. coffee_type and
+-- cost are included so report aggregates can be answered by index-only scans.
+CREATE INDEX IF NOT EXISTS idx_coffee_entries_user_date
+    ON coffee_entries (user_id, entry_date, entry_time)
+    INCLUDE (coffee_type, cost);
+
+-- Type-filtered reports (?type=Vienna) seek straight to one type's range.
+CREATE INDEX IF NOT EXISTS idx_coffee_entries_user_type_date
+    ON coffee_entries (user_id, coffee_type, entry_date)
+    INCLUDE (cost);
@@ -0,0 +1,37 @@
+-- Per-user, per-type aggregates maintained in the same transaction as every
+-- coffee_entries insert/delete (see rollups.py). Reports read these instead of
+-- re-aggregating raw entries.
+
+CREATE TABLE IF NOT EXISTS coffee_daily_rollups (
+    user_id     INTEGER       NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    entry_date  DATE          NOT NULL,
+    coffee_type VARCHAR(50)   NOT NULL,
+    entry_count INTEGER       NOT NULL,
+    total_cost  NUMERIC(12,2) NOT NULL,
+    PRIMARY KEY (user_id, entry_date, coffee_type)
+);
+
+-- month is always the first day of the month.
+CREATE TABLE IF NOT EXISTS coffee_monthly_rollups (
+    user_id     INTEGER       NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    month       DATE          NOT NULL CHECK (EXTRACT(DAY FROM month) = 1),
+    coffee_type VARCHAR(50)   NOT NULL,
+    entry_count INTEGER       NOT NULL,
+    total_cost  NUMERIC(12,2) NOT NULL,
+    PRIMARY KEY (user_id, month, coffee_type)
+);
+
+-- Backfill from existing history.
+LOCK TABLE coffee_entries IN SHARE MODE;
+
+INSERT INTO coffee_daily_rollups (user_id, entry_date, coffee_type, entry_count, total_cost)
+SELECT user_id, entry_date, coffee_type, COUNT(*), SUM(cost)
+FROM coffee_entries
+GROUP BY user_id, entry_date, coffee_type
+ON CONFLICT DO NOTHING;
+
+INSERT INTO coffee_monthly_rollups (user_id, month, coffee_type, entry_count, total_cost)
+SELECT user_id, date_trunc('month', entry_date)::date, coffee_type, SUM(entry_count), SUM(total_cost)
+FROM coffee_daily_rollups
+GROUP BY user_id, date_trunc('month', entry_date), coffee_type
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,7 @@
+-- Optional idempotency key for bulk/legacy imports: re-running an import
+-- skips entries whose key was already loaded for that user.
+ALTER TABLE coffee_entries ADD COLUMN IF NOT EXISTS import_key VARCHAR(255);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_coffee_entries_user_import_key
+    ON coffee_entries (user_id, import_key)
+    WHERE import_key IS NOT NULL;
@@ -0,0 +1,63 @@
+-- Per-user data version for conditional GETs (ETag / If-None-Match).
+-- Bumped by triggers on every write that can change a user's API responses,
+-- so no code path (routes, bulk import, CLI) can forget to do it.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION bump_user_data_version_from_new() RETURNS trigger AS $$
+BEGIN
+    UPDATE users SET data_version = data_version + 1
+    WHERE id IN (SELECT DISTINCT user_id FROM new_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_user_data_version_from_old() RETURNS trigger AS $$
+BEGIN
+    UPDATE users SET data_version = data_version + 1
+    WHERE id IN (SELECT DISTINCT user_id FROM old_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_user_data_version_on_settings() RETURNS trigger AS $$
+BEGIN
+    IF (NEW.currency_code, NEW.currency_symbol) IS DISTINCT FROM (OLD.currency_code, OLD.currency_symbol) THEN
+        NEW.data_version := OLD.data_version + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS coffee_entries_insert_version ON coffee_entries;
+CREATE TRIGGER coffee_entries_insert_version AFTER INSERT ON coffee_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_new();
+
+DROP TRIGGER IF EXISTS coffee_entries_delete_version ON coffee_entries;
+CREATE TRIGGER coffee_entries_delete_version AFTER DELETE ON coffee_entries
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_old();
+
+DROP TRIGGER IF EXISTS coffee_entries_update_version ON coffee_entries;
+CREATE TRIGGER coffee_entries_update_version AFTER UPDATE ON coffee_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_new();
+
+DROP TRIGGER IF EXISTS user_coffee_prices_insert_version ON user_coffee_prices;
+CREATE TRIGGER user_coffee_prices_insert_version AFTER INSERT ON user_coffee_prices
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_new();
+
+DROP TRIGGER IF EXISTS user_coffee_prices_update_version ON user_coffee_prices;
+CREATE TRIGGER user_coffee_prices_update_version AFTER UPDATE ON user_coffee_prices
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_new();
+
+DROP TRIGGER IF EXISTS user_coffee_prices_delete_version ON user_coffee_prices;
+CREATE TRIGGER user_coffee_prices_delete_version AFTER DELETE ON user_coffee_prices
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_old();
+
+DROP TRIGGER IF EXISTS users_settings_version ON users;
+CREATE TRIGGER users_settings_version BEFORE UPDATE OF currency_code, currency_symbol ON users
+    FOR EACH ROW EXECUTE FUNCTION bump_user_data_version_on_settings();
@@ -0,0 +1,20 @@
+-- Coffee catalog: volume (and default price) per coffee type, so reports can
+-- join volumes in SQL instead of looking them up in a Python dict.
+-- Rows here are not covered by users.data_version; after changing a volume,
+-- cached year summaries revalidate only once the user's data changes.
+CREATE TABLE IF NOT EXISTS coffee_catalog (
+    coffee_type  VARCHAR(50)   PRIMARY KEY,
+    default_cost NUMERIC(10,2) NOT NULL CHECK (default_cost >= 0),
+    volume_ml    INTEGER       NOT NULL CHECK (volume_ml >= 0)
+);
+
+INSERT INTO coffee_catalog (coffee_type, default_cost, volume_ml) VALUES
+    ('Chiaro', 0.55, 40),
+    ('Cosi', 0.49, 40),
+    ('Buenos Aires', 0.54, 90),
+    ('Vienna', 0.54, 90),
+    ('Roma', 0.50, 40),
+    ('Arpeggio', 0.50, 40),
+    ('Livanto', 0.50, 40),
+    ('Volluto Decaf', 0.52, 90)
+ON CONFLICT (coffee_type) DO NOTHING;
@@ -0,0 +1,130 @@
+-- Range-partitions coffee_entries by entry_date, one partition per year
+-- (coffee_entries_y2025, ...). Queries with an entry_date range only scan the
+-- partitions it overlaps. A DEFAULT partition catches dates without a yearly
+-- partition yet, so an insert never fails for lack of one;
+-- ensure_coffee_entry_partitions() moves such rows out when it creates the
+-- year (run by `flask --app app migrate` and `ensure-partitions`, see
+-- partitions.py).
+--
+-- Old years can be archived to compressed files and detached
+-- (`flask --app app archive-partitions`). Their hourly per-type totals stay
+-- in coffee_archived_activity, and their rollup rows are kept, so reports
+-- still cover archived years.
+--
+-- Unique constraints on a partitioned table must include the partition key:
+-- the primary key becomes (id, entry_date) and import keys become unique
+-- per user and entry date. Legacy import keys already embed the date.
+
+LOCK TABLE coffee_entries IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE coffee_entries RENAME TO coffee_entries_unpartitioned;
+ALTER INDEX coffee_entries_pkey RENAME TO coffee_entries_unpartitioned_pkey;
+DROP INDEX idx_coffee_entries_user_date;
+DROP INDEX idx_coffee_entries_user_type_date;
+DROP INDEX uq_coffee_entries_user_import_key;
+
+CREATE TABLE coffee_entries (
+    id          INTEGER       NOT NULL DEFAULT nextval('coffee_entries_id_seq'),
+    user_id     INTEGER       NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    coffee_type VARCHAR(50)   NOT NULL,
+    entry_date  DATE          NOT NULL,
+    entry_time  TIME          NOT NULL,
+    cost        NUMERIC(10,2) NOT NULL,
+    created_at  TIMESTAMPTZ   NOT NULL DEFAULT now(),
+    import_key  VARCHAR(255),
+    PRIMARY KEY (id, entry_date)
+) PARTITION BY RANGE (entry_date);
+
+-- Keeps pg_get_serial_sequence('coffee_entries', 'id') working (group_commit.py).
+ALTER SEQUENCE coffee_entries_id_seq OWNED BY coffee_entries.id;
+
+CREATE INDEX idx_coffee_entries_user_date
+    ON coffee_entries (user_id, entry_date, entry_time)
+    INCLUDE (coffee_type, cost);
+CREATE INDEX idx_coffee_entries_user_type_date
+    ON coffee_entries (user_id, coffee_type, entry_date)
+    INCLUDE (cost);
+CREATE UNIQUE INDEX uq_coffee_entries_user_import_key
+    ON coffee_entries (user_id, entry_date, import_key)
+    WHERE import_key IS NOT NULL;
+
+CREATE TABLE coffee_entries_default PARTITION OF coffee_entries DEFAULT;
+
+-- One row per archived yearly partition.
+CREATE TABLE coffee_entry_archives (
+    partition_name VARCHAR(63)  PRIMARY KEY,
+    period_start   DATE         NOT NULL,
+    period_end     DATE         NOT NULL,
+    row_count      BIGINT       NOT NULL,
+    archive_path   TEXT         NOT NULL,
+    sha256         CHAR(64)     NOT NULL,
+    archived_at    TIMESTAMPTZ  NOT NULL DEFAULT now()
+);
+
+-- What year_activity needs from archived entries (count and cost per user,
+-- day, hour of entry_time and type).
+CREATE TABLE coffee_archived_activity (
+    user_id     INTEGER       NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    entry_date  DATE          NOT NULL,
+    hour        SMALLINT      NOT NULL CHECK (hour BETWEEN 0 AND 23),
+    coffee_type VARCHAR(50)   NOT NULL,
+    entry_count INTEGER       NOT NULL,
+    total_cost  NUMERIC(12,2) NOT NULL,
+    PRIMARY KEY (user_id, entry_date, hour, coffee_type)
+);
+
+-- Creates the missing yearly partitions in [first_year, last_year], skipping
+-- archived years. Rows already sitting in the DEFAULT partition for a new
+-- year are moved into it before it is attached. Returns the number created.
+CREATE OR REPLACE FUNCTION ensure_coffee_entry_partitions(first_year INT, last_year INT) RETURNS INT AS $$
+DECLARE
+    y INT;
+    partition_name TEXT;
+    lower_bound DATE;
+    upper_bound DATE;
+    created INT := 0;
+BEGIN
+    FOR y IN first_year..last_year LOOP
+        partition_name := format('coffee_entries_y%s', y);
+        lower_bound := make_date(y, 1, 1);
+        upper_bound := make_date(y + 1, 1, 1);
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL
+            OR EXISTS (SELECT 1 FROM coffee_entry_archives a WHERE a.partition_name = format('coffee_entries_y%s', y));
+        EXECUTE format('CREATE TABLE %I (LIKE coffee_entries INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+        EXECUTE format('ALTER TABLE %I ADD CHECK (entry_date >= %L AND entry_date < %L)',
+                       partition_name, lower_bound, upper_bound);
+        EXECUTE format('WITH moved AS (DELETE FROM coffee_entries_default WHERE entry_date >= %L AND entry_date < %L '
+                       'RETURNING *) INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, partition_name);
+        EXECUTE format('ALTER TABLE coffee_entries ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, lower_bound, upper_bound);
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_coffee_entry_partitions(
+    LEAST(COALESCE((SELECT EXTRACT(YEAR FROM MIN(entry_date))::int FROM coffee_entries_unpartitioned),
+                   EXTRACT(YEAR FROM current_date)::int),
+          EXTRACT(YEAR FROM current_date)::int),
+    EXTRACT(YEAR FROM current_date)::int + 1
+);
+
+INSERT INTO coffee_entries (id, user_id, coffee_type, entry_date, entry_time, cost, created_at, import_key)
+SELECT id, user_id, coffee_type, entry_date, entry_time, cost, created_at, import_key
+FROM coffee_entries_unpartitioned;
+
+DROP TABLE coffee_entries_unpartitioned;
+
+-- Recreated after the copy so it does not bump every user's data_version.
+CREATE TRIGGER coffee_entries_insert_version AFTER INSERT ON coffee_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_new();
+CREATE TRIGGER coffee_entries_delete_version AFTER DELETE ON coffee_entries
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_old();
+CREATE TRIGGER coffee_entries_update_version AFTER UPDATE ON coffee_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version_from_new();
+
+ANALYZE coffee_entries;
@@ -0,0 +1,65 @@
+-- Per-user change feed of coffee_entries, read by GET /api/changes so the
+-- tracker page can keep day logs cached in the browser and fetch only what
+-- changed since its cursor (a seq value).
+--
+-- Filled by triggers, like data_version (0005), so every write path is
+-- covered: routes, group commit, bulk import, the async server and CLI.
+-- Archiving a year (partitions.py) drops rows without firing triggers; it
+-- logs one 'R' (reset) change per affected user instead.
+
+CREATE TABLE coffee_entry_changes (
+    seq         BIGSERIAL     PRIMARY KEY,
+    user_id     INTEGER       NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    op          CHAR(1)       NOT NULL CHECK (op IN ('I', 'D', 'R')),
+    entry_id    INTEGER,
+    entry_date  DATE,
+    coffee_type VARCHAR(50),
+    entry_time  TIME,
+    cost        NUMERIC(10,2),
+    changed_at  TIMESTAMPTZ   NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_coffee_entry_changes_user_seq ON coffee_entry_changes (user_id, seq);
+
+-- Changes up to pruned_through have been deleted (prune-changes); cursors
+-- older than that get a reset instead of an incomplete list.
+CREATE TABLE coffee_entry_changes_horizon (
+    id             BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    pruned_through BIGINT  NOT NULL DEFAULT 0
+);
+INSERT INTO coffee_entry_changes_horizon (id, pruned_through) VALUES (TRUE, 0);
+
+-- Locks the users rows first (the data_version triggers already hold the
+-- lock, so this is free), then draws seq values. Two transactions writing
+-- for the same user therefore commit in seq order, and a reader that has
+-- seen seq N never finds a smaller seq committed later.
+-- Users deleted in the same transaction (ON DELETE CASCADE) are skipped.
+CREATE OR REPLACE FUNCTION log_coffee_entry_changes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        PERFORM 1 FROM users WHERE id IN (SELECT user_id FROM old_rows) ORDER BY id FOR NO KEY UPDATE;
+        INSERT INTO coffee_entry_changes (user_id, op, entry_id, entry_date, coffee_type, entry_time, cost)
+        SELECT o.user_id, 'D', o.id, o.entry_date, o.coffee_type, o.entry_time, o.cost
+        FROM old_rows o JOIN users u ON u.id = o.user_id
+        ORDER BY o.entry_date, o.entry_time, o.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM 1 FROM users WHERE id IN (SELECT user_id FROM new_rows) ORDER BY id FOR NO KEY UPDATE;
+        INSERT INTO coffee_entry_changes (user_id, op, entry_id, entry_date, coffee_type, entry_time, cost)
+        SELECT n.user_id, 'I', n.id, n.entry_date, n.coffee_type, n.entry_time, n.cost
+        FROM new_rows n
+        ORDER BY n.entry_date, n.entry_time, n.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER coffee_entries_log_insert AFTER INSERT ON coffee_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_coffee_entry_changes();
+CREATE TRIGGER coffee_entries_log_delete AFTER DELETE ON coffee_entries
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_coffee_entry_changes();
+CREATE TRIGGER coffee_entries_log_update AFTER UPDATE ON coffee_entries
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_coffee_entry_changes();
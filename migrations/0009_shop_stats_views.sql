@@ -0,0 +1,60 @@
+-- All-users statistics for GET /api/shop/stats, kept in materialized views
+-- so the endpoint never aggregates every user's history per request.
+-- shop_stats.py refreshes them with REFRESH MATERIALIZED VIEW CONCURRENTLY
+-- (readers keep reading the previous contents meanwhile; this needs the
+-- unique indexes below) and records when in shop_stats_refreshes.
+--
+-- The views read the report rollups, so archived years still count.
+-- Costs are stored in each user's currency, so spend is kept per currency.
+
+CREATE MATERIALIZED VIEW shop_type_totals AS
+SELECT r.coffee_type, u.currency_code,
+       SUM(r.entry_count)::bigint AS cups,
+       SUM(r.total_cost) AS spend,
+       SUM(r.entry_count)::bigint * COALESCE(MAX(c.volume_ml), 0) AS volume_ml
+FROM coffee_monthly_rollups r
+JOIN users u ON u.id = r.user_id
+LEFT JOIN coffee_catalog c ON c.coffee_type = r.coffee_type
+GROUP BY r.coffee_type, u.currency_code
+HAVING SUM(r.entry_count) > 0;
+
+CREATE UNIQUE INDEX uq_shop_type_totals ON shop_type_totals (coffee_type, currency_code);
+
+-- Leaderboards cover the last 35 days and the last 12 ISO weeks (as of the
+-- refresh).
+CREATE MATERIALIZED VIEW shop_daily_leaders AS
+SELECT r.entry_date AS day, r.user_id,
+       SUM(r.entry_count)::int AS cups,
+       SUM(r.entry_count * COALESCE(c.volume_ml, 0))::int AS volume_ml
+FROM coffee_daily_rollups r
+LEFT JOIN coffee_catalog c ON c.coffee_type = r.coffee_type
+WHERE r.entry_date >= current_date - 35
+GROUP BY r.entry_date, r.user_id
+HAVING SUM(r.entry_count) > 0;
+
+CREATE UNIQUE INDEX uq_shop_daily_leaders ON shop_daily_leaders (day, user_id);
+CREATE INDEX idx_shop_daily_leaders_rank ON shop_daily_leaders (day, cups DESC, user_id);
+
+CREATE MATERIALIZED VIEW shop_weekly_leaders AS
+SELECT date_trunc('week', r.entry_date)::date AS week_start, r.user_id,
+       SUM(r.entry_count)::int AS cups,
+       SUM(r.entry_count * COALESCE(c.volume_ml, 0))::int AS volume_ml
+FROM coffee_daily_rollups r
+LEFT JOIN coffee_catalog c ON c.coffee_type = r.coffee_type
+WHERE r.entry_date >= date_trunc('week', current_date)::date - 77
+GROUP BY 1, r.user_id
+HAVING SUM(r.entry_count) > 0;
+
+CREATE UNIQUE INDEX uq_shop_weekly_leaders ON shop_weekly_leaders (week_start, user_id);
+CREATE INDEX idx_shop_weekly_leaders_rank ON shop_weekly_leaders (week_start, cups DESC, user_id);
+
+-- refreshed_at is the start of the refresh transaction: the view holds
+-- every write committed before it.
+CREATE TABLE shop_stats_refreshes (
+    view_name    VARCHAR(63)  PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ  NOT NULL,
+    duration_ms  INTEGER      NOT NULL DEFAULT 0
+);
+
+INSERT INTO shop_stats_refreshes (view_name, refreshed_at)
+VALUES ('shop_type_totals', now()), ('shop_daily_leaders', now()), ('shop_weekly_leaders', now());
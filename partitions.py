@@ -0,0 +1,157 @@
+"""Yearly partitions of coffee_entries: creation ahead of time and archiving.
+
+migrations/0007 partitions ``coffee_entries`` by year of entry_date, with a
+DEFAULT partition for dates that have no partition yet. ``ensure`` creates
+this year's partition and the next PARTITION_AHEAD_YEARS ones; it runs after
+``flask --app app migrate`` and DB_AUTO_MIGRATE, and as
+``flask --app app ensure-partitions`` (for cron).
+
+``archive_year`` handles one whole year at a time, in a single transaction:
+1. Copy the partition to ``<dir>/coffee_entries_y<year>.csv.gz``.
+2. Keep its hourly per-type totals in coffee_archived_activity.
+3. Record the archive in coffee_entry_archives.
+4. Detach and drop the partition.
+
+The rollup tables are left alone, so monthly/yearly/range reports and the
+year summary still cover archived years. Day logs and exports of an
+archived year are empty; the archive file holds those rows. Their import
+keys leave with them, so bulk ingest rejects entries dated in an archived
+year (see ``archived_periods``) rather than importing them a second time.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+from datetime import date
+
+from psycopg2 import sql
+
+PARTITION_AHEAD_YEARS = int(os.environ.get('PARTITION_AHEAD_YEARS', "1"))
+ARCHIVE_DIR = os.environ.get('PARTITION_ARCHIVE_DIR', "archive")
+_PARTITION_RE = re.compile(r'^coffee_entries_y(\d{4})$')
+
+
+def ensure(conn, ahead=PARTITION_AHEAD_YEARS, today=None):
+    """Creates missing partitions from this year through `ahead` years on; returns how many."""
+    year = (today or date.today()).year
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT ensure_coffee_entry_partitions(%s, %s)", (year, year + ahead))
+        created = cur.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    if created:
+        logging.info(f"Created {created} coffee_entries partition(s) through {year + ahead}.")
+    return created
+
+
+def list_partitions(conn):
+    """[{name, year, rows}] for the yearly partitions (year None for DEFAULT), oldest first."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT c.relname, c.reltuples::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'coffee_entries'::regclass ORDER BY c.relname"
+        )
+        found = []
+        for name, estimated_rows in cur.fetchall():
+            match = _PARTITION_RE.match(name)
+            found.append({"name": name, "year": int(match.group(1)) if match else None,
+                          "rows": max(estimated_rows, 0)})
+    finally:
+        cur.close()
+        conn.rollback()
+    found.sort(key=lambda p: (p['year'] is None, p['year'] or 0))
+    return found
+
+
+def archived_periods(conn):
+    """[(period_start, period_end)] of the archived years, oldest first."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT period_start, period_end FROM coffee_entry_archives ORDER BY period_start")
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def _write_archive(cur, partition, path):
+    """COPYs the partition as gzipped CSV to path (via a temp file); returns its sha256."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+            cur.copy_expert(
+                sql.SQL("COPY (SELECT id, user_id, coffee_type, entry_date, entry_time, cost, created_at, import_key "
+                        "FROM {} ORDER BY user_id, entry_date, entry_time, id) TO STDOUT WITH (FORMAT csv, HEADER)")
+                .format(sql.Identifier(partition)).as_string(cur),
+                f
+            )
+        raw.flush()
+        os.fsync(raw.fileno())
+    digest = hashlib.sha256()
+    with open(tmp_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    os.replace(tmp_path, path)
+    return digest.hexdigest()
+
+
+def archive_year(conn, year, directory=ARCHIVE_DIR):
+    """Archives and drops one yearly partition; returns a summary dict."""
+    partition = f"coffee_entries_y{year}"
+    path = os.path.join(directory, f"{partition}.csv.gz")
+    os.makedirs(directory, exist_ok=True)
+    ident = sql.Identifier(partition)
+    cur = conn.cursor()
+    try:
+        # Blocks writes to the year while it is copied; reads continue until DETACH.
+        cur.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(ident))
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(ident))
+        row_count = cur.fetchone()[0]
+        digest = _write_archive(cur, partition, path)
+        cur.execute(sql.SQL(
+            "INSERT INTO coffee_archived_activity AS a "
+            "(user_id, entry_date, hour, coffee_type, entry_count, total_cost) "
+            "SELECT user_id, entry_date, EXTRACT(HOUR FROM entry_time)::smallint, coffee_type, COUNT(*), SUM(cost) "
+            "FROM {} GROUP BY 1, 2, 3, 4 "
+            "ON CONFLICT (user_id, entry_date, hour, coffee_type) DO UPDATE SET "
+            "entry_count = a.entry_count + EXCLUDED.entry_count, total_cost = a.total_cost + EXCLUDED.total_cost"
+        ).format(ident))
+        # Day logs and exports of these users change (the rows leave coffee_entries),
+        # and clients caching their days must start over (see /api/changes).
+        cur.execute(sql.SQL(
+            "UPDATE users SET data_version = data_version + 1 WHERE id IN (SELECT DISTINCT user_id FROM {})"
+        ).format(ident))
+        cur.execute(sql.SQL(
+            "INSERT INTO coffee_entry_changes (user_id, op) SELECT DISTINCT user_id, 'R' FROM {}"
+        ).format(ident))
+        cur.execute(
+            "INSERT INTO coffee_entry_archives (partition_name, period_start, period_end, row_count, archive_path, sha256) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            (partition, date(year, 1, 1), date(year + 1, 1, 1), row_count, os.path.abspath(path), digest)
+        )
+        cur.execute(sql.SQL("ALTER TABLE coffee_entries DETACH PARTITION {}").format(ident))
+        cur.execute(sql.SQL("DROP TABLE {}").format(ident))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    logging.info(f"Archived {row_count} entries of {year} to {path} and dropped {partition}.")
+    return {"year": year, "partition": partition, "rows": row_count, "path": path, "sha256": digest}
+
+
+def archive_before(conn, before_year, directory=ARCHIVE_DIR):
+    """Archives every yearly partition older than before_year, oldest first."""
+    if before_year > date.today().year:
+        raise ValueError("Refusing to archive the current or a future year.")
+    years = [p['year'] for p in list_partitions(conn) if p['year'] is not None and p['year'] < before_year]
+    return [archive_year(conn, year, directory) for year in years]
+
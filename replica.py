@@ -0,0 +1,187 @@
+"""Routing read-only report queries to an optional streaming replica.
+
+Set DB_REPLICA_DSN (a libpq connection string) to enable it. Routes marked
+``@replica_reads`` in app.py then read from the replica pool when it is
+usable for the current request. Otherwise they read from the primary, as
+every write does. The replica is skipped when:
+
+* it failed recently (down): it is retried after REPLICA_RETRY_AFTER seconds;
+* its replay lag is above REPLICA_MAX_LAG seconds;
+* it has not yet replayed the user's last write (read-your-writes). Each
+  commit that changes a user's entries, prices or settings records the
+  primary's WAL position for that user in ``WritePositions``, read on the
+  same connection before it is released. The replica must have replayed at
+  least that far, whichever device, session or worker the user reads from:
+  positions are kept in the SQLite file at REPLICA_POSITIONS_PATH, shared
+  by every worker process on the host. Deployments spread over several
+  hosts need sticky sessions, as each host has its own file.
+
+The replica's position and lag are sampled at most every REPLICA_STATUS_TTL
+seconds per process. A sample that is slightly out of date understates the
+replica's progress, so it can only cause extra fallbacks to the primary,
+never a stale read.
+"""
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+
+import db
+from cache import LRUCache, SQLiteCache
+
+REPLICA_DSN = os.environ.get('DB_REPLICA_DSN', "")
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', "5"))
+REPLICA_STATUS_TTL = float(os.environ.get('REPLICA_STATUS_TTL', "1"))
+REPLICA_RETRY_AFTER = float(os.environ.get('REPLICA_RETRY_AFTER', "10"))
+REPLICA_POSITIONS_PATH = os.environ.get('REPLICA_POSITIONS_PATH', "coffee_tracker_replica_positions.sqlite3")
+REPLICA_POSITION_TTL = float(os.environ.get('REPLICA_POSITION_TTL', "300"))
+
+# Lag is zero while the replica has replayed everything it received;
+# pg_last_xact_replay_timestamp() alone grows while the primary is idle.
+STATUS_SQL = """
+    SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()::text,
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END
+"""
+FALLBACK_REASONS = ("down", "lag", "read_your_writes")
+
+
+def parse_lsn(lsn):
+    """'16/B374D848' -> int, so WAL positions compare numerically; None stays None."""
+    if not lsn:
+        return None
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def primary_lsn(conn):
+    """The primary's current WAL write position (text form)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_current_wal_lsn()::text")
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+class WritePositions:
+    """Each user's last data-write WAL position, shared by all of their sessions.
+
+    Positions are kept in memory per worker and, when path is set
+    (REPLICA_POSITIONS_PATH, which the app always passes), in a SQLiteCache
+    file shared by the workers on one host. Without the file, a user whose
+    requests reach another worker could read from a replica that hasn't
+    replayed their write. A position is dropped after ttl seconds, when the
+    replica has long passed it.
+    """
+
+    def __init__(self, path="", maxsize=10000, ttl=REPLICA_POSITION_TTL):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.shared = SQLiteCache(path, ttl=ttl) if path else None
+
+    def record(self, user_id, lsn):
+        self.memory.set(user_id, lsn)
+        if self.shared is not None:
+            self.shared.set(f"write_lsn:{user_id}", lsn)
+
+    def get(self, user_id):
+        """The user's last write position (text LSN), or None if none is remembered."""
+        positions = [self.memory.get(user_id)]
+        if self.shared is not None:
+            positions.append(self.shared.get(f"write_lsn:{user_id}"))
+        return max((lsn for lsn in positions if lsn), key=parse_lsn, default=None)
+
+
+class ReplicaRouter:
+    """Decides per request whether the replica may serve reads."""
+
+    def __init__(self, checkout=None, max_lag=REPLICA_MAX_LAG, status_ttl=REPLICA_STATUS_TTL,
+                 retry_after=REPLICA_RETRY_AFTER):
+        self._checkout = checkout or db.checkout_replica
+        self.max_lag = max_lag
+        self.status_ttl = status_ttl
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._status = None        # (replay_lsn_int, lag_seconds), from the last sample
+        self._checked_at = 0.0
+        self._down_until = 0.0
+        self._counts = {"replica": 0, **{reason: 0 for reason in FALLBACK_REASONS}}
+
+    def _sample(self):
+        conn = self._checkout()
+        try:
+            cur = conn.cursor()
+            cur.execute(STATUS_SQL)
+            in_recovery, replay_lsn, lag = cur.fetchone()
+            cur.close()
+            conn.rollback()
+        finally:
+            conn.close()
+        if not in_recovery:
+            raise psycopg2.OperationalError("DB_REPLICA_DSN does not point at a standby (not in recovery)")
+        return parse_lsn(replay_lsn), float(lag)
+
+    def status(self):
+        """(replay_lsn, lag_seconds), or None while the replica is considered down."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._down_until:
+                return None
+            if self._status is not None and now - self._checked_at < self.status_ttl:
+                return self._status
+        try:
+            sampled = self._sample()
+        except psycopg2.Error as e:
+            self.mark_down(e)
+            return None
+        with self._lock:
+            self._status, self._checked_at = sampled, time.monotonic()
+        return sampled
+
+    def mark_down(self, error):
+        with self._lock:
+            already_down = time.monotonic() < self._down_until
+            self._down_until = time.monotonic() + self.retry_after
+            self._status = None
+        if not already_down:
+            logging.warning(f"Read replica unavailable, using the primary for {self.retry_after:g}s: {error}")
+
+    def choose(self, min_lsn=None):
+        """True if the replica may serve a read that must observe min_lsn (text LSN or None)."""
+        status = self.status()
+        reason = None
+        if status is None:
+            reason = "down"
+        elif status[1] > self.max_lag:
+            reason = "lag"
+        elif min_lsn and (status[0] is None or status[0] < parse_lsn(min_lsn)):
+            reason = "read_your_writes"
+        with self._lock:
+            self._counts[reason or "replica"] += 1
+        return reason is None
+
+    def record_fallback(self, reason):
+        with self._lock:
+            self._counts["replica"] -= 1
+            self._counts[reason] += 1
+
+    def stats(self):
+        with self._lock:
+            status = self._status
+            return {"routed_to_replica": self._counts["replica"],
+                    "fallbacks": {reason: self._counts[reason] for reason in FALLBACK_REASONS},
+                    "down": time.monotonic() < self._down_until,
+                    "lag_seconds": round(status[1], 3) if status else None,
+                    "max_lag_seconds": self.max_lag}
+
+
+def from_env(**connect_kwargs):
+    """A ReplicaRouter when DB_REPLICA_DSN is set (configuring db's replica pool), else None."""
+    if not REPLICA_DSN:
+        return None
+    db.configure_replica(dsn=REPLICA_DSN, **connect_kwargs)
+    return ReplicaRouter()
@@ -0,0 +1,101 @@
+"""Cached report results, invalidated per month or year through the change feed.
+
+Monthly breakdowns and year summaries are cached per (user, report, period,
+type filter). The cache has two layers: a bounded in-memory LRU per worker
+and, when REPORT_CACHE_PATH is set, a SQLite file shared by the workers on
+one host.
+
+Each result remembers two positions from before it was computed: the user's
+data_version and their latest coffee_entry_changes seq. A lookup under the
+same data_version is a hit without any query. After a write it asks the
+change feed (migrations/0008) whether anything after that seq touched the
+result's period. Writing to one month therefore leaves the user's other
+months and years cached. This holds for every write path and every worker,
+because the feed is filled by triggers.
+
+Closed periods (ending before the current month) are kept for
+REPORT_CACHE_CLOSED_TTL seconds; the current month and year, which change
+daily, for REPORT_CACHE_OPEN_TTL.
+"""
+import os
+import threading
+from datetime import date
+
+from cache import LRUCache, SQLiteCache
+
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', "2048"))
+REPORT_CACHE_PATH = os.environ.get('REPORT_CACHE_PATH', "")
+REPORT_CACHE_DISK_SIZE = int(os.environ.get('REPORT_CACHE_DISK_SIZE', "100000"))
+REPORT_CACHE_OPEN_TTL = float(os.environ.get('REPORT_CACHE_OPEN_TTL', "300"))
+REPORT_CACHE_CLOSED_TTL = float(os.environ.get('REPORT_CACHE_CLOSED_TTL', "86400"))
+
+
+class ReportCache:
+    """Report results by (user, report, period, type filter), validated against the change feed."""
+
+    def __init__(self, memory, shared=None, open_ttl=REPORT_CACHE_OPEN_TTL, closed_ttl=REPORT_CACHE_CLOSED_TTL):
+        self.memory = memory
+        self.shared = shared
+        self.open_ttl = open_ttl
+        self.closed_ttl = closed_ttl
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "revalidated": 0, "invalidated": 0}
+
+    def ttl(self, end, today=None):
+        """Longer for periods that ended before the current month."""
+        return self.closed_ttl if end <= (today or date.today()).replace(day=1) else self.open_ttl
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _lookup(self, key):
+        entry = self.memory.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+        return entry
+
+    def _store(self, key, entry, ttl):
+        self.memory.set(key, entry, ttl)
+        if self.shared is not None:
+            self.shared.set(key, entry, ttl)
+
+    def get_or_compute(self, repo, user_id, report, start, end, type_filter, version, compute):
+        """compute()'s result for the period [start, end), from the cache when still valid.
+
+        version is the user's data_version read before this call (None if
+        unknown). Cached values are shared between requests: don't mutate them.
+        """
+        key = f"{report}:{user_id}:{start.isoformat()}:{end.isoformat()}:{type_filter}"
+        ttl = self.ttl(end)
+        entry = self._lookup(key)
+        if entry is not None:
+            if version is not None and entry['version'] == version:
+                self._count("hits")
+                self.memory.set(key, entry, ttl)  # Promotes entries found in the shared file.
+                return entry['value']
+            head, changed = repo.period_changed(user_id, entry['head'], start, end)
+            if not changed:
+                self._count("hits")
+                self._count("revalidated")
+                self._store(key, {**entry, "version": version, "head": max(head, entry['head'])}, ttl)
+                return entry['value']
+            self._count("invalidated")
+        self._count("misses")
+        # Read before computing, so a write racing with compute() invalidates the result.
+        head, _ = repo.period_changed(user_id, None, start, end)
+        value = compute()
+        self._store(key, {"version": version, "head": head, "value": value}, ttl)
+        return value
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {**counts, "memory": self.memory.stats(),
+                "shared": self.shared.stats() if self.shared is not None else None}
+
+
+def from_env():
+    """A ReportCache sized by REPORT_CACHE_SIZE, sharing REPORT_CACHE_PATH when it is set."""
+    shared = SQLiteCache(REPORT_CACHE_PATH, REPORT_CACHE_DISK_SIZE) if REPORT_CACHE_PATH else None
+    return ReportCache(LRUCache(maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_OPEN_TTL), shared)
@@ -0,0 +1,64 @@
+"""Year summary built from one grouped pass over a year of entries.
+
+``Repository.year_activity`` returns one row per (date, hour, type) with
+count, cost and catalog volume; ``build_year_summary`` folds those rows into
+every figure the yearly views need (totals, per type, per month, weekday
+and hour-of-day patterns, longest streak), so the year is scanned once.
+"""
+from datetime import timedelta
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+def longest_streak(active_dates):
+    """(days, start, end) of the longest run of consecutive dates; (0, None, None) if empty."""
+    best = (0, None, None)
+    run_start = previous = None
+    for d in sorted(active_dates):
+        if previous is None or d - previous != timedelta(days=1):
+            run_start = d
+        length = (d - run_start).days + 1
+        if length > best[0]:
+            best = (length, run_start, d)
+        previous = d
+    return best
+
+
+def build_year_summary(year, rows):
+    """rows: year_activity dicts {entry_date, hour, coffee_type, count, cost, volume_ml}."""
+    by_type = {}
+    by_month = [{"month": month, "count": 0, "cost": 0.0, "volume_ml": 0} for month in range(1, 13)]
+    weekdays = [0] * 7
+    hours = [0] * 24
+    active_dates = set()
+    for row in rows:
+        count, cost, volume_ml = row['count'], row['cost'], row['volume_ml']
+        totals = by_type.setdefault(row['coffee_type'], {"count": 0, "cost": 0.0, "volume_ml": 0})
+        month = by_month[row['entry_date'].month - 1]
+        for bucket in (totals, month):
+            bucket['count'] += count
+            bucket['cost'] += cost
+            bucket['volume_ml'] += volume_ml
+        weekdays[row['entry_date'].weekday()] += count
+        hours[row['hour']] += count
+        active_dates.add(row['entry_date'])
+
+    for bucket in list(by_type.values()) + by_month:
+        bucket['cost'] = round(bucket['cost'], 2)
+    streak_days, streak_start, streak_end = longest_streak(active_dates)
+    total_coffees = sum(weekdays)
+    return {
+        "year": year,
+        "total_coffees": total_coffees,
+        "total_cost": round(sum((t['cost'] for t in by_type.values()), 0.0), 2),
+        "total_volume_ml": sum(t['volume_ml'] for t in by_type.values()),
+        "active_days": len(active_dates),
+        "by_type": by_type,
+        "by_month": by_month,
+        "weekday_counts": [{"weekday": name, "count": weekdays[i]} for i, name in enumerate(WEEKDAYS)],
+        "busiest_weekday": WEEKDAYS[weekdays.index(max(weekdays))] if total_coffees else None,
+        "hour_histogram": hours,
+        "longest_streak": {"days": streak_days,
+                           "start": streak_start.isoformat() if streak_start else None,
+                           "end": streak_end.isoformat() if streak_end else None},
+    }
@@ -0,0 +1,175 @@
+"""Incrementally maintained daily/monthly report rollups.
+
+Every write to ``coffee_entries`` calls ``record_insert(s)`` or ``record_deletes``
+with the same cursor, before committing, so the rollups change atomically with
+the raw rows. ``rebuild`` and ``find_inconsistencies`` back the
+``flask --app app rebuild-rollups`` / ``check-rollups`` commands.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+import psycopg2.extras
+
+DAILY_TABLE = "coffee_daily_rollups"
+MONTHLY_TABLE = "coffee_monthly_rollups"
+
+# Live entries plus the totals kept for archived partitions (partitions.py):
+# what the daily rollups must add up to.
+ENTRY_FACTS = """
+    (SELECT user_id, entry_date, coffee_type, 1 AS entry_count, cost AS total_cost FROM coffee_entries
+     UNION ALL
+     SELECT user_id, entry_date, coffee_type, entry_count, total_cost FROM coffee_archived_activity) facts
+"""
+
+
+def month_start(d):
+    return d.replace(day=1)
+
+
+def record_insert(cur, user_id, coffee_type, entry_date, cost):
+    apply_deltas(cur, user_id, {(entry_date, coffee_type): (1, Decimal(str(cost)))})
+
+
+def record_inserts(cur, user_id, inserted_rows):
+    """inserted_rows: iterable of (coffee_type, entry_date, cost), e.g. from INSERT ... RETURNING."""
+    _record_rows(cur, user_id, inserted_rows, 1)
+
+
+def record_deletes(cur, user_id, deleted_rows):
+    """deleted_rows: iterable of (coffee_type, entry_date, cost), e.g. from DELETE ... RETURNING."""
+    _record_rows(cur, user_id, deleted_rows, -1)
+
+
+def _record_rows(cur, user_id, rows, sign):
+    deltas = deltas_from_rows(rows, sign)
+    if deltas:
+        apply_deltas(cur, user_id, deltas)
+
+
+def deltas_from_rows(rows, sign):
+    """{(entry_date, coffee_type): (count_delta, cost_delta)} for (coffee_type, entry_date, cost) rows."""
+    deltas = defaultdict(lambda: (0, Decimal(0)))
+    for coffee_type, entry_date, cost in rows:
+        count, total = deltas[(entry_date, coffee_type)]
+        deltas[(entry_date, coffee_type)] = (count + sign, total + sign * Decimal(str(cost)))
+    return dict(deltas)
+
+
+def rollup_levels(deltas):
+    """Expands daily deltas into [(table, key_column, [(key, coffee_type, count, cost), ...])].
+
+    Rows are sorted so concurrent writers touching the same keys lock them in
+    the same order. Shared by apply_deltas and the asyncpg path in asgi.py.
+    """
+    monthly = defaultdict(lambda: (0, Decimal(0)))
+    for (entry_date, coffee_type), (count, total) in deltas.items():
+        m_count, m_total = monthly[(month_start(entry_date), coffee_type)]
+        monthly[(month_start(entry_date), coffee_type)] = (m_count + count, m_total + total)
+    return [
+        (table, key_column, [(key, coffee_type, count, total)
+                             for (key, coffee_type), (count, total) in sorted(level.items())])
+        for table, key_column, level in ((DAILY_TABLE, "entry_date", deltas), (MONTHLY_TABLE, "month", monthly))
+    ]
+
+
+def apply_deltas(cur, user_id, deltas):
+    """Adds {(entry_date, coffee_type): (count_delta, cost_delta)} to both rollup levels."""
+    for table, key_column, rows in rollup_levels(deltas):
+        psycopg2.extras.execute_values(
+            cur,
+            f"INSERT INTO {table} AS r (user_id, {key_column}, coffee_type, entry_count, total_cost) "
+            f"VALUES %s ON CONFLICT (user_id, {key_column}, coffee_type) DO UPDATE SET "
+            f"entry_count = r.entry_count + EXCLUDED.entry_count, "
+            f"total_cost = r.total_cost + EXCLUDED.total_cost",
+            [(user_id, *row) for row in rows]
+        )
+        cur.execute(
+            f"DELETE FROM {table} WHERE user_id = %s AND {key_column} = ANY(%s) AND entry_count <= 0",
+            (user_id, sorted({row[0] for row in rows}))
+        )
+
+
+def rebuild(conn, user_id=None):
+    """Recomputes rollups from coffee_entries and archived activity (all users, or one).
+
+    Returns the daily row count.
+    """
+    user_clause = "" if user_id is None else " WHERE user_id = %(user_id)s"
+    params = {"user_id": user_id}
+    cur = conn.cursor()
+    try:
+        # Blocks concurrent entry writes (but not reads) until the rebuild commits.
+        cur.execute("LOCK TABLE coffee_entries IN SHARE MODE")
+        cur.execute(f"DELETE FROM {MONTHLY_TABLE}{user_clause}", params)
+        cur.execute(f"DELETE FROM {DAILY_TABLE}{user_clause}", params)
+        cur.execute(
+            f"INSERT INTO {DAILY_TABLE} (user_id, entry_date, coffee_type, entry_count, total_cost) "
+            f"SELECT user_id, entry_date, coffee_type, SUM(entry_count), SUM(total_cost) FROM {ENTRY_FACTS}{user_clause} "
+            f"GROUP BY user_id, entry_date, coffee_type",
+            params
+        )
+        daily_rows = cur.rowcount
+        cur.execute(
+            f"INSERT INTO {MONTHLY_TABLE} (user_id, month, coffee_type, entry_count, total_cost) "
+            f"SELECT user_id, date_trunc('month', entry_date)::date, coffee_type, SUM(entry_count), SUM(total_cost) "
+            f"FROM {DAILY_TABLE}{user_clause} GROUP BY user_id, date_trunc('month', entry_date), coffee_type",
+            params
+        )
+        conn.commit()
+        return daily_rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def find_inconsistencies(conn, user_id=None, limit=100):
+    """Compares raw (live and archived) entries to daily rollups, and daily to monthly rollups.
+
+    Returns a list of dicts describing mismatching keys (empty when consistent).
+    """
+    user_clause = "" if user_id is None else " WHERE user_id = %(user_id)s"
+    params = {"user_id": user_id, "limit": limit}
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cur.execute(
+            f"""
+            SELECT 'daily' AS level, COALESCE(e.user_id, r.user_id) AS user_id,
+                   COALESCE(e.entry_date, r.entry_date) AS period,
+                   COALESCE(e.coffee_type, r.coffee_type) AS coffee_type,
+                   e.entry_count AS expected_count, r.entry_count AS rollup_count,
+                   e.total_cost AS expected_cost, r.total_cost AS rollup_cost
+            FROM (SELECT user_id, entry_date, coffee_type, SUM(entry_count) AS entry_count, SUM(total_cost) AS total_cost
+                  FROM {ENTRY_FACTS}{user_clause} GROUP BY user_id, entry_date, coffee_type) e
+            FULL OUTER JOIN (SELECT * FROM {DAILY_TABLE}{user_clause}) r
+                 USING (user_id, entry_date, coffee_type)
+            WHERE e.entry_count IS DISTINCT FROM r.entry_count OR e.total_cost IS DISTINCT FROM r.total_cost
+            LIMIT %(limit)s
+            """,
+            params
+        )
+        mismatches = cur.fetchall()
+        cur.execute(
+            f"""
+            SELECT 'monthly' AS level, COALESCE(d.user_id, m.user_id) AS user_id,
+                   COALESCE(d.month, m.month) AS period,
+                   COALESCE(d.coffee_type, m.coffee_type) AS coffee_type,
+                   d.entry_count AS expected_count, m.entry_count AS rollup_count,
+                   d.total_cost AS expected_cost, m.total_cost AS rollup_cost
+            FROM (SELECT user_id, date_trunc('month', entry_date)::date AS month, coffee_type,
+                         SUM(entry_count) AS entry_count, SUM(total_cost) AS total_cost
+                  FROM {DAILY_TABLE}{user_clause}
+                  GROUP BY user_id, date_trunc('month', entry_date), coffee_type) d
+            FULL OUTER JOIN (SELECT * FROM {MONTHLY_TABLE}{user_clause}) m
+                 USING (user_id, month, coffee_type)
+            WHERE d.entry_count IS DISTINCT FROM m.entry_count OR d.total_cost IS DISTINCT FROM m.total_cost
+            LIMIT %(limit)s
+            """,
+            params
+        )
+        mismatches.extend(cur.fetchall())
+        return [dict(row) for row in mismatches]
+    finally:
+        cur.close()
+        conn.rollback()
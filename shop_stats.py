@@ -0,0 +1,177 @@
+"""All-users statistics from materialized views (migrations/0009).
+
+``refresh`` runs ``REFRESH MATERIALIZED VIEW CONCURRENTLY`` on each view
+that is older than the interval. Readers are never blocked: they keep
+seeing the previous contents until the refresh commits. Each view is
+refreshed in its own transaction under an advisory lock, and the age check
+happens inside that lock. Any number of workers or cron jobs can therefore
+call ``refresh``, and each view is still refreshed about once per interval.
+
+``Refresher`` is the background scheduler: a daemon thread per worker
+process that calls ``refresh`` every SHOP_STATS_REFRESH_INTERVAL seconds.
+Setting the interval to 0 turns it off, leaving refreshes to
+``flask --app app refresh-shop-stats``. ``read_stats`` reports how old
+the data is.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+import psycopg2
+import psycopg2.extras
+from psycopg2 import sql
+
+import db
+
+REFRESH_INTERVAL = float(os.environ.get('SHOP_STATS_REFRESH_INTERVAL', "300"))
+VIEWS = ("shop_type_totals", "shop_daily_leaders", "shop_weekly_leaders")
+REFRESH_LOCK_ID = 0x73686F70  # arbitrary, constant across processes; paired with the view's index
+
+
+def refresh(conn, max_age=REFRESH_INTERVAL):
+    """Refreshes the views older than max_age seconds (all of them for 0); returns {view: ms}.
+
+    Views another process is refreshing right now are skipped.
+    """
+    refreshed = {}
+    cur = conn.cursor()
+    try:
+        for index, view in enumerate(VIEWS):
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (REFRESH_LOCK_ID, index))
+            stale = False
+            if cur.fetchone()[0]:
+                cur.execute("SELECT refreshed_at <= now() - make_interval(secs => %s) "
+                            "FROM shop_stats_refreshes WHERE view_name = %s", (max_age, view))
+                row = cur.fetchone()
+                stale = row is None or row[0]
+            if not stale:
+                conn.rollback()
+                continue
+            started = time.perf_counter()
+            cur.execute(sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}").format(sql.Identifier(view)))
+            duration_ms = round((time.perf_counter() - started) * 1000)
+            cur.execute(
+                "INSERT INTO shop_stats_refreshes (view_name, refreshed_at, duration_ms) VALUES (%s, now(), %s) "
+                "ON CONFLICT (view_name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at, "
+                "duration_ms = EXCLUDED.duration_ms",
+                (view, duration_ms)
+            )
+            conn.commit()
+            refreshed[view] = duration_ms
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    if refreshed:
+        logging.info(f"Refreshed shop statistics: {', '.join(f'{v} ({ms} ms)' for v, ms in refreshed.items())}.")
+    return refreshed
+
+
+class Refresher:
+    """Per-process daemon thread calling refresh() every `interval` seconds."""
+
+    def __init__(self, connect=None, interval=REFRESH_INTERVAL):
+        self._connect = connect or db.checkout
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "refreshes": 0, "failures": 0, "last_duration_ms": 0}
+
+    def ensure_started(self):
+        # Threads don't survive fork(); each worker process starts its own.
+        if self.interval <= 0 or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name="shop-stats-refresh", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # Jitter keeps the workers from all checking at the same moment.
+            time.sleep(self.interval * random.uniform(0.5, 1.0))
+            self.run_once()
+
+    def run_once(self):
+        try:
+            conn = self._connect()
+            try:
+                refreshed = refresh(conn, self.interval)
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            logging.warning(f"Shop statistics refresh failed: {e}")
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["failures"] += 1
+            return
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["refreshes"] += len(refreshed)
+            if refreshed:
+                self._stats["last_duration_ms"] = sum(refreshed.values())
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, interval_seconds=self.interval)
+
+
+def read_stats(conn, day, week_start, limit):
+    """Shop totals, per-type totals and the day's and week's leaderboards, with their age."""
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cur.execute("SELECT MIN(refreshed_at) AS refreshed_at, "
+                    "EXTRACT(EPOCH FROM now() - MIN(refreshed_at)) AS staleness FROM shop_stats_refreshes")
+        freshness = cur.fetchone()
+        cur.execute("SELECT coffee_type, currency_code, cups, spend, volume_ml FROM shop_type_totals "
+                    "ORDER BY coffee_type, currency_code")
+        type_rows = cur.fetchall()
+        leaderboards = {}
+        for board, table, column, period in (("daily", "shop_daily_leaders", "day", day),
+                                             ("weekly", "shop_weekly_leaders", "week_start", week_start)):
+            cur.execute(
+                sql.SQL("SELECT u.username, l.cups, l.volume_ml FROM {} l JOIN users u ON u.id = l.user_id "
+                        "WHERE l.{} = %s ORDER BY l.cups DESC, l.user_id LIMIT %s")
+                .format(sql.Identifier(table), sql.Identifier(column)),
+                (period, limit)
+            )
+            leaderboards[board] = cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+
+    by_type, spend = {}, {}
+    for row in type_rows:
+        totals = by_type.setdefault(row['coffee_type'], {"type": row['coffee_type'], "cups": 0,
+                                                          "volume_ml": 0, "spend": {}})
+        totals['cups'] += row['cups']
+        totals['volume_ml'] += row['volume_ml']
+        totals['spend'][row['currency_code']] = round(float(row['spend']), 2)
+        spend[row['currency_code']] = round(spend.get(row['currency_code'], 0.0) + float(row['spend']), 2)
+    return {
+        "refreshed_at": freshness['refreshed_at'].isoformat() if freshness['refreshed_at'] else None,
+        "staleness_seconds": round(float(freshness['staleness']), 1) if freshness['staleness'] is not None else None,
+        "totals": {"cups": sum(t['cups'] for t in by_type.values()),
+                   "volume_ml": sum(t['volume_ml'] for t in by_type.values()), "spend": spend},
+        "by_type": list(by_type.values()),
+        "leaderboards": {
+            "daily": {"date": day.isoformat(), "leaders": _ranked(leaderboards['daily'])},
+            "weekly": {"week_start": week_start.isoformat(), "leaders": _ranked(leaderboards['weekly'])},
+        },
+    }
+
+
+def _ranked(rows):
+    """Standard competition ranking: equal cups share a rank (1, 2, 2, 4)."""
+    ranked, previous = [], None
+    for position, row in enumerate(rows, start=1):
+        rank = ranked[-1]['rank'] if previous == row['cups'] else position
+        ranked.append({"rank": rank, "username": row['username'], "cups": row['cups'],
+                       "volume_ml": row['volume_ml']})
+        previous = row['cups']
+    return ranked
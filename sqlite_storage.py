@@ -0,0 +1,386 @@
+"""Embedded SQLite storage backend (STORAGE_BACKEND=sqlite).
+
+One database file, opened in WAL mode so readers never block the writer.
+Writes take the write lock up front (``BEGIN IMMEDIATE``) instead of
+upgrading mid-transaction, which would fail with SQLITE_BUSY under
+concurrency. Reports aggregate ``coffee_entries`` directly through a covering
+(user_id, entry_date, ...) index; at single-site volumes that is cheaper than
+maintaining rollup tables. ``users.data_version`` is bumped by triggers,
+mirroring migrations/0005, so ETags work the same on both backends.
+
+The schema is created on first open; there are no migrations yet.
+"""
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, time, timedelta, timezone
+
+from storage import Repository, StorageError, bucket_start, bucket_starts, feed_page
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id              INTEGER PRIMARY KEY,
+    username        TEXT    NOT NULL UNIQUE,
+    password_hash   TEXT    NOT NULL,
+    currency_code   TEXT    NOT NULL DEFAULT 'EUR',
+    currency_symbol TEXT    NOT NULL DEFAULT '€',
+    data_version    INTEGER NOT NULL DEFAULT 0,
+    created_at      TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS coffee_entries (
+    id          INTEGER PRIMARY KEY,
+    user_id     INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    coffee_type TEXT    NOT NULL,
+    entry_date  TEXT    NOT NULL,  -- YYYY-MM-DD, so text order is date order
+    entry_time  TEXT    NOT NULL,  -- HH:MM:SS
+    cost        REAL    NOT NULL,
+    created_at  TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Covers the day log and every report: no table lookups for either.
+CREATE INDEX IF NOT EXISTS idx_coffee_entries_user_date
+    ON coffee_entries (user_id, entry_date, entry_time, coffee_type, cost);
+CREATE INDEX IF NOT EXISTS idx_coffee_entries_user_type_date
+    ON coffee_entries (user_id, coffee_type, entry_date, cost);
+
+CREATE TABLE IF NOT EXISTS user_coffee_prices (
+    user_id     INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    coffee_type TEXT    NOT NULL,
+    price       REAL    NOT NULL CHECK (price >= 0),
+    PRIMARY KEY (user_id, coffee_type)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS coffee_catalog (
+    coffee_type  TEXT    PRIMARY KEY,
+    default_cost REAL    NOT NULL CHECK (default_cost >= 0),
+    volume_ml    INTEGER NOT NULL CHECK (volume_ml >= 0)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO coffee_catalog (coffee_type, default_cost, volume_ml) VALUES
+    ('Chiaro', 0.55, 40), ('Cosi', 0.49, 40), ('Buenos Aires', 0.54, 90), ('Vienna', 0.54, 90),
+    ('Roma', 0.50, 40), ('Arpeggio', 0.50, 40), ('Livanto', 0.50, 40), ('Volluto Decaf', 0.52, 90);
+
+CREATE TRIGGER IF NOT EXISTS coffee_entries_insert_version AFTER INSERT ON coffee_entries
+BEGIN UPDATE users SET data_version = data_version + 1 WHERE id = NEW.user_id; END;
+CREATE TRIGGER IF NOT EXISTS coffee_entries_update_version AFTER UPDATE ON coffee_entries
+BEGIN UPDATE users SET data_version = data_version + 1 WHERE id IN (OLD.user_id, NEW.user_id); END;
+CREATE TRIGGER IF NOT EXISTS coffee_entries_delete_version AFTER DELETE ON coffee_entries
+BEGIN UPDATE users SET data_version = data_version + 1 WHERE id = OLD.user_id; END;
+-- Change feed for /api/changes (migrations/0008). AUTOINCREMENT never reuses
+-- a seq, and writes are serialized, so seq order is commit order.
+CREATE TABLE IF NOT EXISTS coffee_entry_changes (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id     INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    op          TEXT    NOT NULL CHECK (op IN ('I', 'D', 'R')),
+    entry_id    INTEGER,
+    entry_date  TEXT,
+    coffee_type TEXT,
+    entry_time  TEXT,
+    cost        REAL,
+    changed_at  TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_coffee_entry_changes_user_seq ON coffee_entry_changes (user_id, seq);
+
+CREATE TABLE IF NOT EXISTS coffee_entry_changes_horizon (
+    id             INTEGER PRIMARY KEY CHECK (id = 1),
+    pruned_through INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO coffee_entry_changes_horizon (id, pruned_through) VALUES (1, 0);
+
+-- The EXISTS skips entries removed by deleting their user (ON DELETE CASCADE).
+CREATE TRIGGER IF NOT EXISTS coffee_entries_log_insert AFTER INSERT ON coffee_entries
+BEGIN
+    INSERT INTO coffee_entry_changes (user_id, op, entry_id, entry_date, coffee_type, entry_time, cost)
+    VALUES (NEW.user_id, 'I', NEW.id, NEW.entry_date, NEW.coffee_type, NEW.entry_time, NEW.cost);
+END;
+CREATE TRIGGER IF NOT EXISTS coffee_entries_log_update AFTER UPDATE ON coffee_entries
+BEGIN
+    INSERT INTO coffee_entry_changes (user_id, op, entry_id, entry_date, coffee_type, entry_time, cost)
+    VALUES (OLD.user_id, 'D', OLD.id, OLD.entry_date, OLD.coffee_type, OLD.entry_time, OLD.cost),
+           (NEW.user_id, 'I', NEW.id, NEW.entry_date, NEW.coffee_type, NEW.entry_time, NEW.cost);
+END;
+CREATE TRIGGER IF NOT EXISTS coffee_entries_log_delete AFTER DELETE ON coffee_entries
+BEGIN
+    INSERT INTO coffee_entry_changes (user_id, op, entry_id, entry_date, coffee_type, entry_time, cost)
+    SELECT OLD.user_id, 'D', OLD.id, OLD.entry_date, OLD.coffee_type, OLD.entry_time, OLD.cost
+    WHERE EXISTS (SELECT 1 FROM users WHERE id = OLD.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_coffee_prices_insert_version AFTER INSERT ON user_coffee_prices
+BEGIN UPDATE users SET data_version = data_version + 1 WHERE id = NEW.user_id; END;
+CREATE TRIGGER IF NOT EXISTS user_coffee_prices_update_version AFTER UPDATE ON user_coffee_prices
+BEGIN UPDATE users SET data_version = data_version + 1 WHERE id IN (OLD.user_id, NEW.user_id); END;
+CREATE TRIGGER IF NOT EXISTS user_coffee_prices_delete_version AFTER DELETE ON user_coffee_prices
+BEGIN UPDATE users SET data_version = data_version + 1 WHERE id = OLD.user_id; END;
+CREATE TRIGGER IF NOT EXISTS users_currency_version AFTER UPDATE OF currency_code, currency_symbol ON users
+BEGIN UPDATE users SET data_version = data_version + 1 WHERE id = NEW.id; END;
+"""
+
+
+class SQLiteRepository(Repository):
+    """Repository over one SQLite file, with a small pool of reusable connections."""
+
+    backend = "sqlite"
+
+    def __init__(self, path, pool_size=4, busy_timeout_ms=5000):
+        self.path = path
+        self.pool_size = pool_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        with self._checkout() as conn:
+            conn.executescript(SCHEMA)
+
+    def _open(self):
+        # Autocommit mode: transactions are opened explicitly in _transaction().
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        return conn
+
+    @contextmanager
+    def _checkout(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # SQLite connections must not be used across fork(); a worker drops the parent's.
+                self._idle, self._pid = [], os.getpid()
+            conn = self._idle.pop() if self._idle else None
+        try:
+            conn = conn or self._open()
+            yield conn
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        finally:
+            if conn is not None:
+                with self._lock:
+                    keep = len(self._idle) < self.pool_size and not conn.in_transaction
+                    if keep:
+                        self._idle.append(conn)
+                if not keep:
+                    conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """A write transaction holding the database write lock from the start."""
+        with self._checkout() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    # --- Users ---
+    def find_user(self, username):
+        with self._checkout() as conn:
+            row = conn.execute("SELECT id, username, password_hash, currency_code, currency_symbol "
+                               "FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "username", "password_hash", "currency_code", "currency_symbol"), row))
+
+    def create_user(self, username, password_hash, currency_code='EUR', currency_symbol='€'):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "INSERT INTO users (username, password_hash, currency_code, currency_symbol) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (username) DO NOTHING RETURNING id",
+                (username, password_hash, currency_code, currency_symbol)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_password_hash(self, user_id, password_hash):
+        with self._transaction() as conn:
+            conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id))
+
+    def delete_user(self, user_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+    def user_profile(self, user_id):
+        with self._checkout() as conn:
+            rows = conn.execute(
+                "SELECT u.currency_code, u.currency_symbol, p.coffee_type, p.price "
+                "FROM users u LEFT JOIN user_coffee_prices p ON p.user_id = u.id "
+                "WHERE u.id = ?",
+                (user_id,)
+            ).fetchall()
+        if not rows:
+            return None
+        return {"currency_code": rows[0][0], "currency_symbol": rows[0][1],
+                "prices": {coffee_type: float(price) for _, _, coffee_type, price in rows if coffee_type is not None}}
+
+    def update_currency(self, user_id, currency_code, currency_symbol):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "UPDATE users SET currency_code = ?, currency_symbol = ? WHERE id = ? "
+                "RETURNING currency_code, currency_symbol",
+                (currency_code, currency_symbol, user_id)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def replace_prices(self, user_id, prices):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM user_coffee_prices WHERE user_id = ?", (user_id,))
+            conn.executemany("INSERT INTO user_coffee_prices (user_id, coffee_type, price) VALUES (?, ?, ?)",
+                             [(user_id, coffee_type, price) for coffee_type, price in prices.items()])
+
+    def data_version(self, user_id):
+        with self._checkout() as conn:
+            row = conn.execute("SELECT data_version FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    # --- Entries ---
+    def day_entries(self, user_id, entry_date):
+        with self._checkout() as conn:
+            rows = conn.execute(
+                "SELECT id, coffee_type, entry_time, cost FROM coffee_entries "
+                "WHERE user_id = ? AND entry_date = ? ORDER BY entry_time, id",
+                (user_id, entry_date.isoformat())
+            ).fetchall()
+        return [{"id": entry_id, "coffee_type": coffee_type, "entry_time": time.fromisoformat(entry_time),
+                 "cost": float(cost)} for entry_id, coffee_type, entry_time, cost in rows]
+
+    @staticmethod
+    def _day_totals(conn, user_id, entry_date):
+        count, total_cost = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(cost), 0) FROM coffee_entries WHERE user_id = ? AND entry_date = ?",
+            (user_id, entry_date.isoformat())
+        ).fetchone()
+        return int(count), round(float(total_cost), 2)
+
+    def add_entry(self, user_id, coffee_type, entry_date, entry_time, cost):
+        with self._transaction() as conn:
+            entry_id = conn.execute(
+                "INSERT INTO coffee_entries (user_id, coffee_type, entry_date, entry_time, cost) "
+                "VALUES (?, ?, ?, ?, ?) RETURNING id",
+                (user_id, coffee_type, entry_date.isoformat(), entry_time.strftime('%H:%M:%S'), float(cost))
+            ).fetchone()[0]
+            day_count, day_total_cost = self._day_totals(conn, user_id, entry_date)
+        return entry_id, day_count, day_total_cost
+
+    def clear_day(self, user_id, entry_date):
+        with self._transaction() as conn:
+            cur = conn.execute("DELETE FROM coffee_entries WHERE user_id = ? AND entry_date = ?",
+                               (user_id, entry_date.isoformat()))
+            return cur.rowcount
+
+    def delete_entry(self, user_id, entry_id):
+        with self._transaction() as conn:
+            row = conn.execute("DELETE FROM coffee_entries WHERE id = ? AND user_id = ? RETURNING entry_date",
+                               (entry_id, user_id)).fetchone()
+            if row is None:
+                return None
+            entry_date = date.fromisoformat(row[0])
+            day_count, day_total_cost = self._day_totals(conn, user_id, entry_date)
+        return entry_date, day_count, day_total_cost
+
+    # --- Change feed ---
+    def changes_since(self, user_id, cursor, limit):
+        with self._checkout() as conn:
+            pruned_through, head = conn.execute(
+                "SELECT (SELECT pruned_through FROM coffee_entry_changes_horizon), "
+                "(SELECT COALESCE(MAX(seq), 0) FROM coffee_entry_changes WHERE user_id = ?)",
+                (user_id,)
+            ).fetchone()
+            rows = []
+            if cursor is not None and pruned_through <= cursor <= max(head, pruned_through):
+                rows = conn.execute(
+                    "SELECT seq, op, entry_id, entry_date, coffee_type, entry_time, cost FROM coffee_entry_changes "
+                    "WHERE user_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                    (user_id, cursor, limit)
+                ).fetchall()
+        return feed_page([(seq, op, entry_id, entry_date and date.fromisoformat(entry_date), coffee_type,
+                           entry_time and time.fromisoformat(entry_time), cost)
+                          for seq, op, entry_id, entry_date, coffee_type, entry_time, cost in rows],
+                         cursor, head, pruned_through)
+
+    def prune_changes(self, older_than):
+        # changed_at is CURRENT_TIMESTAMP text (UTC, 'YYYY-MM-DD HH:MM:SS').
+        cutoff = older_than.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE coffee_entry_changes_horizon SET pruned_through = MAX(pruned_through, "
+                "(SELECT COALESCE(MAX(seq), 0) FROM coffee_entry_changes WHERE changed_at < ?))",
+                (cutoff,)
+            )
+            return conn.execute(
+                "DELETE FROM coffee_entry_changes "
+                "WHERE seq <= (SELECT pruned_through FROM coffee_entry_changes_horizon)"
+            ).rowcount
+
+    def period_changed(self, user_id, since, start, end):
+        with self._checkout() as conn:
+            head, pruned_through, touched = conn.execute(
+                "SELECT (SELECT COALESCE(MAX(seq), 0) FROM coffee_entry_changes WHERE user_id = :user_id), "
+                "(SELECT pruned_through FROM coffee_entry_changes_horizon), "
+                "EXISTS (SELECT 1 FROM coffee_entry_changes WHERE user_id = :user_id AND seq > :since "
+                "AND (op = 'R' OR (entry_date >= :start AND entry_date < :end)))",
+                {"user_id": user_id, "since": since or 0, "start": start.isoformat(), "end": end.isoformat()}
+            ).fetchone()
+        return max(head, pruned_through), since is None or since < pruned_through or bool(touched)
+
+    # --- Reports ---
+    def type_breakdown(self, user_id, start, end, type_filter='All'):
+        sql_query = ("SELECT coffee_type, COUNT(*), SUM(cost) FROM coffee_entries "
+                     "WHERE user_id = ? AND entry_date >= ? AND entry_date < ?")
+        params = [user_id, start.isoformat(), end.isoformat()]
+        if type_filter != 'All':
+            sql_query += " AND coffee_type = ?"
+            params.append(type_filter)
+        sql_query += " GROUP BY coffee_type ORDER BY coffee_type"
+        with self._checkout() as conn:
+            rows = conn.execute(sql_query, params).fetchall()
+        return [{"coffee_type": coffee_type, "count": int(count), "total_cost": round(float(total_cost), 2)}
+                for coffee_type, count, total_cost in rows]
+
+    def year_activity(self, user_id, start, end, type_filter='All'):
+        sql_query = ("SELECT e.entry_date, CAST(substr(e.entry_time, 1, 2) AS INTEGER) AS hour, e.coffee_type, "
+                     "COUNT(*), SUM(e.cost), COUNT(*) * COALESCE(c.volume_ml, 0) "
+                     "FROM coffee_entries e LEFT JOIN coffee_catalog c ON c.coffee_type = e.coffee_type "
+                     "WHERE e.user_id = ? AND e.entry_date >= ? AND e.entry_date < ?")
+        params = [user_id, start.isoformat(), end.isoformat()]
+        if type_filter != 'All':
+            sql_query += " AND e.coffee_type = ?"
+            params.append(type_filter)
+        sql_query += " GROUP BY e.entry_date, hour, e.coffee_type"
+        with self._checkout() as conn:
+            rows = conn.execute(sql_query, params).fetchall()
+        return [{"entry_date": date.fromisoformat(entry_date), "hour": hour, "coffee_type": coffee_type,
+                 "count": int(count), "cost": float(cost), "volume_ml": int(volume_ml)}
+                for entry_date, hour, coffee_type, count, cost, volume_ml in rows]
+
+    def range_series(self, user_id, date_from, date_to, granularity, volumes, type_filter='All'):
+        sql_query = ("SELECT entry_date, coffee_type, COUNT(*), SUM(cost) FROM coffee_entries "
+                     "WHERE user_id = ? AND entry_date >= ? AND entry_date < ?")
+        params = [user_id, date_from.isoformat(), (date_to + timedelta(days=1)).isoformat()]
+        if type_filter != 'All':
+            sql_query += " AND coffee_type = ?"
+            params.append(type_filter)
+        sql_query += " GROUP BY entry_date, coffee_type"
+        with self._checkout() as conn:
+            rows = conn.execute(sql_query, params).fetchall()
+
+        totals = defaultdict(lambda: [0, 0.0, 0])
+        for entry_date, coffee_type, count, cost in rows:
+            bucket = totals[bucket_start(date.fromisoformat(entry_date), granularity)]
+            bucket[0] += count
+            bucket[1] += cost
+            bucket[2] += count * volumes.get(coffee_type, 0)
+        series = []
+        for period in bucket_starts(date_from, date_to, granularity):
+            count, cost, volume_ml = totals.get(period, (0, 0.0, 0))
+            series.append({"period": period, "count": count, "cost": round(cost, 2), "volume_ml": volume_ml})
+        return series
@@ -163,6 +163,10 @@ document.addEventListener("DOMContentLoaded", () => {
     Vienna: "vienna.avif",
     "Volluto Decaf": "volluto-decaf.webp",
   };
+  // Fingerprinted image URLs rendered into the page (see assets.py).
+  const assetUrls = window.COFFEE_ASSET_URLS || {};
+  const imageUrl = (imageName) =>
+    assetUrls[`images/${imageName}`] || `/static/images/${imageName}`;
 
   // --- Utility Functions ---
   const getFormattedDate = (dateObj) => {
@@ -199,9 +203,8 @@ document.addEventListener("DOMContentLoaded", () => {
     updateSimpleSelectedDateDisplay(todayFormatted);
 
     try {
-      await loadUserSettings(); // Load currency first
-      await loadUserCoffeePrices(); // Then custom prices
-      await fetchCoffeeDefinitionsAndPopulate(); // Then all coffee types with correct pricing/symbols
+      // Settings, custom prices, priced coffee types and today's log in one request
+      await loadDashboard(todayFormatted);
 
       populateReportSelects(); // Advanced view
       populateSimpleCoffeeButtons(); // Simple view (uses coffeeTypeDefinitions)
@@ -217,7 +220,8 @@ document.addEventListener("DOMContentLoaded", () => {
     populateMonthYearInputs(); // For reports (advanced view)
 
     viewModeToggle.checked = false; // Default to Advanced
-    toggleViewMode(); // Sets initial visibility and loads data for the active view
+    toggleViewMode(false); // Sets initial visibility; the day's log came with the dashboard
+    renderDailyLogAndCosts();
 
     // Event Listeners (rest of them)
     viewModeToggle.addEventListener("change", toggleViewMode);
@@ -318,41 +322,210 @@ document.addEventListener("DOMContentLoaded", () => {
       saveCustomPricesBtn.addEventListener("click", handleSaveCustomPrices);
   };
 
-  // --- User Settings Functions ---
-  async function loadUserSettings() {
-    try {
-      const response = await fetch("/api/user/settings");
-      if (!response.ok) {
-        const errData = await response.json().catch(() => ({}));
-        throw new Error(errData.error || "Failed to load user settings");
+  // --- Day Log Cache (IndexedDB + /api/changes) ---
+  // Days already seen are kept in IndexedDB, one database per user. Before a
+  // cached day is shown, the entry changes after the stored cursor are fetched
+  // from /api/changes and applied, so switching dates and reloading download
+  // only what changed. Without IndexedDB every day comes from the network.
+  const DAY_CACHE_MAX_DAYS = 400;
+
+  const idbRequest = (request) =>
+    new Promise((resolve, reject) => {
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => reject(request.error);
+    });
+
+  // "8:05 PM" -> minutes since midnight, to keep cached days in log order.
+  const minutesOfDay = (time) => {
+    const match = /^(\d{1,2}):(\d{2})\s*([AP]M)$/i.exec(time || "");
+    if (!match) return 24 * 60;
+    const pm = match[3].toUpperCase() === "PM";
+    return ((Number(match[1]) % 12) + (pm ? 12 : 0)) * 60 + Number(match[2]);
+  };
+  const compareEntries = (a, b) =>
+    minutesOfDay(a.time) - minutesOfDay(b.time) || a.id - b.id;
+
+  const dayCache = {
+    db: null,
+    days: new Map(), // date -> { date, entries, seenAt }
+    cursor: null,
+    generation: 0, // bumped by resets; days fetched before one are not cached
+    syncing: null,
+
+    async open() {
+      if (this.db || !window.indexedDB || window.COFFEE_USER_ID == null) return;
+      try {
+        const request = indexedDB.open(`coffee-tracker-${window.COFFEE_USER_ID}`, 1);
+        request.onupgradeneeded = () => {
+          request.result.createObjectStore("days", { keyPath: "date" });
+          request.result.createObjectStore("meta");
+        };
+        const db = await idbRequest(request);
+        const tx = db.transaction(["days", "meta"]);
+        const [days, cursor] = await Promise.all([
+          idbRequest(tx.objectStore("days").getAll()),
+          idbRequest(tx.objectStore("meta").get("cursor")),
+        ]);
+        days.forEach((day) => this.days.set(day.date, day));
+        this.cursor = cursor === undefined ? null : cursor;
+        this.db = db;
+      } catch (error) {
+        console.warn("Day log cache unavailable:", error);
       }
-      const settings = await response.json();
-      currentUserSettings = settings;
-      if (currencyCodeInput)
-        currencyCodeInput.value = settings.currency_code || "EUR";
-      if (currencySymbolInput)
-        currencySymbolInput.value = settings.currency_symbol || "€";
-    } catch (error) {
-      console.error("Error loading user settings:", error);
-      showMessage(error.message, "error");
-      // Keep defaults if loading fails, or handle more gracefully
-    }
-  }
+    },
+
+    // Applies /api/changes pages until caught up; concurrent callers share one request.
+    sync() {
+      if (!this.db) return Promise.reject(new Error("No day log cache"));
+      if (!this.syncing)
+        this.syncing = this.fetchChanges().finally(() => {
+          this.syncing = null;
+        });
+      return this.syncing;
+    },
+
+    async trySync() {
+      try {
+        await this.sync();
+        return true;
+      } catch (error) {
+        if (this.db) console.warn("Could not sync the day log cache:", error);
+        return false;
+      }
+    },
+
+    async fetchChanges() {
+      let more = true;
+      while (more) {
+        const since = this.cursor === null ? "" : this.cursor;
+        const response = await fetch(`/api/changes?since=${since}`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || "Failed to load changes");
+        if (data.reset) {
+          this.days.clear();
+          this.generation += 1;
+        }
+        const touched = data.changes
+          .filter((change) => this.applyChange(change))
+          .map((change) => change.date);
+        this.cursor = data.cursor;
+        await this.persist(touched, data.reset);
+        more = data.more && data.changes.length > 0;
+      }
+    },
+
+    // Idempotent, so replaying changes a fetched day already contains is harmless.
+    applyChange(change) {
+      const day = this.days.get(change.date);
+      if (!day) return false;
+      if (change.op === "clear") {
+        day.entries = [];
+      } else {
+        day.entries = day.entries.filter((entry) => entry.id !== change.id);
+        if (change.op === "insert") {
+          const { id, type, time, cost } = change;
+          day.entries.push({ id, type, time, cost });
+          day.entries.sort(compareEntries);
+        }
+      }
+      return true;
+    },
+
+    // Applies this page's own write (insert, delete or clear) to a cached day.
+    record(change) {
+      if (this.applyChange(change)) this.persist([change.date]);
+    },
+
+    // Caches a day whose fetch started while the cursor was current (same
+    // generation): it holds every change up to the cursor, and later ones are
+    // replayed on top of it.
+    rememberDay(date, entries, generation) {
+      if (!this.db || this.cursor === null || generation !== this.generation) return;
+      this.days.set(date, {
+        date,
+        entries: entries.map(({ id, type, time, cost }) => ({ id, type, time, cost })),
+        seenAt: Date.now(),
+      });
+      this.persist([date]);
+    },
+
+    // One day's entries: from the cache after a sync, otherwise from the network.
+    async getDay(date) {
+      const synced = await this.trySync();
+      const cached = synced && this.days.get(date);
+      if (cached) {
+        cached.seenAt = Date.now();
+        return cached.entries.slice();
+      }
+      const generation = this.generation;
+      const response = await fetch(`/api/coffees/${date}`);
+      const data = await response.json();
+      if (!response.ok) throw new Error(data.error || "Failed to load log");
+      if (synced) this.rememberDay(date, data, generation);
+      return data;
+    },
+
+    persist(dates, clear = false) {
+      if (!this.db) return Promise.resolve();
+      const evicted = [...this.days.values()]
+        .sort((a, b) => b.seenAt - a.seenAt)
+        .slice(DAY_CACHE_MAX_DAYS)
+        .map((day) => day.date);
+      evicted.forEach((date) => this.days.delete(date));
+      return new Promise((resolve) => {
+        const tx = this.db.transaction(["days", "meta"], "readwrite");
+        const store = tx.objectStore("days");
+        if (clear) store.clear();
+        evicted.forEach((date) => store.delete(date));
+        new Set(dates).forEach((date) => {
+          const day = this.days.get(date);
+          if (day) store.put(day);
+        });
+        tx.objectStore("meta").put(this.cursor, "cursor");
+        tx.oncomplete = () => resolve();
+        tx.onerror = tx.onabort = () => {
+          console.warn("Could not write the day log cache:", tx.error);
+          resolve();
+        };
+      });
+    },
+  };
 
-  async function loadUserCoffeePrices() {
+  // --- Dashboard (initial page load) ---
+  async function loadDashboard(selectedDate) {
     try {
-      const response = await fetch("/api/user/coffee_prices");
-      if (!response.ok) {
-        const errData = await response.json().catch(() => ({}));
-        throw new Error(errData.error || "Failed to load user coffee prices");
+      // A cached day is refreshed from /api/changes alongside the dashboard
+      // request, which then leaves the day out.
+      await dayCache.open();
+      const cached = dayCache.days.has(selectedDate);
+      const generation = dayCache.generation;
+      const [response, synced] = await Promise.all([
+        fetch(`/api/dashboard?date=${selectedDate}${cached ? "&day=0" : ""}`),
+        dayCache.trySync(),
+      ]);
+      const data = await response.json();
+      if (!response.ok) throw new Error(data.error || "Failed to load dashboard");
+      currentUserSettings = data.settings;
+      if (currencyCodeInput)
+        currencyCodeInput.value = data.settings.currency_code || "EUR";
+      if (currencySymbolInput)
+        currencySymbolInput.value = data.settings.currency_symbol || "€";
+      userCoffeePrices = data.custom_prices;
+      applyCoffeeTypes(data.coffee_types);
+      if (data.day) {
+        dailyCoffees = data.day.entries;
+        if (synced) dayCache.rememberDay(selectedDate, dailyCoffees, generation);
+      } else {
+        dailyCoffees = await dayCache.getDay(selectedDate);
       }
-      userCoffeePrices = await response.json();
     } catch (error) {
-      console.error("Error loading user coffee prices:", error);
+      console.error("Error loading dashboard:", error);
       showMessage(error.message, "error");
+      dailyCoffees = [];
     }
   }
 
+  // --- User Settings Functions ---
   function populateCustomPricesForm() {
     if (!customPricesContainer) return;
     customPricesContainer.innerHTML = "";
@@ -495,8 +668,9 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   // --- View Toggling Function ---
-  function toggleViewMode() {
-    // ... (same as previous version)
+  function toggleViewMode(reload = true) {
+    // reload is false only on first load, when the dashboard already supplied the day's log.
+    // As a change listener it receives the Event, which is truthy.
     const isSimpleView = viewModeToggle.checked;
     if (isSimpleView) {
       mainTitle.textContent = "Coffee Tracker";
@@ -506,7 +680,8 @@ document.addEventListener("DOMContentLoaded", () => {
       logDateInputSimple.value = logDateInput.value;
       updateSimpleSelectedDateDisplay(logDateInputSimple.value);
       populateSimpleCoffeeButtons();
-      loadAndDisplaySimpleCoffeeCount();
+      if (reload) loadAndDisplaySimpleCoffeeCount();
+      else simpleCoffeeCountSpan.textContent = dailyCoffees.length;
     } else {
       mainTitle.textContent = "Advanced Coffee Tracker";
       viewModeLabel.textContent = "Switch to Simple View";
@@ -514,7 +689,7 @@ document.addEventListener("DOMContentLoaded", () => {
       simpleViewWrapper.style.display = "none";
       logDateInput.value = logDateInputSimple.value;
       updateSelectedDateDisplays(logDateInput.value);
-      loadDailyLog();
+      if (reload) loadDailyLog();
     }
   }
 
@@ -528,31 +703,7 @@ document.addEventListener("DOMContentLoaded", () => {
           errData.error || `HTTP error! status: ${response.status}`
         );
       }
-      const typesFromServer = await response.json();
-
-      coffeeTypeDefinitions = {};
-      if (coffeeTypeSelect) {
-        coffeeTypeSelect.innerHTML =
-          '<option value="">-- Select Coffee Type --</option>';
-      }
-
-      typesFromServer.forEach((type) => {
-        coffeeTypeDefinitions[type.name] = {
-          cost: type.cost,
-          volume: type.volume,
-          currency_symbol: type.currency_symbol,
-        };
-        if (coffeeTypeSelect) {
-          const option = document.createElement("option");
-          option.value = type.name;
-          option.textContent = `${type.name} (${
-            type.currency_symbol
-          }${type.cost.toFixed(2)})`;
-          coffeeTypeSelect.appendChild(option);
-        }
-      });
-      populateSimpleCoffeeButtons(); // Re-populate simple buttons with current prices/symbols
-      // populateCustomPricesForm(); // This is called after loadUserCoffeePrices, not needed here again unless base coffees change
+      applyCoffeeTypes(await response.json());
     } catch (error) {
       console.error("Error fetching coffee definitions:", error);
       showMessage(error.message || "Could not load coffee types.", "error");
@@ -562,6 +713,31 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  function applyCoffeeTypes(typesFromServer) {
+    coffeeTypeDefinitions = {};
+    if (coffeeTypeSelect) {
+      coffeeTypeSelect.innerHTML =
+        '<option value="">-- Select Coffee Type --</option>';
+    }
+
+    typesFromServer.forEach((type) => {
+      coffeeTypeDefinitions[type.name] = {
+        cost: type.cost,
+        volume: type.volume,
+        currency_symbol: type.currency_symbol,
+      };
+      if (coffeeTypeSelect) {
+        const option = document.createElement("option");
+        option.value = type.name;
+        option.textContent = `${type.name} (${
+          type.currency_symbol
+        }${type.cost.toFixed(2)})`;
+        coffeeTypeSelect.appendChild(option);
+      }
+    });
+    populateSimpleCoffeeButtons(); // Re-populate simple buttons with current prices/symbols
+  }
+
   // ... (populateReportSelects, populateMonthYearInputs - same as before)
   const populateReportSelects = () => {
     if (!reportCoffeeTypeMonthlySelect || !reportCoffeeTypeYearlySelect) return;
@@ -662,7 +838,7 @@ document.addEventListener("DOMContentLoaded", () => {
           button.dataset.coffeeType = name;
           const imageName = coffeeImageMapping[name];
           let imageHtml = imageName
-            ? `<img src="/static/images/${imageName}" alt="${name} coffee" class="w-full h-3/5 object-contain rounded-md mb-1" onerror="this.onerror=null; this.src='https://placehold.co/80x60/E2E8F0/4A5568?text=%E2%98%95%EF%B8%8F'; this.alt='Coffee cup icon';">`
+            ? `<img src="${imageUrl(imageName)}" alt="${name} coffee" class="w-full h-3/5 object-contain rounded-md mb-1" onerror="this.onerror=null; this.src='https://placehold.co/80x60/E2E8F0/4A5568?text=%E2%98%95%EF%B8%8F'; this.alt='Coffee cup icon';">`
             : `<div class="w-full h-3/5 flex justify-center items-center text-3xl text-gray-300"><span>☕</span></div>`;
           const textHtml = `<div class="h-2/5 flex flex-col justify-center items-center w-full"><span class="block font-semibold leading-tight text-xs">${name}</span><span class="block text-[0.65rem] text-indigo-200 dark:text-indigo-300 mt-0.5">${
             def.volume || "?"
@@ -700,13 +876,27 @@ document.addEventListener("DOMContentLoaded", () => {
       const result = await response.json();
       if (!response.ok) throw new Error(result.error || "Failed to add coffee");
       showMessage(`${coffeeType} added for ${selectedDate}!`, "success");
-      await loadAndDisplaySimpleCoffeeCount();
+      applyAddedCoffee(selectedDate, result);
     } catch (error) {
       console.error("Error adding coffee (simple view):", error);
       showMessage(`Error: ${error.message}`, "error");
     }
   };
 
+  // Write responses carry the day's new count/total, so the log is patched locally
+  // instead of re-fetching the whole day.
+  const applyAddedCoffee = (entryDate, result) => {
+    if (entryDate === logDateInput.value) {
+      const { day_count, day_total_cost, ...entry } = result;
+      dailyCoffees.push(entry);
+      dailyCoffees.sort(compareEntries); // Same order as the server's day log.
+      renderDailyLogAndCosts();
+    }
+    dayCache.record({ op: "insert", date: entryDate, ...result });
+    if (simpleCoffeeCountSpan && entryDate === logDateInputSimple.value)
+      simpleCoffeeCountSpan.textContent = result.day_count;
+  };
+
   const loadAndDisplaySimpleCoffeeCount = async () => {
     // ... (same as previous version) ...
     if (!simpleCoffeeCountSpan || !logDateInputSimple) return;
@@ -716,10 +906,7 @@ document.addEventListener("DOMContentLoaded", () => {
     }
     updateSimpleSelectedDateDisplay(selectedDate);
     try {
-      const response = await fetch(`/api/coffees/${selectedDate}`);
-      const coffeesForDay = await response.json();
-      if (!response.ok)
-        throw new Error(coffeesForDay.error || "Failed to load count");
+      const coffeesForDay = await dayCache.getDay(selectedDate);
       simpleCoffeeCountSpan.textContent = coffeesForDay.length;
     } catch (error) {
       console.error("Error loading coffee count for simple view:", error);
@@ -767,10 +954,7 @@ document.addEventListener("DOMContentLoaded", () => {
     }
     updateSelectedDateDisplays(selectedDate);
     try {
-      const response = await fetch(`/api/coffees/${selectedDate}`);
-      const data = await response.json();
-      if (!response.ok) throw new Error(data.error || `Failed to load log`);
-      dailyCoffees = data;
+      dailyCoffees = await dayCache.getDay(selectedDate);
     } catch (error) {
       console.error("Error loading daily log:", error);
       showMessage(
@@ -879,8 +1063,11 @@ document.addEventListener("DOMContentLoaded", () => {
           result.message || `${coffeeType} entry deleted successfully!`,
           "success"
         );
-        await loadDailyLog();
-        await loadAndDisplaySimpleCoffeeCount();
+        dailyCoffees = dailyCoffees.filter((coffee) => coffee.id !== entryId);
+        renderDailyLogAndCosts();
+        dayCache.record({ op: "delete", id: entryId, date: result.entry_date });
+        if (simpleCoffeeCountSpan && result.entry_date === logDateInputSimple.value)
+          simpleCoffeeCountSpan.textContent = result.day_count;
       } catch (error) {
         console.error("Error deleting coffee entry:", error);
         showMessage(`Error: ${error.message}`, "error");
@@ -916,10 +1103,7 @@ document.addEventListener("DOMContentLoaded", () => {
         `${selectedCoffeeType} added for ${selectedDate}!`,
         "success"
       );
-      await loadDailyLog();
-      if (viewModeToggle.checked) {
-        await loadAndDisplaySimpleCoffeeCount();
-      }
+      applyAddedCoffee(selectedDate, result);
       coffeeTypeSelect.value = "";
     } catch (error) {
       console.error("Error adding coffee:", error);
@@ -946,10 +1130,11 @@ document.addEventListener("DOMContentLoaded", () => {
         if (!response.ok)
           throw new Error(result.error || `Failed to clear log`);
         showMessage(`Log for ${selectedDate} cleared.`, "success");
-        await loadDailyLog();
-        if (viewModeToggle.checked) {
-          await loadAndDisplaySimpleCoffeeCount();
-        }
+        dailyCoffees = [];
+        renderDailyLogAndCosts();
+        dayCache.record({ op: "clear", date: selectedDate });
+        if (simpleCoffeeCountSpan && selectedDate === logDateInputSimple.value)
+          simpleCoffeeCountSpan.textContent = result.day_count;
       } catch (error) {
         console.error("Error clearing log:", error);
         showMessage(`Error clearing log: ${error.message}`, "error");
@@ -1066,6 +1251,15 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   };
 
+  // Both yearly views read the same per-year summary; the URL does not vary
+  // with the type filter so the browser revalidates one cached copy (ETag).
+  const fetchYearSummary = async (year) => {
+    const response = await fetch(`/api/reports/year-summary?year=${year}`);
+    const summary = await response.json();
+    if (!response.ok) throw new Error(summary.error || `Report error`);
+    return summary;
+  };
+
   const handleGenerateYearlyReport = async () => {
     // ... (Update to use reportData.currency_symbol)
     if (
@@ -1082,13 +1276,16 @@ document.addEventListener("DOMContentLoaded", () => {
       return;
     }
     try {
-      const response = await fetch(
-        `/api/reports/yearly?year=${year}&type=${encodeURIComponent(
-          typeFilter
-        )}`
-      );
-      const reportData = await response.json();
-      if (!response.ok) throw new Error(reportData.error || `Report error`);
+      const summary = await fetchYearSummary(year);
+      const selected = summary.by_type[typeFilter] || { count: 0, cost: 0 };
+      const reportData = {
+        currency_symbol: summary.currency_symbol,
+        coffee_type_filter: typeFilter,
+        total_coffees:
+          typeFilter === "All" ? summary.total_coffees : selected.count,
+        total_cost: typeFilter === "All" ? summary.total_cost : selected.cost,
+        breakdown_by_type: typeFilter === "All" ? summary.by_type : {},
+      };
       const symbol =
         reportData.currency_symbol ||
         currentUserSettings.currency_symbol ||
@@ -1148,9 +1345,7 @@ document.addEventListener("DOMContentLoaded", () => {
       return;
     }
     try {
-      const response = await fetch(`/api/fun-facts/yearly-volume?year=${year}`);
-      const factData = await response.json();
-      if (!response.ok) throw new Error(factData.error || `Fun fact error`);
+      const factData = await fetchYearSummary(year);
       funFactYearDisplaySpan.textContent = factData.year;
       funFactVolumeSpan.textContent = factData.total_volume_ml.toLocaleString();
       funFactDisplayArea.style.display = "block";
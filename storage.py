@@ -0,0 +1,562 @@
+"""Storage backends behind the user, entry and report routes.
+
+Routes talk to a ``Repository``; each method is one unit of work (its own
+connection checkout and transaction) and returns plain Python values: dates
+and times as ``date``/``time``, counts as ``int`` and money as ``float``.
+Backend failures surface as ``StorageError`` so routes don't depend on a
+driver's exception hierarchy.
+
+``STORAGE_BACKEND`` selects the implementation:
+
+* ``postgres`` (default) -- ``PostgresRepository`` over the pooled psycopg2
+  connections, reading the report rollups.
+* ``sqlite`` -- ``sqlite_storage.SQLiteRepository``, an embedded database file
+  at ``SQLITE_PATH`` for single-site installs and laptops without Postgres.
+
+Bulk import, export, the async server and the schema/rollup CLI commands
+remain Postgres-only. ``conformance.py`` exercises any implementation against
+the contract described here (tests/test_storage_conformance.py runs it for
+both backends).
+"""
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+
+import psycopg2
+import psycopg2.extras
+
+import db
+import rollups
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', "postgres")
+SQLITE_PATH = os.environ.get('SQLITE_PATH', "coffee_tracker.sqlite3")
+GRANULARITIES = ('day', 'week', 'month')
+
+
+class StorageError(Exception):
+    """A storage backend failed (connection, constraint, query)."""
+
+
+class WriteOutcomeUnknown(StorageError):
+    """A write neither committed nor failed in time; it may still commit, so don't retry blindly."""
+
+
+def bucket_start(d, granularity):
+    """First day of the day/ISO-week/month bucket containing d."""
+    if granularity == 'week':
+        return d - timedelta(days=d.weekday())
+    if granularity == 'month':
+        return d.replace(day=1)
+    return d
+
+
+def bucket_starts(date_from, date_to, granularity):
+    """Every bucket start from the one containing date_from through date_to."""
+    current = bucket_start(date_from, granularity)
+    while current <= date_to:
+        yield current
+        if granularity == 'month':
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            current += timedelta(days=7 if granularity == 'week' else 1)
+
+
+CHANGE_OPS = {'I': 'insert', 'D': 'delete', 'R': 'reset'}
+
+
+def feed_page(rows, cursor, head, pruned_through=0):
+    """changes_since's result from (seq, op, entry_id, entry_date, coffee_type, entry_time, cost) rows."""
+    head = max(head, pruned_through)  # A cursor below the horizon would reset forever.
+    if cursor is None or cursor < pruned_through or cursor > head or any(row[1] == 'R' for row in rows):
+        return [], head, True
+    changes = [{"seq": seq, "op": CHANGE_OPS[op], "id": entry_id, "entry_date": entry_date,
+                "coffee_type": coffee_type, "entry_time": entry_time, "cost": float(cost)}
+               for seq, op, entry_id, entry_date, coffee_type, entry_time, cost in rows]
+    return changes, changes[-1]['seq'] if changes else cursor, False
+
+
+class Repository:
+    """The contract every storage backend implements."""
+
+    backend = None
+
+    # --- Users ---
+    def find_user(self, username):
+        """{id, username, password_hash, currency_code, currency_symbol} or None."""
+        raise NotImplementedError
+
+    def create_user(self, username, password_hash, currency_code='EUR', currency_symbol='€'):
+        """Returns the new user's id, or None when the username is taken."""
+        raise NotImplementedError
+
+    def set_password_hash(self, user_id, password_hash):
+        raise NotImplementedError
+
+    def delete_user(self, user_id):
+        """Removes the user with all their entries and prices."""
+        raise NotImplementedError
+
+    def user_profile(self, user_id):
+        """{currency_code, currency_symbol, prices: {type: price}} or None for unknown users."""
+        raise NotImplementedError
+
+    def update_currency(self, user_id, currency_code, currency_symbol):
+        """Returns the stored (currency_code, currency_symbol), or None for unknown users."""
+        raise NotImplementedError
+
+    def replace_prices(self, user_id, prices):
+        """Replaces all custom prices with {type: price} (empty clears them)."""
+        raise NotImplementedError
+
+    def data_version(self, user_id):
+        """Counter that changes on every entry, price or currency write; None for unknown users."""
+        raise NotImplementedError
+
+    # --- Entries ---
+    def day_entries(self, user_id, entry_date):
+        """[{id, coffee_type, entry_time, cost}] for one day, ordered by time."""
+        raise NotImplementedError
+
+    def add_entry(self, user_id, coffee_type, entry_date, entry_time, cost):
+        """Returns (entry_id, day_count, day_total_cost) after the insert."""
+        raise NotImplementedError
+
+    def clear_day(self, user_id, entry_date):
+        """Deletes all of one day's entries; returns how many were deleted."""
+        raise NotImplementedError
+
+    def delete_entry(self, user_id, entry_id):
+        """Returns (entry_date, day_count, day_total_cost) after the delete, or None if not found."""
+        raise NotImplementedError
+
+    # --- Change feed ---
+    def changes_since(self, user_id, cursor, limit):
+        """(changes, cursor, reset): the user's entry inserts/deletes after cursor, oldest first.
+
+        changes is at most `limit` [{seq, op ('insert'/'delete'), id, entry_date,
+        coffee_type, entry_time, cost}]; the returned cursor is the last seq
+        listed (unchanged when there is nothing new). reset is True, with no
+        changes and the user's current position as cursor, when the changes after
+        cursor can't be listed: cursor is None, pruned, ahead of the feed, or
+        followed by an archive of the user's entries.
+        """
+        raise NotImplementedError
+
+    def prune_changes(self, older_than):
+        """Deletes change feed rows recorded before the older_than datetime; returns how many."""
+        raise NotImplementedError
+
+    def period_changed(self, user_id, since, start, end):
+        """(head, changed): the user's feed position (as in changes_since), and whether a change
+        after seq `since` touched [start, end).
+
+        changed is True when since is None or pruned, or an archive reset followed it.
+        Read through the report connection (report_cache.py validates results with it).
+        """
+        raise NotImplementedError
+
+    # --- Reports ---
+    def type_breakdown(self, user_id, start, end, type_filter='All'):
+        """[{coffee_type, count, total_cost}] within [start, end), ordered by type.
+
+        start/end must be month-aligned (see app.period_bounds).
+        """
+        raise NotImplementedError
+
+    def year_activity(self, user_id, start, end, type_filter='All'):
+        """[{entry_date, hour, coffee_type, count, cost, volume_ml}] within [start, end).
+
+        One row per (date, hour of entry_time, type); volume_ml is count times
+        the coffee_catalog volume (0 for types missing from the catalog).
+        Input for reports.build_year_summary.
+        """
+        raise NotImplementedError
+
+    def range_series(self, user_id, date_from, date_to, granularity, volumes, type_filter='All'):
+        """Zero-filled [{period, count, cost, volume_ml}] for every bucket over [date_from, date_to].
+
+        volumes maps coffee type to ml per cup; types missing from it count as 0 ml.
+        """
+        raise NotImplementedError
+
+
+class PostgresRepository(Repository):
+    """Postgres backend; reports read the coffee_*_rollups tables kept by rollups.py."""
+
+    backend = "postgres"
+
+    def __init__(self, connect=None, group_committer=None, connect_read=None, on_data_write=None):
+        # connect() must return a pooled connection whose close() hands it back.
+        self._connect = connect or db.checkout
+        # Used by the report reads (data_version, type_breakdown, year_activity,
+        # range_series); app.py points it at the read replica when one is usable.
+        self._connect_read = connect_read or self._connect
+        # Optional group_commit.GroupCommitter that batches add_entry calls.
+        self.group_committer = group_committer
+        # Optional on_data_write(conn, user_ids), called on the primary connection
+        # right after a commit that changed those users' entries, prices or
+        # settings (app.py records the WAL position for replica read-your-writes).
+        self.on_data_write = on_data_write
+
+    @contextmanager
+    def _connection(self, read_only=False, written_by=None):
+        try:
+            conn = self._connect_read() if read_only else self._connect()
+        except psycopg2.Error as e:
+            raise StorageError(str(e)) from e
+        try:
+            yield conn
+        except psycopg2.Error as e:
+            conn.rollback()
+            raise StorageError(str(e)) from e
+        else:
+            if written_by is not None and self.on_data_write is not None:
+                self.on_data_write(conn, [written_by])
+        finally:
+            conn.close()
+
+    # --- Users ---
+    def find_user(self, username):
+        with self._connection() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("SELECT id, username, password_hash, currency_code, currency_symbol "
+                        "FROM users WHERE username = %s", (username,))
+            row = cur.fetchone()
+            cur.close()
+        return dict(row) if row else None
+
+    def create_user(self, username, password_hash, currency_code='EUR', currency_symbol='€'):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO users (username, password_hash, currency_code, currency_symbol) "
+                "VALUES (%s, %s, %s, %s) ON CONFLICT (username) DO NOTHING RETURNING id",
+                (username, password_hash, currency_code, currency_symbol)
+            )
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+        return row[0] if row else None
+
+    def set_password_hash(self, user_id, password_hash):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (password_hash, user_id))
+            conn.commit()
+            cur.close()
+
+    def delete_user(self, user_id):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            # Rollups have no FK to users; clear them alongside the cascade.
+            cur.execute(f"DELETE FROM {rollups.DAILY_TABLE} WHERE user_id = %s", (user_id,))
+            cur.execute(f"DELETE FROM {rollups.MONTHLY_TABLE} WHERE user_id = %s", (user_id,))
+            cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            conn.commit()
+            cur.close()
+
+    def user_profile(self, user_id):
+        with self._connection() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cur.execute(
+                "SELECT u.currency_code, u.currency_symbol, p.coffee_type, p.price "
+                "FROM users u LEFT JOIN user_coffee_prices p ON p.user_id = u.id "
+                "WHERE u.id = %s",
+                (user_id,)
+            )
+            rows = cur.fetchall()
+            cur.close()
+        if not rows:
+            return None
+        return {
+            "currency_code": rows[0]['currency_code'],
+            "currency_symbol": rows[0]['currency_symbol'],
+            "prices": {row['coffee_type']: float(row['price']) for row in rows if row['coffee_type'] is not None},
+        }
+
+    def update_currency(self, user_id, currency_code, currency_symbol):
+        with self._connection(written_by=user_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE users SET currency_code = %s, currency_symbol = %s WHERE id = %s "
+                "RETURNING currency_code, currency_symbol",
+                (currency_code, currency_symbol, user_id)
+            )
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+        return tuple(row) if row else None
+
+    def replace_prices(self, user_id, prices):
+        with self._connection(written_by=user_id) as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM user_coffee_prices WHERE user_id = %s", (user_id,))
+            if prices:
+                psycopg2.extras.execute_values(
+                    cur, "INSERT INTO user_coffee_prices (user_id, coffee_type, price) VALUES %s",
+                    [(user_id, coffee_type, price) for coffee_type, price in prices.items()]
+                )
+            conn.commit()
+            cur.close()
+
+    def data_version(self, user_id):
+        with self._connection(read_only=True) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT data_version FROM users WHERE id = %s", (user_id,))
+            row = cur.fetchone()
+            cur.close()
+        return row[0] if row else None
+
+    # --- Entries ---
+    @staticmethod
+    def day_entries_query(user_id, entry_date):
+        """SQL and params behind day_entries (EXPLAINed by tests/test_report_plans.py)."""
+        return ("SELECT id, coffee_type, entry_time, cost FROM coffee_entries "
+                "WHERE user_id = %s AND entry_date = %s ORDER BY entry_time, id", (user_id, entry_date))
+
+    def day_entries(self, user_id, entry_date):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(*self.day_entries_query(user_id, entry_date))
+            rows = cur.fetchall()
+            cur.close()
+        return [{"id": entry_id, "coffee_type": coffee_type, "entry_time": entry_time, "cost": float(cost)}
+                for entry_id, coffee_type, entry_time, cost in rows]
+
+    @staticmethod
+    def _day_totals(cur, user_id, entry_date):
+        cur.execute(
+            f"SELECT COALESCE(SUM(entry_count), 0), COALESCE(SUM(total_cost), 0) "
+            f"FROM {rollups.DAILY_TABLE} WHERE user_id = %s AND entry_date = %s",
+            (user_id, entry_date)
+        )
+        count, total_cost = cur.fetchone()
+        return int(count), round(float(total_cost), 2)
+
+    def add_entry(self, user_id, coffee_type, entry_date, entry_time, cost):
+        if self.group_committer is not None:
+            return self.group_committer.submit(user_id, coffee_type, entry_date, entry_time, cost)
+        with self._connection(written_by=user_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO coffee_entries (user_id, coffee_type, entry_date, entry_time, cost) "
+                "VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                (user_id, coffee_type, entry_date, entry_time, cost)
+            )
+            entry_id = cur.fetchone()[0]
+            rollups.record_insert(cur, user_id, coffee_type, entry_date, cost)
+            day_count, day_total_cost = self._day_totals(cur, user_id, entry_date)
+            conn.commit()
+            cur.close()
+        return entry_id, day_count, day_total_cost
+
+    def clear_day(self, user_id, entry_date):
+        with self._connection(written_by=user_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "DELETE FROM coffee_entries WHERE user_id = %s AND entry_date = %s "
+                "RETURNING coffee_type, entry_date, cost",
+                (user_id, entry_date)
+            )
+            deleted = cur.fetchall()
+            rollups.record_deletes(cur, user_id, deleted)
+            conn.commit()
+            cur.close()
+        return len(deleted)
+
+    def delete_entry(self, user_id, entry_id):
+        with self._connection(written_by=user_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "DELETE FROM coffee_entries WHERE id = %s AND user_id = %s "
+                "RETURNING coffee_type, entry_date, cost",
+                (entry_id, user_id)
+            )
+            deleted = cur.fetchall()
+            if not deleted:
+                cur.close()
+                conn.rollback()
+                return None
+            rollups.record_deletes(cur, user_id, deleted)
+            entry_date = deleted[0][1]
+            day_count, day_total_cost = self._day_totals(cur, user_id, entry_date)
+            conn.commit()
+            cur.close()
+        return entry_date, day_count, day_total_cost
+
+    # --- Change feed ---
+    def changes_since(self, user_id, cursor, limit):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT (SELECT pruned_through FROM coffee_entry_changes_horizon), "
+                "(SELECT COALESCE(MAX(seq), 0) FROM coffee_entry_changes WHERE user_id = %s)",
+                (user_id,)
+            )
+            pruned_through, head = cur.fetchone()
+            rows = []
+            if cursor is not None and pruned_through <= cursor <= max(head, pruned_through):
+                cur.execute(
+                    "SELECT seq, op, entry_id, entry_date, coffee_type, entry_time, cost FROM coffee_entry_changes "
+                    "WHERE user_id = %s AND seq > %s ORDER BY seq LIMIT %s",
+                    (user_id, cursor, limit)
+                )
+                rows = cur.fetchall()
+            conn.rollback()
+            cur.close()
+        return feed_page(rows, cursor, head, pruned_through)
+
+    def prune_changes(self, older_than):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            # Raising the horizon first makes readers with older cursors reset rather than miss rows.
+            cur.execute(
+                "UPDATE coffee_entry_changes_horizon SET pruned_through = GREATEST(pruned_through, "
+                "(SELECT COALESCE(MAX(seq), 0) FROM coffee_entry_changes WHERE changed_at < %s)) "
+                "RETURNING pruned_through",
+                (older_than,)
+            )
+            pruned_through = cur.fetchone()[0]
+            cur.execute("DELETE FROM coffee_entry_changes WHERE seq <= %s", (pruned_through,))
+            deleted = cur.rowcount
+            conn.commit()
+            cur.close()
+        return deleted
+
+    def period_changed(self, user_id, since, start, end):
+        with self._connection(read_only=True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT (SELECT COALESCE(MAX(seq), 0) FROM coffee_entry_changes WHERE user_id = %(user_id)s), "
+                "(SELECT pruned_through FROM coffee_entry_changes_horizon), "
+                "EXISTS (SELECT 1 FROM coffee_entry_changes WHERE user_id = %(user_id)s AND seq > %(since)s "
+                "AND (op = 'R' OR (entry_date >= %(start)s AND entry_date < %(end)s)))",
+                {"user_id": user_id, "since": since or 0, "start": start, "end": end}
+            )
+            head, pruned_through, touched = cur.fetchone()
+            cur.close()
+        return max(head, pruned_through), since is None or since < pruned_through or touched
+
+    # --- Reports ---
+    @staticmethod
+    def type_breakdown_query(user_id, start, end, type_filter='All'):
+        """SQL and params behind type_breakdown (EXPLAINed by tests/test_report_plans.py).
+
+        Reads coffee_monthly_rollups, so a month costs one row per type and a
+        year at most twelve, however many entries were logged.
+        """
+        sql_query = f"""
+            SELECT coffee_type, SUM(entry_count) as count, SUM(total_cost) as total_cost
+            FROM {rollups.MONTHLY_TABLE}
+            WHERE user_id = %s AND month >= %s AND month < %s
+        """
+        params = [user_id, start, end]
+        if type_filter != 'All':
+            sql_query += " AND coffee_type = %s"
+            params.append(type_filter)
+        sql_query += " GROUP BY coffee_type ORDER BY coffee_type;"
+        return sql_query, tuple(params)
+
+    def type_breakdown(self, user_id, start, end, type_filter='All'):
+        with self._connection(read_only=True) as conn:
+            cur = conn.cursor()
+            cur.execute(*self.type_breakdown_query(user_id, start, end, type_filter))
+            rows = cur.fetchall()
+            cur.close()
+        return [{"coffee_type": coffee_type, "count": int(count), "total_cost": float(total_cost)}
+                for coffee_type, count, total_cost in rows]
+
+    @staticmethod
+    def year_activity_query(user_id, start, end, type_filter='All'):
+        """SQL and params behind year_activity (EXPLAINed by tests/test_report_plans.py)."""
+        # Live entries: index-only scan of idx_coffee_entries_user_date in the
+        # partitions overlapping [start, end). Archived years come from
+        # coffee_archived_activity (see partitions.py).
+        type_clause = "" if type_filter == 'All' else " AND coffee_type = %(type)s"
+        sql_query = f"""
+            SELECT a.entry_date, a.hour, a.coffee_type, SUM(a.count), SUM(a.cost),
+                   SUM(a.count) * COALESCE(c.volume_ml, 0)
+            FROM (
+                SELECT entry_date, EXTRACT(HOUR FROM entry_time)::int AS hour, coffee_type,
+                       COUNT(*) AS count, SUM(cost) AS cost
+                FROM coffee_entries
+                WHERE user_id = %(user_id)s AND entry_date >= %(start)s AND entry_date < %(end)s{type_clause}
+                GROUP BY 1, 2, 3
+                UNION ALL
+                SELECT entry_date, hour, coffee_type, entry_count, total_cost
+                FROM coffee_archived_activity
+                WHERE user_id = %(user_id)s AND entry_date >= %(start)s AND entry_date < %(end)s{type_clause}
+            ) a
+            LEFT JOIN coffee_catalog c ON c.coffee_type = a.coffee_type
+            GROUP BY a.entry_date, a.hour, a.coffee_type, c.volume_ml
+        """
+        params = {"user_id": user_id, "start": start, "end": end, "type": type_filter}
+        return sql_query, params
+
+    def year_activity(self, user_id, start, end, type_filter='All'):
+        with self._connection(read_only=True) as conn:
+            cur = conn.cursor()
+            cur.execute(*self.year_activity_query(user_id, start, end, type_filter))
+            rows = cur.fetchall()
+            cur.close()
+        return [{"entry_date": entry_date, "hour": hour, "coffee_type": coffee_type, "count": int(count),
+                 "cost": float(cost), "volume_ml": int(volume_ml)}
+                for entry_date, hour, coffee_type, count, cost, volume_ml in rows]
+
+    @staticmethod
+    def range_series_query(user_id, date_from, date_to, granularity, volumes, type_filter='All'):
+        """SQL and params behind range_series (EXPLAINed by tests/test_report_plans.py)."""
+        # Empty buckets are zero-filled by generate_series in the same grouped
+        # query over the daily rollups, so the cost grows with buckets only.
+        params = {"user_id": user_id, "granularity": granularity, "date_from": date_from,
+                  "date_to": date_to, "date_to_excl": date_to + timedelta(days=1),
+                  "types": list(volumes), "volumes": list(volumes.values()),
+                  "type_filter": type_filter}
+        sql_query = f"""
+            WITH buckets AS (
+                SELECT generate_series(date_trunc(%(granularity)s, %(date_from)s::timestamp),
+                                       %(date_to)s::timestamp,
+                                       ('1 ' || %(granularity)s)::interval)::date AS period
+            ), totals AS (
+                SELECT date_trunc(%(granularity)s, r.entry_date::timestamp)::date AS period,
+                       SUM(r.entry_count) AS count, SUM(r.total_cost) AS cost,
+                       SUM(r.entry_count * COALESCE(v.volume_ml, 0)) AS volume_ml
+                FROM {rollups.DAILY_TABLE} r
+                LEFT JOIN unnest(%(types)s::text[], %(volumes)s::int[]) AS v(coffee_type, volume_ml)
+                     ON v.coffee_type = r.coffee_type
+                WHERE r.user_id = %(user_id)s AND r.entry_date >= %(date_from)s AND r.entry_date < %(date_to_excl)s
+        """
+        if type_filter != 'All':
+            sql_query += " AND r.coffee_type = %(type_filter)s"
+        sql_query += """
+                GROUP BY 1
+            )
+            SELECT b.period, COALESCE(t.count, 0), COALESCE(t.cost, 0), COALESCE(t.volume_ml, 0)
+            FROM buckets b LEFT JOIN totals t USING (period)
+            ORDER BY b.period
+        """
+        return sql_query, params
+
+    def range_series(self, user_id, date_from, date_to, granularity, volumes, type_filter='All'):
+        with self._connection(read_only=True) as conn:
+            cur = conn.cursor()
+            cur.execute(*self.range_series_query(user_id, date_from, date_to, granularity, volumes, type_filter))
+            rows = cur.fetchall()
+            cur.close()
+        return [{"period": period, "count": int(count), "cost": round(float(cost), 2), "volume_ml": int(volume_ml)}
+                for period, count, cost, volume_ml in rows]
+
+
+def from_config(connect=None, connect_read=None, on_data_write=None):
+    """The Repository selected by STORAGE_BACKEND.
+
+    on_data_write is only called by the Postgres backend (see PostgresRepository).
+    """
+    if STORAGE_BACKEND == "postgres":
+        import group_commit
+        committer = group_commit.GroupCommitter(on_commit=on_data_write) if group_commit.GROUP_COMMIT else None
+        return PostgresRepository(connect, committer, connect_read, on_data_write)
+    if STORAGE_BACKEND == "sqlite":
+        import sqlite_storage
+        return sqlite_storage.SQLiteRepository(SQLITE_PATH)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND!r} (expected 'postgres' or 'sqlite')")
@@ -0,0 +1,66 @@
+"""Shared fixtures. The Flask app is imported on the SQLite backend, in a
+throwaway database file, so the route tests run without a Postgres server.
+Postgres tests use the server named by the DB_* variables (as app.py does)
+and are skipped when it can't be reached."""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+_SQLITE_DIR = tempfile.mkdtemp(prefix="coffee-tracker-tests-")
+os.environ.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(_SQLITE_DIR, "app.sqlite3"),
+                  PASSWORD_HASH_WORKERS="0")
+for _name in ('DB_AUTO_MIGRATE', 'DB_REPLICA_DSN', 'GROUP_COMMIT', 'REPORT_CACHE_PATH'):
+    os.environ.pop(_name, None)
+
+
+@pytest.fixture(scope="session")
+def flask_app():
+    import app as coffee_app
+    coffee_app.app.config.update(TESTING=True)
+    return coffee_app.app
+
+
+@pytest.fixture
+def client(flask_app):
+    """A test client logged in as a fresh user."""
+    client = flask_app.test_client()
+    username = f"test_{uuid.uuid4().hex[:12]}"
+    client.post('/register', data={"username": username, "password": "secret1", "confirm_password": "secret1"})
+    response = client.post('/login', data={"username": username, "password": "secret1"})
+    assert response.status_code == 302 and response.headers['Location'].endswith('/coffee')
+    return client
+
+
+@pytest.fixture(scope="session")
+def postgres():
+    """Points db's pool at the DB_* server with all migrations applied; skips without one."""
+    import psycopg2
+
+    import db
+    import migrate
+    connect_kwargs = dict(
+        dbname=os.environ.get('DB_NAME', "coffee_tracker_db"), user=os.environ.get('DB_USER', "postgres"),
+        password=os.environ.get('DB_PASSWORD', "postgres"), host=os.environ.get('DB_HOST', "localhost"),
+        port=os.environ.get('DB_PORT', "5432"),
+    )
+    try:
+        conn = psycopg2.connect(connect_timeout=3, **connect_kwargs)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL not available: {e}")
+    try:
+        migrate.apply_migrations(conn)
+    finally:
+        conn.close()
+    db.configure(**connect_kwargs)
+    yield
+    db.close_pool()
+
+
+@pytest.fixture
+def pg_conn(postgres):
+    import db
+    conn = db.checkout()
+    yield conn
+    conn.close()
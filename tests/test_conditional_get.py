@@ -0,0 +1,77 @@
+"""ETag/304 handling of etag_by_user_version: every mutating route must make
+previously issued tags stale."""
+DAY = "2024-02-28"
+DAY_LOG = f"/api/coffees/{DAY}"
+COFFEE_TYPES = "/api/coffee-types"
+MONTHLY = "/api/reports/monthly?year=2024&month=2"
+
+
+def current_etag(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    return response.headers['ETag']
+
+
+def assert_stale(client, url, etag):
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def add_coffee(client, coffee_type="Roma", entry_time="8:30 AM"):
+    response = client.post(DAY_LOG, json={"type": coffee_type, "time": entry_time})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_unchanged_resource_returns_304(client):
+    add_coffee(client)
+    for url in (DAY_LOG, COFFEE_TYPES, MONTHLY):
+        etag = current_etag(client, url)
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        assert response.data == b""
+
+
+def test_add_coffee_invalidates(client):
+    day_log, monthly = current_etag(client, DAY_LOG), current_etag(client, MONTHLY)
+    add_coffee(client)
+    assert_stale(client, DAY_LOG, day_log)
+    assert_stale(client, MONTHLY, monthly)
+
+
+def test_delete_entry_invalidates(client):
+    entry_id = add_coffee(client)
+    day_log, monthly = current_etag(client, DAY_LOG), current_etag(client, MONTHLY)
+    assert client.delete(f"/api/coffee_entry/{entry_id}").status_code == 200
+    assert_stale(client, DAY_LOG, day_log)
+    assert_stale(client, MONTHLY, monthly)
+
+
+def test_clear_day_invalidates(client):
+    add_coffee(client)
+    add_coffee(client, "Vienna", "2:05 PM")
+    day_log, monthly = current_etag(client, DAY_LOG), current_etag(client, MONTHLY)
+    assert client.delete(DAY_LOG).status_code == 200
+    assert_stale(client, DAY_LOG, day_log)
+    assert_stale(client, MONTHLY, monthly)
+
+
+def test_update_settings_invalidates(client):
+    add_coffee(client)
+    day_log, coffee_types = current_etag(client, DAY_LOG), current_etag(client, COFFEE_TYPES)
+    response = client.put("/api/user/settings", json={"currency_code": "USD", "currency_symbol": "$"})
+    assert response.status_code == 200
+    assert_stale(client, DAY_LOG, day_log)
+    assert_stale(client, COFFEE_TYPES, coffee_types)
+    assert client.get(COFFEE_TYPES).get_json()[0]['currency_symbol'] == "$"
+
+
+def test_update_prices_invalidates(client):
+    coffee_types = current_etag(client, COFFEE_TYPES)
+    assert client.post("/api/user/coffee_prices", json={"Roma": "0.65"}).status_code == 200
+    assert_stale(client, COFFEE_TYPES, coffee_types)
+    prices = {t['name']: t['cost'] for t in client.get(COFFEE_TYPES).get_json()}
+    assert prices['Roma'] == 0.65
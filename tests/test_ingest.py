@@ -0,0 +1,32 @@
+"""Bulk ingest into archived years: their import keys were archived with the
+rows, so the entries must be rejected rather than inserted again."""
+import uuid
+
+import ingest
+
+ARCHIVED_YEAR = 2001
+COSTS = {"Roma": 0.5}
+
+
+def test_archived_year_is_rejected(pg_conn):
+    cur = pg_conn.cursor()
+    cur.execute("INSERT INTO users (username, password_hash) VALUES (%s, 'x') RETURNING id",
+                (f"test_{uuid.uuid4().hex[:12]}",))
+    user_id = cur.fetchone()[0]
+    cur.execute(
+        "INSERT INTO coffee_entry_archives (partition_name, period_start, period_end, row_count, archive_path, sha256) "
+        "VALUES (%s, %s, %s, 0, '', %s)",
+        (f"coffee_entries_y{ARCHIVED_YEAR}", f"{ARCHIVED_YEAR}-01-01", f"{ARCHIVED_YEAR + 1}-01-01", "0" * 64)
+    )
+    pg_conn.commit()
+    try:
+        log = {f"{ARCHIVED_YEAR}-03-01": [{"type": "Roma", "time": "8:00 AM"}],
+               f"{ARCHIVED_YEAR + 1}-03-01": [{"type": "Roma", "time": "8:00 AM"}]}
+        result = ingest.ingest_entries(pg_conn, user_id, ingest.legacy_log_entries(log), COSTS)
+        assert result['inserted'] == 1
+        assert [error['entry']['date'] for error in result['errors']] == [f"{ARCHIVED_YEAR}-03-01"]
+    finally:
+        cur.execute("DELETE FROM coffee_entry_archives WHERE partition_name = %s", (f"coffee_entries_y{ARCHIVED_YEAR}",))
+        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        pg_conn.commit()
+        cur.close()
@@ -0,0 +1,68 @@
+"""EXPLAIN checks: the date-range report queries must be index range scans.
+
+Sequential scans are disabled while planning (see migrate.check_index_usage),
+so a non-sargable predicate shows up as a missing ``Index Cond`` on the date
+column even on a nearly empty development database.
+"""
+from datetime import date, timedelta
+
+import pytest
+
+import migrate
+import storage
+
+Repo = storage.PostgresRepository
+TODAY = date.today()
+YEAR = (date(TODAY.year, 1, 1), date(TODAY.year + 1, 1, 1))
+VOLUMES = {"Roma": 40, "Vienna": 90}
+MONTH = (TODAY.replace(day=1), (TODAY.replace(day=28) + timedelta(days=4)).replace(day=1))
+
+
+@pytest.fixture
+def entry_indexes(pg_conn):
+    """{index name: index on coffee_entries} for coffee_entries' indexes and their per-partition copies."""
+    cur = pg_conn.cursor()
+    cur.execute(
+        "SELECT c.relname, c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = 'coffee_entries'::regclass "
+        "UNION ALL "
+        "SELECT c.relname, p.relname FROM pg_inherits h JOIN pg_class c ON c.oid = h.inhrelid "
+        "JOIN pg_class p ON p.oid = h.inhparent JOIN pg_index i ON i.indexrelid = p.oid "
+        "WHERE i.indrelid = 'coffee_entries'::regclass"
+    )
+    indexes = dict(cur.fetchall())
+    cur.close()
+    pg_conn.rollback()
+    return indexes
+
+
+USER_DATE = {"idx_coffee_entries_user_date"}
+
+
+@pytest.mark.parametrize("label, query, expected_indexes", [
+    ("day log", Repo.day_entries_query(0, TODAY), USER_DATE),
+    ("year activity", Repo.year_activity_query(0, *YEAR), USER_DATE),
+    # Either index has the date range as an index condition after the type.
+    ("year activity (type filter)", Repo.year_activity_query(0, *YEAR, 'Vienna'),
+     USER_DATE | {"idx_coffee_entries_user_type_date"}),
+])
+def test_entry_date_range_uses_index(pg_conn, entry_indexes, label, query, expected_indexes):
+    result = migrate.check_index_usage(pg_conn, *query)
+    entry_scans = [scan for scan in result['index_scans'] if scan['index'] in entry_indexes]
+    assert entry_scans, f"{label}: coffee_entries is not read through an index ({result['node_types']})"
+    for scan in entry_scans:
+        assert entry_indexes[scan['index']] in expected_indexes, f"{label}: {scan}"
+        assert "entry_date" in scan['index_cond'], f"{label}: {scan}"
+    assert not [name for name in result['seq_scans'] if name.startswith("coffee_entries")], label
+
+
+@pytest.mark.parametrize("label, query, indexed_column", [
+    ("range report", Repo.range_series_query(0, *MONTH, 'day', VOLUMES), "entry_date"),
+    ("monthly", Repo.type_breakdown_query(0, *MONTH), "month"),
+    ("monthly (type filter)", Repo.type_breakdown_query(0, *MONTH, 'Vienna'), "month"),
+    ("yearly", Repo.type_breakdown_query(0, *YEAR), "month"),
+])
+def test_rollup_range_uses_index(pg_conn, label, query, indexed_column):
+    result = migrate.check_index_usage(pg_conn, *query, indexed_column=indexed_column)
+    assert result['uses_index'], f"{label}: {' > '.join(result['node_types'])} {result['indexes']}"
+    assert not result['seq_scans'], label
@@ -0,0 +1,20 @@
+"""Runs the repository conformance checks (conformance.py) against every backend,
+so the SQLite and Postgres implementations can't drift apart unnoticed."""
+import pytest
+
+import conformance
+import sqlite_storage
+import storage
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def repo(request, tmp_path):
+    if request.param == "sqlite":
+        return sqlite_storage.SQLiteRepository(str(tmp_path / "conformance.sqlite3"))
+    request.getfixturevalue("postgres")
+    return storage.PostgresRepository()
+
+
+def test_repository_conforms(repo):
+    failures = conformance.check_repository(repo)
+    assert not failures, f"{repo.backend} backend:\n" + "\n".join(failures)